@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import numpy as np
+
+from audio_pipeline.vad import SpeechSegment
+
+logger = logging.getLogger("CallimacusAudio")
+
+OVERLOAD_POLICIES = ("drop_oldest", "merge", "downgrade")
+
+#-----------------------
+# CONFIGURATION
+#-----------------------
+
+@dataclass
+class BackpressureConfig:
+    """Queue bounds and overload behaviour ('backpressure' section of config.json)."""
+    max_audio_chunks: int = 64          # ~16 s of 4096-sample chunks between the socket and the VAD
+    max_messages: int = 256             # Outgoing JSON messages waiting for a slow client
+    max_backlog_segments: int = 4       # Closed segments waiting for a decode slot before the policy kicks in
+    max_inflight: int = 2               # Segments handed to the shared scheduler at once
+    policy: str = "drop_oldest"         # drop_oldest | merge | downgrade
+    lag_warn_s: float = 5.0             # Lag that flips the session to "lagging"
+    max_merge_s: float = 28.0           # Merged segments must still fit one 30 s Whisper window
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "BackpressureConfig":
+        if not data:
+            return cls()
+        known = {f.name for f in fields(cls)}
+        config = cls(**{k: v for k, v in data.items() if k in known})
+        if config.policy not in OVERLOAD_POLICIES:
+            logger.warning(f"Unknown overload policy '{config.policy}', falling back to drop_oldest.")
+            config.policy = "drop_oldest"
+        return config
+
+#-----------------------
+# COUNTERS
+#-----------------------
+
+@dataclass
+class SessionCounters:
+    """Per-session traffic and overload counters, exposed through /api/audio/stats."""
+    codec: str = "pcm16"
+    received_bytes: int = 0             # On the wire (compressed, if the session negotiated a codec)
+    decoded_bytes: int = 0              # 16 kHz Int16 PCM handed to the VAD gate
+    decode_cpu_s: float = 0.0           # Server CPU spent decoding the wire format
+    queued_bytes: int = 0
+    dropped_chunks: int = 0
+    dropped_bytes: int = 0
+    dropped_segments: int = 0
+    dropped_messages: int = 0           # Drafts and status updates a slow client never received
+    merged_segments: int = 0
+    degraded_segments: int = 0
+    lag_s: float = 0.0
+    lagging: bool = False
+    started_at: float = field(default_factory=time.monotonic)
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = {f.name: getattr(self, f.name) for f in fields(self) if f.name != "started_at"}
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        data["lag_s"] = round(self.lag_s, 2)
+        data["decode_cpu_s"] = round(self.decode_cpu_s, 3)
+        data["wire_kbps"] = round(self.received_bytes * 8 / 1000 / elapsed, 1)
+        data["compression"] = round(self.decoded_bytes / self.received_bytes, 1) if self.received_bytes else None
+        data["decode_cpu_pct"] = round(100 * self.decode_cpu_s / elapsed, 2)
+        return data
+
+#-----------------------
+# BOUNDED QUEUES
+#-----------------------
+
+def put_dropping_oldest(queue: asyncio.Queue, item) -> Optional[Any]:
+    """Non-blocking put on a bounded queue. Returns the evicted item, if any."""
+    evicted = None
+    if queue.full():
+        evicted = queue.get_nowait()
+    queue.put_nowait(item)
+    return evicted
+
+
+def evict_oldest(queue: asyncio.Queue, droppable: Callable[[Any], bool]) -> Optional[Any]:
+    """Removes and returns the oldest queued item that is `droppable`, if any; the others keep their order."""
+    items = [queue.get_nowait() for _ in range(queue.qsize())]
+    index = next((i for i, item in enumerate(items) if droppable(item)), None)
+    evicted = items.pop(index) if index is not None else None
+    for item in items:
+        queue.put_nowait(item)
+    return evicted
+
+
+def put_droppable(queue: asyncio.Queue, item, droppable: Callable[[Any], bool]) -> Optional[Any]:
+    """
+    Non-blocking put of an item that may be lost. A full queue makes room by evicting its oldest droppable
+    item; if it holds none, `item` itself is dropped. Returns the dropped item, if any.
+    """
+    if queue.full():
+        evicted = evict_oldest(queue, droppable)
+        if evicted is None:
+            return item
+        queue.put_nowait(item)
+        return evicted
+    queue.put_nowait(item)
+    return None
+
+
+async def put_keeping(queue: asyncio.Queue, item, droppable: Callable[[Any], bool]) -> Optional[Any]:
+    """
+    Put of an item that must not be lost. A full queue makes room by evicting its oldest droppable item;
+    if it holds none, this waits for the consumer. Returns the evicted item, if any.
+    """
+    evicted = evict_oldest(queue, droppable) if queue.full() else None
+    await queue.put(item)
+    return evicted
+
+
+def _merge(a: SpeechSegment, b: SpeechSegment) -> SpeechSegment:
+    """Joins two adjacent utterances into one decode (the silence between them is not kept)."""
+    na, nb = a.samples.size, b.samples.size
+    return SpeechSegment(
+        samples=np.concatenate((a.samples, b.samples)),
+        start=a.start,
+        end=b.end,
+        speech_prob=(a.speech_prob * na + b.speech_prob * nb) / (na + nb),
+        closed_at=a.closed_at,
+    )
+
+
+class SegmentBacklog:
+    """
+    Bounded FIFO of closed segments waiting for a decode slot.
+    When it is full, the configured overload policy decides what happens to the next segment.
+    """
+
+    def __init__(self, config: BackpressureConfig, counters: SessionCounters):
+        self.config = config
+        self.counters = counters
+        self._items: Deque[SpeechSegment] = deque()
+        self._available = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(s.samples.nbytes for s in self._items)
+
+    @property
+    def overloaded(self) -> bool:
+        return len(self._items) >= self.config.max_backlog_segments
+
+    def oldest_age(self) -> float:
+        return time.monotonic() - self._items[0].closed_at if self._items else 0.0
+
+    def put(self, segment: SpeechSegment):
+        cfg = self.config
+        if self.overloaded:
+            if cfg.policy == "merge" and self._items:
+                tail = self._items[-1]
+                if (segment.end - tail.start) <= cfg.max_merge_s:
+                    self._items[-1] = _merge(tail, segment)
+                    self.counters.merged_segments += 1
+                    return
+                # Too long to merge: fall through to dropping the oldest
+
+            if cfg.policy == "downgrade" and len(self._items) < 4 * cfg.max_backlog_segments:
+                # Keep everything; get() hands these out as greedy decodes until the backlog drains
+                pass
+            else:
+                self._items.popleft()
+                self.counters.dropped_segments += 1
+
+        self._items.append(segment)
+        self._available.set()
+
+    async def get(self) -> Tuple[SpeechSegment, bool]:
+        """Returns the next segment and whether it should be decoded cheaply (greedy)."""
+        while not self._items:
+            self._available.clear()
+            await self._available.wait()
+
+        degraded = self.config.policy == "downgrade" and self.overloaded
+        if degraded:
+            self.counters.degraded_segments += 1
+        return self._items.popleft(), degraded
@@ -0,0 +1,77 @@
+import numpy as np
+
+INT16_SCALE = np.float32(1.0 / 32768.0)
+
+#-----------------------
+# RING BUFFER
+#-----------------------
+
+class PCMRingBuffer:
+    """
+    Preallocated float32 ring holding the tail of one session's audio stream.
+    Positions are absolute sample indices since the session started; the ring only keeps the last `capacity` of them.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.written = 0
+        self._data = np.zeros(capacity, dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    def write_int16(self, pcm) -> int:
+        """Converts little-endian Int16 PCM straight into the ring (no intermediate arrays). Returns samples written."""
+        src = np.frombuffer(pcm, dtype=np.int16)
+        n = src.size
+        if n > self.capacity:
+            raise ValueError(f"Chunk of {n} samples exceeds ring capacity {self.capacity}")
+
+        pos = self.written % self.capacity
+        first = min(n, self.capacity - pos)
+        np.multiply(src[:first], INT16_SCALE, out=self._data[pos:pos + first])
+        if first < n:
+            np.multiply(src[first:], INT16_SCALE, out=self._data[:n - first])
+
+        self.written += n
+        return n
+
+    def write_float32(self, samples: np.ndarray) -> int:
+        """Copies already-normalised float32 samples into the ring. Returns samples written."""
+        n = samples.size
+        if n > self.capacity:
+            raise ValueError(f"Chunk of {n} samples exceeds ring capacity {self.capacity}")
+
+        pos = self.written % self.capacity
+        first = min(n, self.capacity - pos)
+        self._data[pos:pos + first] = samples[:first]
+        if first < n:
+            self._data[:n - first] = samples[first:]
+
+        self.written += n
+        return n
+
+    def _check(self, start: int, end: int):
+        if start < self.written - self.capacity or end > self.written or start > end:
+            raise IndexError(f"Samples [{start}, {end}) are no longer (or not yet) in the ring")
+
+    def view(self, start: int, end: int) -> np.ndarray:
+        """Zero-copy view of [start, end). The range must not straddle the wrap point."""
+        self._check(start, end)
+        pos = start % self.capacity
+        if pos + (end - start) > self.capacity:
+            raise IndexError("View straddles the ring wrap point; use copy() instead")
+        return self._data[pos:pos + (end - start)]
+
+    def copy(self, start: int, end: int) -> np.ndarray:
+        """Contiguous copy of [start, end), e.g. a finished segment that must outlive the ring position."""
+        self._check(start, end)
+        n = end - start
+        out = np.empty(n, dtype=np.float32)
+        pos = start % self.capacity
+        first = min(n, self.capacity - pos)
+        out[:first] = self._data[pos:pos + first]
+        if first < n:
+            out[first:] = self._data[:n - first]
+        return out
@@ -0,0 +1,141 @@
+import io
+import queue
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+import av
+
+from audio_pipeline.vad import SAMPLE_RATE
+
+logger = logging.getLogger("CallimacusAudio")
+
+# Wire formats a client can ask for with ?codec=...; raw Int16 PCM is the fallback
+PCM16 = "pcm16"
+WEBM_OPUS = "webm-opus"         # MediaRecorder('audio/webm;codecs=opus'): ~24 kbit/s instead of 256
+SUPPORTED_CODECS = (PCM16, WEBM_OPUS)
+BLOCK_BYTES = 8192              # Decoded PCM is handed on in 4096-sample blocks, like the ScriptProcessor sends
+
+#-----------------------
+# NEGOTIATION
+#-----------------------
+
+def negotiate_codec(requested: Optional[str]) -> str:
+    """The wire format the session will use: the requested one if this server can decode it, else PCM."""
+    if requested in SUPPORTED_CODECS:
+        return requested
+    if requested:
+        logger.warning(f"⚠️ Client asked for unsupported audio codec '{requested}', falling back to {PCM16}.")
+    return PCM16
+
+#-----------------------
+# STREAMING DECODER
+#-----------------------
+
+class _ChunkPipe(io.RawIOBase):
+    """Blocking, non-seekable file object fed chunk by chunk from the event loop; read by the demuxer thread."""
+
+    def __init__(self):
+        self._chunks: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        self._pending = memoryview(b"")
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def feed(self, data: bytes):
+        self._chunks.put(data)
+
+    def close_input(self):
+        self._chunks.put(None)
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            if self._eof:
+                return 0
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+                return 0
+            self._pending = memoryview(chunk)
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+class StreamDecoder:
+    """
+    Decodes one session's compressed stream into 16 kHz mono Int16 PCM, the format the VAD gate expects.
+    Demuxing, decoding and resampling run on a dedicated thread; `on_pcm` is called from that thread
+    for every decoded block, and `cpu_s` is the thread's own CPU time (the per-session decode cost).
+    """
+
+    def __init__(self, container_format: str, on_pcm: Callable[[bytes], None]):
+        self.container_format = container_format
+        self.on_pcm = on_pcm
+        self.cpu_s = 0.0
+        self.decoded_bytes = 0
+        self.error: Optional[str] = None
+        self._block = bytearray()
+        self._pipe = _ChunkPipe()
+        self._thread = threading.Thread(target=self._run, name="audio-decoder", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def feed(self, data: bytes):
+        self._pipe.feed(data)
+
+    def close(self):
+        self._pipe.close_input()
+
+    def _run(self):
+        try:
+            # Keep probing minimal: the stream is live, and the WebM header already describes the track
+            container = av.open(self._pipe, mode="r", format=self.container_format,
+                                options={"probesize": "4096", "analyzeduration": "0"})
+            stream = container.streams.audio[0]
+            resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+
+            for packet in container.demux(stream):
+                try:
+                    frames = packet.decode()
+                except av.error.InvalidDataError:
+                    continue  # Same policy as faster_whisper.decode_audio: skip damaged packets
+
+                for frame in frames:
+                    for out in resampler.resample(frame):
+                        self._emit(out)
+                self.cpu_s = time.thread_time()
+
+            for out in resampler.resample(None):
+                self._emit(out)
+            self._flush()
+            container.close()
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"❌ Audio decoder stopped: {e}")
+        finally:
+            self.cpu_s = time.thread_time()
+
+    def _emit(self, frame):
+        # Opus frames are 20 ms; batching them keeps the bounded audio queue measured in seconds, not frames
+        self._block += frame.to_ndarray().tobytes()
+        if len(self._block) >= BLOCK_BYTES:
+            self._flush()
+
+    def _flush(self):
+        if self._block:
+            pcm = bytes(self._block)
+            self._block.clear()
+            self.decoded_bytes += len(pcm)
+            self.on_pcm(pcm)
+
+
+def make_decoder(codec: str, on_pcm: Callable[[bytes], None]) -> Optional[StreamDecoder]:
+    """None for raw PCM, which goes straight to the VAD gate."""
+    if codec == WEBM_OPUS:
+        return StreamDecoder("webm", on_pcm)
+    return None
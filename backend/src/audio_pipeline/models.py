@@ -0,0 +1,197 @@
+import os
+import time
+import logging
+from dataclasses import dataclass, asdict, fields
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from faster_whisper import WhisperModel, decode_audio
+
+from audio_pipeline.scheduler import decode_batch
+from audio_pipeline.vad import SAMPLE_RATE
+
+logger = logging.getLogger("CallimacusAudio")
+
+WHISPER_SIZES = ("tiny", "base", "small")
+COMPUTE_TYPES = ("default", "int8", "int8_float32", "float32")
+HF_CACHE_DIR = os.path.expanduser("~/.cache/huggingface/hub")
+
+#-----------------------
+# CONFIGURATION
+#-----------------------
+
+@dataclass
+class WhisperConfig:
+    """Which Whisper build the live pipeline runs ('whisper' section of config.json)."""
+    model: str = "base"
+    compute_type: str = "default"
+    cpu_threads: int = 2
+    warmup: bool = True
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "WhisperConfig":
+        if not data:
+            return cls()
+        known = {f.name for f in fields(cls)}
+        config = cls(**{k: v for k, v in data.items() if k in known})
+        config.validate()
+        return config
+
+    def validate(self):
+        if self.model not in WHISPER_SIZES:
+            raise ValueError(f"Unknown Whisper size '{self.model}'. Choose one of {WHISPER_SIZES}.")
+        if self.compute_type not in COMPUTE_TYPES:
+            raise ValueError(f"Unknown compute type '{self.compute_type}'. Choose one of {COMPUTE_TYPES}.")
+        if self.cpu_threads < 1:
+            raise ValueError("cpu_threads must be at least 1.")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+#-----------------------
+# LOADING
+#-----------------------
+
+def resolve_snapshot(size: str) -> str:
+    """Finds the locally cached CTranslate2 snapshot for a model size (see setup_models.py)."""
+    cache_path = os.path.join(HF_CACHE_DIR, f"models--Systran--faster-whisper-{size}", "snapshots")
+    try:
+        snapshot_folder = os.listdir(cache_path)[0]
+    except (FileNotFoundError, IndexError):
+        raise FileNotFoundError(f"Faster-Whisper '{size}' cache not found! Run: python setup_models.py --sizes {size}")
+    return os.path.join(cache_path, snapshot_folder)
+
+
+def cached_sizes() -> List[str]:
+    sizes = []
+    for size in WHISPER_SIZES:
+        try:
+            resolve_snapshot(size)
+            sizes.append(size)
+        except FileNotFoundError:
+            pass
+    return sizes
+
+
+def synthetic_audio(seconds: float = 2.0) -> np.ndarray:
+    """A quiet voiced-like signal (harmonic stack + noise); enough to exercise encoder and decoder."""
+    t = np.arange(int(seconds * SAMPLE_RATE), dtype=np.float32) / SAMPLE_RATE
+    f0 = 140.0 + 20.0 * np.sin(2 * np.pi * 3.0 * t)
+    signal = sum(np.sin(2 * np.pi * k * f0 * t) / k for k in range(1, 6))
+    noise = np.random.default_rng(0).normal(0, 0.02, t.size)
+    return (0.1 * signal + noise).astype(np.float32)
+
+
+def warm_up(model: WhisperModel):
+    """
+    Pays the one-off allocation and kernel-selection cost before the first real segment.
+    Run it on the thread that will decode with the model (the scheduler does so for its replicas).
+    """
+    started = time.perf_counter()
+    decode_batch(model, [synthetic_audio()], beam_size=1)
+    logger.info(f"🔥 Whisper warm-up decode took {time.perf_counter() - started:.2f}s")
+
+
+def load_whisper(config: WhisperConfig, num_workers: int = 1) -> WhisperModel:
+    """
+    Loads straight from the hard drive, bypassing network requests completely.
+    num_workers > 1 lets that many threads transcribe with the same model in parallel.
+    """
+    model = WhisperModel(
+        resolve_snapshot(config.model),
+        device="cpu",
+        compute_type=config.compute_type,
+        local_files_only=True,
+        cpu_threads=config.cpu_threads,
+        num_workers=num_workers
+    )
+    return model
+
+#-----------------------
+# REGISTRY
+#-----------------------
+
+class ModelRegistry:
+    """Owns the active Whisper configuration and builds replica sets for the scheduler."""
+
+    def __init__(self, config: WhisperConfig, replicas: int = 1):
+        self.active = config
+        self.replicas = max(1, replicas)
+        self.loaded_at: Optional[float] = None
+
+    def load(self, config: Optional[WhisperConfig] = None) -> List[WhisperModel]:
+        """Loads one independent model per replica (the scheduler warms them up). Blocking: call from a worker thread."""
+        config = config or self.active
+        config.validate()
+        logger.info(f"🧠 Loading Faster-Whisper '{config.model}' ({config.compute_type}, {config.cpu_threads} threads) x{self.replicas}...")
+        models = [load_whisper(config) for _ in range(self.replicas)]
+        self.active = config
+        self.loaded_at = time.time()
+        return models
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "active": self.active.as_dict(),
+            "replicas": self.replicas,
+            "loaded_at": self.loaded_at,
+            "sizes": list(WHISPER_SIZES),
+            "compute_types": list(COMPUTE_TYPES),
+            "cached_sizes": cached_sizes(),
+        }
+
+#-----------------------
+# BENCHMARK
+#-----------------------
+
+def _word_error_rate(reference: str, hypothesis: str) -> float:
+    ref, hyp = reference.lower().split(), hypothesis.lower().split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1] / len(ref)
+
+
+def benchmark(configs: List[WhisperConfig], audio_path: Optional[str] = None,
+              reference: Optional[str] = None, seconds: float = 10.0, segment_s: float = 10.0,
+              batch_size: int = 4, beam_size: int = 5) -> List[Dict[str, Any]]:
+    """
+    Real-time factor (decode time / audio duration, lower is faster) of each configuration on this CPU,
+    timed on the live path: the audio is cut into VAD-sized segments and decoded with decode_batch() in
+    scheduler-sized batches, after a warm-up. With a recording and its reference text, the word error rate
+    is reported too.
+    """
+    audio = decode_audio(audio_path, sampling_rate=SAMPLE_RATE) if audio_path else synthetic_audio(seconds)
+    duration = audio.size / SAMPLE_RATE
+    step = max(1, int(segment_s * SAMPLE_RATE))
+    segments = [audio[i:i + step] for i in range(0, audio.size, step)]
+
+    results = []
+    for config in configs:
+        row = {"config": config.as_dict()}
+        try:
+            started = time.perf_counter()
+            model = load_whisper(config)
+            row["load_s"] = round(time.perf_counter() - started, 2)
+            warm_up(model)
+
+            started = time.perf_counter()
+            texts = []
+            for i in range(0, len(segments), batch_size):
+                texts += decode_batch(model, segments[i:i + batch_size], beam_size=beam_size)
+            text = " ".join(t for t in texts if t)
+            elapsed = time.perf_counter() - started
+
+            row["rtf"] = round(elapsed / duration, 3)
+            if reference is not None:
+                row["wer"] = round(_word_error_rate(reference, text), 3)
+            del model
+        except Exception as e:
+            row["error"] = str(e)
+        results.append(row)
+        logger.info(f"⏱️ Benchmark {row}")
+    return sorted(results, key=lambda r: r.get("rtf", float("inf")))
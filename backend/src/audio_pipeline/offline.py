@@ -0,0 +1,298 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from pathlib import Path
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from pydub.utils import get_encoder_name
+
+from audio_pipeline.models import WhisperConfig, load_whisper
+from audio_pipeline.vad import SAMPLE_RATE
+
+logger = logging.getLogger("CallimacusAudio")
+
+SUPPORTED_EXTENSIONS = (".wav", ".mp3", ".m4a")
+FRAME_SAMPLES = 320                 # 20 ms energy frames for silence detection
+
+#-----------------------
+# CONFIGURATION
+#-----------------------
+
+@dataclass
+class OfflineConfig:
+    """Recorded-lecture transcription knobs ('offline' section of config.json)."""
+    workers: int = max(1, (os.cpu_count() or 2) // 2)
+    cpu_threads: int = 2            # Per worker
+    model: Optional[str] = None     # Defaults to the live model size
+    compute_type: Optional[str] = None
+    target_chunk_s: float = 60.0    # Chunks are cut at the quietest point near this length...
+    search_window_s: float = 15.0   # ...looking this far either side of the target
+    min_pause_s: float = 0.3        # Length of the quiet run a cut is centred on
+    beam_size: int = 5
+    job_ttl_s: float = 3600.0       # Finished jobs (and their transcripts) are kept this long for polling...
+    max_jobs: int = 100             # ...and at most this many of them
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "OfflineConfig":
+        if not data:
+            return cls()
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+@dataclass
+class OfflineJob:
+    id: str
+    filename: str
+    status: str = "queued"          # queued | decoding | transcribing | completed | error
+    duration_s: float = 0.0
+    total_chunks: int = 0
+    done_chunks: int = 0
+    segments: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def as_dict(self, include_segments: bool = True) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "duration_s": round(self.duration_s, 2),
+            "progress": round(self.done_chunks / self.total_chunks, 3) if self.total_chunks else 0.0,
+            "done_chunks": self.done_chunks,
+            "total_chunks": self.total_chunks,
+            "error": self.error,
+        }
+        if self.finished_at and self.duration_s:
+            # Wall-clock processing time / audio duration
+            data["rtf"] = round((self.finished_at - self.created_at) / self.duration_s, 3)
+        if include_segments and self.status == "completed":
+            data["segments"] = self.segments
+            data["text"] = " ".join(s["text"] for s in self.segments)
+        return data
+
+#-----------------------
+# SILENCE SPLITTING
+#-----------------------
+
+def frame_energy(pcm: np.ndarray, block_frames: int = 50_000) -> np.ndarray:
+    """Per-frame mean square energy, computed block by block so a memory-mapped hour never sits in RAM."""
+    n_frames = pcm.size // FRAME_SAMPLES
+    energy = np.empty(n_frames, dtype=np.float32)
+    for first in range(0, n_frames, block_frames):
+        last = min(n_frames, first + block_frames)
+        block = pcm[first * FRAME_SAMPLES:last * FRAME_SAMPLES].astype(np.float32)
+        energy[first:last] = np.mean(block.reshape(-1, FRAME_SAMPLES) ** 2, axis=1)
+    return energy
+
+
+def split_at_silence(pcm: np.ndarray, config: OfflineConfig) -> List[Tuple[int, int]]:
+    """Returns (start, end) sample ranges covering the recording, cut at the quietest pauses near each target length."""
+    total = pcm.size
+    frames_per_s = SAMPLE_RATE / FRAME_SAMPLES
+    target = int(config.target_chunk_s * frames_per_s)
+    if total <= target * FRAME_SAMPLES * 1.5:
+        return [(0, total)]
+
+    # Smooth the energy over a pause-sized window, so a cut lands in a pause and not between two syllables
+    energy = frame_energy(pcm)
+    width = max(1, int(config.min_pause_s * frames_per_s))
+    smoothed = np.convolve(energy, np.ones(width, dtype=np.float32) / width, mode="same")
+
+    window = int(config.search_window_s * frames_per_s)
+    cuts = [0]
+    while len(smoothed) - cuts[-1] > target + window:
+        lo = max(cuts[-1] + 1, cuts[-1] + target - window)
+        hi = cuts[-1] + target + window
+        cuts.append(lo + int(np.argmin(smoothed[lo:hi])))
+    cuts.append(len(smoothed))
+
+    ranges = [(a * FRAME_SAMPLES, b * FRAME_SAMPLES) for a, b in zip(cuts, cuts[1:])]
+    ranges[-1] = (ranges[-1][0], total)
+    return ranges
+
+#-----------------------
+# WORKERS
+#-----------------------
+
+def _transcribe_range(model, raw_path: str, start: int, end: int, beam_size: int) -> List[Dict[str, Any]]:
+    """Transcribes one chunk of the memory-mapped recording; runs on a worker thread."""
+    pcm = np.memmap(raw_path, dtype=np.int16, mode="r")
+    samples = pcm[start:end].astype(np.float32) / 32768.0
+    offset = start / SAMPLE_RATE
+
+    segments, _ = model.transcribe(samples, beam_size=beam_size, language="en")
+    return [
+        {"start": round(offset + s.start, 2), "end": round(offset + s.end, 2), "text": s.text.strip()}
+        for s in segments if s.text.strip()
+    ]
+
+#-----------------------
+# JOB RUNNER
+#-----------------------
+
+class OfflineTranscriber:
+    """
+    Turns uploaded recordings into timestamped transcripts, transcribing chunks in parallel.
+    CTranslate2 releases the GIL, so worker threads sharing one model with `num_workers` slots
+    scale across cores like a process pool would, without re-importing the app in every child
+    or loading one copy of the weights per process.
+    """
+
+    def __init__(self, work_dir: Path, whisper: WhisperConfig, config: Optional[OfflineConfig] = None):
+        self.config = config or OfflineConfig()
+        self.work_dir = work_dir
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs: Dict[str, OfflineJob] = {}
+        self._tasks: Set[asyncio.Task] = set()  # Running jobs, referenced until done
+
+        self._model_config = self._derive_config(whisper)
+        self._model = None
+        self._pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()   # Guards the model and pool; never held during a load
+        self._load_lock = threading.Lock()   # One load at a time, so concurrent first jobs share it
+
+    def _derive_config(self, whisper: WhisperConfig) -> WhisperConfig:
+        """The live configuration, overridden by the 'offline' model and compute type when set."""
+        config = WhisperConfig(
+            model=self.config.model or whisper.model,
+            compute_type=self.config.compute_type or whisper.compute_type,
+            cpu_threads=self.config.cpu_threads,
+            warmup=False,
+        )
+        config.validate()
+        return config
+
+    def follow(self, whisper: WhisperConfig):
+        """
+        Tracks a hot-swapped live model. If the offline model changes, the pool is dropped and the next
+        job starts a new one; chunks already submitted finish on the old model, which holds its own reference.
+        """
+        config = self._derive_config(whisper)
+        with self._pool_lock:
+            if config == self._model_config:
+                return
+            self._model_config = config
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._model, self._pool = None, None
+
+    def _get_pool(self):
+        # Started lazily: the workers (and their model) only exist once someone uploads a recording.
+        # The load runs outside _pool_lock, so follow() (on the event loop) never waits for it
+        with self._load_lock:
+            while True:
+                with self._pool_lock:
+                    if self._pool is not None:
+                        return self._model, self._pool
+                    config = self._model_config
+                model = load_whisper(config, num_workers=self.config.workers)
+                with self._pool_lock:
+                    if config != self._model_config:
+                        continue  # Swapped while loading: load the new model instead
+                    self._model = model
+                    self._pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.config.workers, thread_name_prefix="offline-whisper"
+                    )
+                    return self._model, self._pool
+
+    def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _prune_jobs(self):
+        """Forgets finished jobs past their TTL, then the oldest finished ones beyond max_jobs."""
+        now = time.time()
+        finished = sorted(
+            (job for job in self.jobs.values() if job.finished_at is not None), key=lambda job: job.finished_at
+        )
+        expired = [job for job in finished if now - job.finished_at > self.config.job_ttl_s]
+        excess = len(self.jobs) - len(expired) - self.config.max_jobs
+        if excess > 0:
+            expired += [job for job in finished if job not in expired][:excess]
+        for job in expired:
+            del self.jobs[job.id]
+
+    def new_upload_path(self, filename: str) -> Tuple[str, Path]:
+        job_id = uuid.uuid4().hex
+        ext = os.path.splitext(filename)[1].lower()
+        return job_id, self.work_dir / f"{job_id}{ext}"
+
+    def submit(self, job_id: str, upload_path: Path, filename: str) -> OfflineJob:
+        self._prune_jobs()
+        job = OfflineJob(id=job_id, filename=filename)
+        self.jobs[job_id] = job
+        task = asyncio.create_task(self._run(job, upload_path))
+        self._tasks.add(task)
+        task.add_done_callback(self._job_done)
+        return job
+
+    def _job_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ Offline job crashed: {task.exception()!r}")
+
+    async def _decode_to_raw(self, upload_path: Path, raw_path: Path):
+        """Streams the upload through ffmpeg into 16 kHz mono Int16 on disk."""
+        proc = await asyncio.create_subprocess_exec(
+            get_encoder_name(), "-nostdin", "-loglevel", "error", "-y",
+            "-i", str(upload_path), "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", str(raw_path),
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='ignore').strip()[:300]}")
+
+    async def _run(self, job: OfflineJob, upload_path: Path):
+        loop = asyncio.get_running_loop()
+        raw_path = upload_path.with_suffix(".raw")
+        try:
+            job.status = "decoding"
+            await self._decode_to_raw(upload_path, raw_path)
+
+            pcm = np.memmap(raw_path, dtype=np.int16, mode="r")
+            job.duration_s = pcm.size / SAMPLE_RATE
+            ranges = await loop.run_in_executor(None, split_at_silence, pcm, self.config)
+            del pcm
+
+            job.status = "transcribing"
+            job.total_chunks = len(ranges)
+            logger.info(f"📼 Offline job {job.id[:8]}: {job.duration_s / 60:.1f} min in {len(ranges)} chunks on {self.config.workers} workers.")
+
+            model, pool = await loop.run_in_executor(None, self._get_pool)
+            futures = [
+                loop.run_in_executor(pool, _transcribe_range, model, str(raw_path), start, end, self.config.beam_size)
+                for start, end in ranges
+            ]
+            results: List[List[Dict[str, Any]]] = [[] for _ in futures]
+
+            async def track(i: int, future):
+                results[i] = await future
+                job.done_chunks += 1
+
+            await asyncio.gather(*(track(i, f) for i, f in enumerate(futures)))
+
+            # Chunks are disjoint and in order, so concatenation keeps the timeline sorted
+            job.segments = [s for chunk in results for s in chunk]
+            job.status = "completed"
+        except Exception as e:
+            logger.error(f"❌ Offline transcription {job.id[:8]} failed: {e}")
+            job.status = "error"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            for path in (upload_path, raw_path):
+                try:
+                    path.unlink(missing_ok=True)
+                except Exception as e:
+                    logger.warning(f"Could not delete {path}: {e}")
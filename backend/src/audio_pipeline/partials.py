@@ -0,0 +1,80 @@
+import re
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+#-----------------------
+# CONFIGURATION
+#-----------------------
+
+@dataclass
+class StreamingConfig:
+    """Partial-transcript knobs ('streaming' section of config.json)."""
+    enabled: bool = False           # Clients can also opt in with ?partials=1 on the WebSocket URL
+    min_interval_s: float = 0.75    # Caps partial decodes to at most one per interval per session
+    min_audio_s: float = 0.5        # Don't bother decoding drafts shorter than this
+    # Draft beam width is the scheduler's 'partial_beam_size' ('transcription' section)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "StreamingConfig":
+        if not data:
+            return cls()
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+#-----------------------
+# LOCAL AGREEMENT
+#-----------------------
+
+def _normalise(word: str) -> str:
+    return re.sub(r"[^\w']", "", word).lower()
+
+
+class LocalAgreement:
+    """
+    LocalAgreement-2 prefix stabilisation: a word becomes stable once two consecutive
+    hypotheses of the growing buffer agree on it. Stable words are never retracted.
+    """
+
+    def __init__(self):
+        self._previous: List[str] = []
+        self._stable: List[str] = []
+
+    def reset(self):
+        """Called when the utterance is committed; the next one starts from scratch."""
+        self._previous = []
+        self._stable = []
+
+    @staticmethod
+    def _common_prefix(a: List[str], b: List[str]) -> int:
+        n = 0
+        for x, y in zip(a, b):
+            if _normalise(x) != _normalise(y):
+                break
+            n += 1
+        return n
+
+    def _tail_start(self, words: List[str]) -> int:
+        """Where the words after the stable prefix begin in a hypothesis, which may have revised that prefix."""
+        kept = self._common_prefix(self._stable, words)
+        if kept == len(self._stable):
+            return kept
+        # A stable word was revised: resume after the last stable word if it is still there (a word
+        # inserted or dropped before it), else after as many words as the stable prefix (a word replaced)
+        last = _normalise(self._stable[-1])
+        for i in range(kept, len(words)):
+            if _normalise(words[i]) == last:
+                return i + 1
+        return len(self._stable)
+
+    def update(self, hypothesis: str) -> Tuple[str, str]:
+        """Returns (stable prefix, unstable tail) for the newest hypothesis."""
+        words = hypothesis.split()
+        agreed = self._common_prefix(self._previous, words)
+        start = self._tail_start(words)
+
+        if agreed > start:
+            self._stable = self._stable + words[start:agreed]
+            start = agreed
+        self._previous = words
+
+        return " ".join(self._stable), " ".join(words[start:])
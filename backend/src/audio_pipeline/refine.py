@@ -0,0 +1,357 @@
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from dataclasses import dataclass, fields
+from typing import Any, Callable, Dict, List, Optional
+
+from pydub.utils import get_encoder_name
+
+from audio_pipeline.models import resolve_snapshot
+from audio_pipeline.vad import SAMPLE_RATE
+from paths import RECORDINGS_DIR
+from transcripts import TranscriptLog
+
+logger = logging.getLogger("CallimacusAudio")
+
+RECORDING_SUFFIX = ".ogg"
+PARTIAL_SUFFIX = ".part"            # Still being written by a live session
+RESULT_SUFFIX = ".refined.json"     # Second-pass output; its presence marks the recording as done
+FAILED_SUFFIX = ".failed"           # Error of a failed pass; kept on disk so a restart does not retry it
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#-----------------------
+# CONFIGURATION
+#-----------------------
+
+@dataclass
+class RefineConfig:
+    """Second-pass transcription of saved session audio ('refine' section of config.json)."""
+    enabled: bool = True
+    model: str = "small"
+    compute_type: str = "int8"
+    cpu_threads: int = max(1, (os.cpu_count() or 2) - 2)   # Spare cores; the process runs niced anyway
+    beam_size: int = 5
+    language: str = "en"
+    bitrate: str = "24k"            # Opus bitrate of the saved audio (speech stays transparent for Whisper)
+    idle_s: float = 30.0            # How long the live pipeline must be quiet before a job starts
+    poll_s: float = 2.0
+    niceness: int = 19
+    retention_days: float = 30.0    # Refined (or failed) recordings and their results are deleted after this...
+    max_recordings_mb: float = 2048.0   # ...and the oldest recordings beyond this total, refined or not
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "RefineConfig":
+        if not data:
+            return cls()
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+#-----------------------
+# SESSION RECORDING
+#-----------------------
+
+def recording_path(doc_id: str, session_id: str, started_at: float) -> Path:
+    """recordings/{doc_id}/{start_ms}_{session_id}.ogg: the name alone is enough to map results back to the log."""
+    return Path(RECORDINGS_DIR) / doc_id / f"{int(started_at * 1000)}_{session_id}{RECORDING_SUFFIX}"
+
+
+class SessionRecorder:
+    """
+    Pipes a session's raw PCM through ffmpeg into an Opus file next to the document.
+    Encoding runs in the ffmpeg process; a failing recorder only stops recording, never the session.
+    """
+
+    def __init__(self, path: Path, bitrate: str = "24k", input_args: Optional[List[str]] = None):
+        self.path = path
+        self.bitrate = bitrate
+        # The client's raw format (see resample.InputFormat); ffmpeg resamples while encoding
+        self.input_args = input_args or ["-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1"]
+        self.bytes_in = 0
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._partial = path.with_name(path.name + PARTIAL_SUFFIX)
+
+    async def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self._proc = await asyncio.create_subprocess_exec(
+                get_encoder_name(), "-nostdin", "-loglevel", "error", "-y",
+                *self.input_args, "-i", "pipe:0",
+                "-c:a", "libopus", "-b:a", self.bitrate, "-application", "voip", "-f", "ogg", str(self._partial),
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Session audio will not be saved: {e}")
+            self._proc = None
+
+    def write(self, pcm: bytes):
+        """Non-blocking: the pipe transport buffers while ffmpeg catches up."""
+        if self._proc is None:
+            return
+        if self._proc.returncode is not None:
+            logger.warning(f"⚠️ Session recorder exited ({self._proc.returncode}); audio is no longer saved.")
+            self._proc = None
+            return
+        self._proc.stdin.write(pcm)
+        self.bytes_in += len(pcm)
+
+    async def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+            await asyncio.wait_for(self._proc.wait(), timeout=10)
+        except Exception as e:
+            logger.warning(f"⚠️ Session recorder did not finish cleanly: {e}")
+            self._proc.kill()
+        self._proc = None
+
+        if self.bytes_in and self._partial.exists():
+            self._partial.rename(self.path)
+        else:
+            self._partial.unlink(missing_ok=True)
+
+#-----------------------
+# BACKGROUND REFINEMENT
+#-----------------------
+
+def _result_path(recording: Path) -> Path:
+    return recording.with_name(recording.stem + RESULT_SUFFIX)
+
+
+def _failed_path(recording: Path) -> Path:
+    return recording.with_name(recording.name + FAILED_SUFFIX)
+
+
+class RefinementWorker:
+    """
+    Re-transcribes finished session recordings with a larger model, once the live pipeline has been
+    idle for a while, and overlays the result on the document's transcript log.
+
+    Jobs run in a separate, niced process (`python -m audio_pipeline.refine`), so they use spare cores
+    without competing for the server's GIL. Whenever the live pipeline gets busy again the process is
+    stopped (SIGSTOP) and continued once it is idle, so refinement never adds latency to live decoding.
+    """
+
+    def __init__(self, config: RefineConfig, is_busy: Callable[[], bool]):
+        self.config = config
+        self.is_busy = is_busy
+        self.completed = 0
+        self.refined_records = 0
+        self.current: Optional[Path] = None
+        self.paused = False
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._task: Optional[asyncio.Task] = None
+        self._job: Optional[asyncio.Task] = None
+        self._last_busy = time.monotonic()
+
+    def start(self):
+        # The child loads the model with local_files_only: without the snapshot every job would fail
+        try:
+            resolve_snapshot(self.config.model)
+        except FileNotFoundError as e:
+            logger.warning(f"⚠️ Transcript refinement disabled: {e}")
+            self.config.enabled = False
+            return
+        self._recover_partials()
+        self.prune()
+        self._task = asyncio.create_task(self._loop())
+
+    async def shutdown(self):
+        # The job is cancelled before its process is stopped, so the terminated child is not logged as a failure
+        proc = self._proc
+        for task in (self._task, self._job):
+            if task is not None:
+                task.cancel()
+        if proc is not None and proc.returncode is None:
+            self._resume_process(proc)
+            proc.terminate()
+            await proc.wait()
+
+    def _recover_partials(self):
+        # Nothing is recording before startup, so leftovers are from a crash: keep what ffmpeg managed to write
+        for partial in Path(RECORDINGS_DIR).glob(f"*/*{RECORDING_SUFFIX}{PARTIAL_SUFFIX}"):
+            partial.rename(partial.with_name(partial.name[:-len(PARTIAL_SUFFIX)]))
+
+    def pending(self) -> List[Path]:
+        recordings = sorted(Path(RECORDINGS_DIR).glob(f"*/*{RECORDING_SUFFIX}"))
+        return [p for p in recordings if not _result_path(p).exists() and not _failed_path(p).exists()]
+
+    def failed(self) -> List[Path]:
+        return sorted(Path(RECORDINGS_DIR).glob(f"*/*{RECORDING_SUFFIX}{FAILED_SUFFIX}"))
+
+    def prune(self) -> int:
+        """
+        Applies the retention limits: recordings that are done (refined or failed) past retention_days, then
+        the oldest ones while the total exceeds max_recordings_mb. Each goes with its result and failure
+        marker. The refined text already lives in the transcript log. Returns the number deleted.
+        """
+        cutoff = time.time() - self.config.retention_days * 86400
+        recordings = []
+        for path in Path(RECORDINGS_DIR).glob(f"*/*{RECORDING_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            recordings.append((stat.st_mtime, stat.st_size, path))
+        recordings.sort()
+
+        expired = [
+            path for mtime, _, path in recordings
+            if mtime < cutoff and (_result_path(path).exists() or _failed_path(path).exists())
+        ]
+        total = sum(size for _, size, path in recordings if path not in expired)
+        budget = self.config.max_recordings_mb * 1024 * 1024
+        for _, size, path in recordings:
+            if total <= budget:
+                break
+            if path not in expired and path != self.current:
+                expired.append(path)
+                total -= size
+
+        for path in expired:
+            for related in (path, _result_path(path), _failed_path(path)):
+                related.unlink(missing_ok=True)
+        if expired:
+            logger.info(f"🧹 Deleted {len(expired)} old session recordings.")
+        return len(expired)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.config.enabled,
+            "model": self.config.model,
+            "pending": len(self.pending()),
+            "current": self.current.name if self.current else None,
+            "paused": self.paused,
+            "completed": self.completed,
+            "refined_records": self.refined_records,
+            "failed": len(self.failed()),
+        }
+
+    # --- 1. SCHEDULING ---
+
+    def _pause(self):
+        if self._proc is not None and self._proc.returncode is None and not self.paused:
+            self._proc.send_signal(signal.SIGSTOP)
+            self.paused = True
+            logger.info("⏸️ Live audio is busy: pausing transcript refinement.")
+
+    def _resume(self):
+        if self._proc is not None:
+            self._resume_process(self._proc)
+
+    def _resume_process(self, proc: asyncio.subprocess.Process):
+        if self.paused:
+            proc.send_signal(signal.SIGCONT)
+            self.paused = False
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.config.poll_s)
+            now = time.monotonic()
+            if self.is_busy():
+                self._last_busy = now
+                self._pause()
+                continue
+            if now - self._last_busy < self.config.idle_s:
+                continue
+            self._resume()
+
+            if self._job is not None and not self._job.done():
+                continue
+            if self._job is not None:
+                self._job = None
+                self.prune()
+            pending = self.pending()
+            if pending:
+                self._job = asyncio.create_task(self._refine(pending[0]))
+
+    # --- 2. JOBS ---
+
+    async def _refine(self, recording: Path):
+        cfg = self.config
+        output = _result_path(recording)
+        started_ms, session_id = recording.stem.split("_", 1)
+        doc_id = recording.parent.name
+        self.current = recording
+        try:
+            started = time.perf_counter()
+            # Same working directory as the server (relative data dirs resolve alike), with src/ importable
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (SRC_DIR, os.environ.get("PYTHONPATH")))))
+            self._proc = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "audio_pipeline.refine", str(recording), str(output),
+                "--model", cfg.model, "--compute-type", cfg.compute_type, "--threads", str(cfg.cpu_threads),
+                "--beam-size", str(cfg.beam_size), "--language", cfg.language,
+                env=env,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+                preexec_fn=lambda: os.nice(cfg.niceness),
+            )
+            _, stderr = await self._proc.communicate()
+            if self._proc.returncode != 0:
+                raise RuntimeError(stderr.decode(errors="ignore").strip()[-300:])
+
+            segments = json.loads(output.read_text())["segments"]
+            log = TranscriptLog(doc_id)
+            loop = asyncio.get_running_loop()
+            refined = await loop.run_in_executor(
+                None, log.apply_refinement, session_id, int(started_ms) / 1000, segments, cfg.model
+            )
+            self.completed += 1
+            self.refined_records += refined
+            logger.info(f"✨ Refined {refined} transcript records of '{doc_id}' with '{cfg.model}' in {time.perf_counter() - started:.0f}s.")
+        except Exception as e:
+            logger.error(f"❌ Transcript refinement of {recording.name} failed: {e}")
+            output.unlink(missing_ok=True)
+            try:
+                _failed_path(recording).write_text(str(e), encoding="utf-8")
+            except OSError as write_error:
+                logger.warning(f"Could not record the failure of {recording.name}: {write_error}")
+        finally:
+            self._proc = None
+            self.paused = False
+            self.current = None
+
+#-----------------------
+# REFINEMENT PROCESS
+#-----------------------
+
+def transcribe_recording(audio_path: str, output_path: str, model: str, compute_type: str,
+                         threads: int, beam_size: int, language: str):
+    """Runs in the niced child process: one long-form decode with context carried across windows."""
+    from audio_pipeline.models import WhisperConfig, load_whisper
+
+    whisper = load_whisper(WhisperConfig(model=model, compute_type=compute_type, cpu_threads=threads, warmup=False))
+    segments, _ = whisper.transcribe(audio_path, beam_size=beam_size, language=language, condition_on_previous_text=True)
+    result = {
+        "model": model,
+        "segments": [
+            {"start": round(s.start, 2), "end": round(s.end, 2), "text": s.text.strip()}
+            for s in segments if s.text.strip()
+        ],
+    }
+
+    # Written atomically: the file's existence is what marks the recording as done
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(tmp_path, output_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Second-pass transcription of a saved session recording.")
+    parser.add_argument("audio")
+    parser.add_argument("output")
+    parser.add_argument("--model", default="small")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--beam-size", type=int, default=5)
+    parser.add_argument("--language", default="en")
+    args = parser.parse_args()
+
+    transcribe_recording(args.audio, args.output, args.model, args.compute_type,
+                         args.threads, args.beam_size, args.language)
@@ -0,0 +1,154 @@
+import logging
+from math import gcd
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Mapping, Optional
+
+import numpy as np
+
+from audio_pipeline.vad import SAMPLE_RATE
+from audio_pipeline.buffers import INT16_SCALE
+
+logger = logging.getLogger("CallimacusAudio")
+
+SAMPLE_FORMATS = {"s16": np.dtype("<i2"), "f32": np.dtype("<f4")}
+MIN_RATE, MAX_RATE = 8000, 192000
+MAX_CHANNELS = 8
+BLOCK_FRAMES = 8192             # Input frames resampled per step, so temporaries stay a fixed size
+
+#-----------------------
+# HANDSHAKE
+#-----------------------
+
+@dataclass
+class InputFormat:
+    """What the client declared in the handshake (?rate=48000&format=f32&channels=2)."""
+    rate: int = SAMPLE_RATE
+    format: str = "s16"
+    channels: int = 1
+
+    @classmethod
+    def from_query(cls, params: Mapping[str, str]) -> "InputFormat":
+        fmt = cls()
+        try:
+            fmt.rate = int(params.get("rate", SAMPLE_RATE))
+            fmt.channels = int(params.get("channels", 1))
+            fmt.format = params.get("format", "s16")
+        except ValueError:
+            pass
+        if fmt.format not in SAMPLE_FORMATS or not MIN_RATE <= fmt.rate <= MAX_RATE or not 1 <= fmt.channels <= MAX_CHANNELS:
+            logger.warning(f"⚠️ Unsupported input format {fmt.as_dict()}, assuming 16 kHz mono s16.")
+            return cls()
+        return fmt
+
+    @property
+    def is_native(self) -> bool:
+        """16 kHz mono Int16 goes straight into the ring, as before."""
+        return self.rate == SAMPLE_RATE and self.format == "s16" and self.channels == 1
+
+    @property
+    def frame_bytes(self) -> int:
+        return SAMPLE_FORMATS[self.format].itemsize * self.channels
+
+    def ffmpeg_args(self):
+        return ["-f", f"{self.format}le", "-ar", str(self.rate), "-ac", str(self.channels)]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+#-----------------------
+# RESAMPLING
+#-----------------------
+
+def design_lowpass(up: int, down: int, half_width: int = 10, beta: float = 5.0) -> np.ndarray:
+    """Kaiser-windowed sinc anti-aliasing filter at the upsampled rate (the same design as scipy's resample_poly)."""
+    max_rate = max(up, down)
+    half_len = half_width * max_rate
+    n = np.arange(-half_len, half_len + 1, dtype=np.float64)
+    h = np.sinc(n / max_rate) / max_rate * np.kaiser(2 * half_len + 1, beta)
+    return h * up
+
+
+class StreamingResampler:
+    """
+    Polyphase rational resampler (up / down) that keeps its filter history between chunks.
+    Each output sample is one dot product over a window of input samples; all windows of a
+    block are gathered with a strided view and reduced in a single einsum.
+    """
+
+    def __init__(self, rate_in: int, rate_out: int = SAMPLE_RATE):
+        g = gcd(rate_in, rate_out)
+        self.up, self.down = rate_out // g, rate_in // g
+
+        h = design_lowpass(self.up, self.down)
+        taps = -(-h.size // self.up)
+        h = np.pad(h, (0, taps * self.up - h.size))
+        # Row p holds phase p, reversed so it lines up with an ascending input window
+        self._phases = np.ascontiguousarray(h.reshape(taps, self.up).T[:, ::-1], dtype=np.float32)
+        self._taps = taps
+
+        self._history = np.zeros(taps - 1, dtype=np.float32)
+        self._consumed = 0          # Input samples seen so far
+        self._produced = 0          # Output samples emitted so far
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        if self.up == self.down:
+            return x
+        up, down, taps = self.up, self.down, self._taps
+
+        buf = np.concatenate((self._history, x))
+        base = self._consumed - (taps - 1)          # Absolute input index of buf[0]
+        self._consumed += x.size
+
+        # Every output whose newest input sample has now arrived
+        last = (self._consumed * up + down - 1) // down
+        k = np.arange(self._produced, last, dtype=np.int64)
+        self._produced = last
+
+        t = k * down
+        newest = t // up - base
+        windows = np.lib.stride_tricks.sliding_window_view(buf, taps)[newest - (taps - 1)]
+        out = np.einsum("kt,kt->k", windows, self._phases[t % up]).astype(np.float32, copy=False)
+
+        self._history = buf[buf.size - (taps - 1):].copy()
+        return out
+
+#-----------------------
+# NORMALISATION
+#-----------------------
+
+class PCMNormalizer:
+    """
+    Turns whatever the client declared into 16 kHz mono float32, block by block:
+    decode the sample format, downmix by averaging the channels, then resample.
+    A partial frame at the end of a chunk is carried over to the next one.
+    """
+
+    def __init__(self, fmt: InputFormat):
+        self.format = fmt
+        self._dtype = SAMPLE_FORMATS[fmt.format]
+        self._resampler = StreamingResampler(fmt.rate)
+        self._carry = b""
+
+    def process(self, chunk: bytes) -> np.ndarray:
+        fmt = self.format
+        if self._carry:
+            chunk = self._carry + chunk
+        usable = len(chunk) - len(chunk) % fmt.frame_bytes
+        self._carry = chunk[usable:]
+
+        samples = np.frombuffer(chunk, dtype=self._dtype, count=usable // self._dtype.itemsize)
+        frames = samples.reshape(-1, fmt.channels)
+
+        out = []
+        for first in range(0, frames.shape[0], BLOCK_FRAMES):
+            block = frames[first:first + BLOCK_FRAMES]
+            mono = block.mean(axis=1, dtype=np.float32) if fmt.channels > 1 else block[:, 0].astype(np.float32)
+            if fmt.format == "s16":
+                mono *= INT16_SCALE
+            out.append(self._resampler.process(mono))
+        return np.concatenate(out) if out else np.empty(0, dtype=np.float32)
+
+
+def make_normalizer(fmt: InputFormat) -> Optional[PCMNormalizer]:
+    """None when the client already sends what the ring expects."""
+    return None if fmt.is_native else PCMNormalizer(fmt)
@@ -0,0 +1,330 @@
+import asyncio
+import concurrent.futures
+import logging
+import time
+import zlib
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from faster_whisper import WhisperModel
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+
+logger = logging.getLogger("CallimacusAudio")
+
+MAX_DECODE_TOKENS = 448             # Whisper's decoder context
+
+# The filters WhisperModel.transcribe() applies, with its default thresholds: silence and noise
+# otherwise come back as hallucinated text
+NO_SPEECH_THRESHOLD = 0.6           # Dropped when this likely silent...
+LOG_PROB_THRESHOLD = -1.0           # ...and the decoder was this unsure (average log-probability per token)
+COMPRESSION_RATIO_THRESHOLD = 2.4   # Dropped when this repetitive (gzip ratio), e.g. "thank you thank you..."
+
+#-----------------------
+# CONFIGURATION
+#-----------------------
+
+@dataclass
+class SchedulerConfig:
+    """Knobs for the shared transcription scheduler ('transcription' section of config.json)."""
+    replicas: int = 1               # Independent Whisper instances, each pinned to its own OS thread
+    batch_size: int = 4             # Max segments decoded together in one CTranslate2 call
+    beam_size: int = 5
+    partial_beam_size: int = 1      # Draft decodes for partial transcripts are greedy
+    language: str = "en"
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "SchedulerConfig":
+        if not data:
+            return cls()
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+#-----------------------
+# BATCHED DECODING
+#-----------------------
+
+def compression_ratio(text: str) -> float:
+    data = text.encode("utf-8")
+    return len(data) / len(zlib.compress(data)) if data else 0.0
+
+
+def keep_transcript(text: str, no_speech_prob: float, avg_logprob: float) -> bool:
+    """Whether a decoded segment is speech rather than a hallucination over silence or noise."""
+    if no_speech_prob > NO_SPEECH_THRESHOLD and avg_logprob < LOG_PROB_THRESHOLD:
+        return False
+    return compression_ratio(text) <= COMPRESSION_RATIO_THRESHOLD
+
+
+def decode_batch(model: WhisperModel, batch: List[np.ndarray], beam_size: int = 5, language: str = "en") -> List[str]:
+    """
+    Decodes several (<30 s) float32 segments in a single encoder/decoder pass.
+    VAD segments are capped well below Whisper's 30 s window, so each one fits a single padded mel window.
+    Segments that fail keep_transcript() come back as "".
+    """
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language=language)
+    prompt = list(tokenizer.sot_sequence) + [tokenizer.no_timestamps]
+
+    features = np.stack([pad_or_trim(model.feature_extractor(samples)) for samples in batch])
+    encoder_output = model.encode(features)
+
+    results = model.model.generate(
+        encoder_output,
+        [prompt] * len(batch),
+        beam_size=beam_size,
+        max_length=MAX_DECODE_TOKENS,
+        return_scores=True,
+        return_no_speech_prob=True,
+    )
+    texts = []
+    for r in results:
+        tokens = r.sequences_ids[0]
+        text = tokenizer.decode(tokens).strip()
+        # The score is length-normalised; averaged like transcribe() does (over the tokens plus end-of-text)
+        avg_logprob = r.scores[0] * len(tokens) / (len(tokens) + 1)
+        texts.append(text if keep_transcript(text, r.no_speech_prob, avg_logprob) else "")
+    return texts
+
+#-----------------------
+# SCHEDULER
+#-----------------------
+
+@dataclass
+class TranscriptionJob:
+    session_id: str
+    samples: np.ndarray
+    future: asyncio.Future
+    beam_size: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class SessionWaitStats:
+    submitted: int = 0
+    completed: int = 0
+    pending: int = 0
+    partials: int = 0
+    total_wait_s: float = 0.0
+    last_wait_s: float = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        avg = self.total_wait_s / self.completed if self.completed else 0.0
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "pending": self.pending,
+            "partials": self.partials,
+            "avg_wait_s": round(avg, 3),
+            "last_wait_s": round(self.last_wait_s, 3),
+        }
+
+
+class _Replica:
+    """One Whisper instance and the single thread allowed to touch it (warm-up included)."""
+
+    def __init__(self, index: int, model: WhisperModel):
+        self.index = index
+        self.model = model
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"whisper-{index}")
+        self.batches = 0
+
+
+class TranscriptionScheduler:
+    """
+    Gathers pending segments from every audio WebSocket and decodes them in batches.
+    Sessions are served round-robin, so one talkative connection cannot starve the others.
+    """
+
+    def __init__(self, models: List[WhisperModel], config: Optional[SchedulerConfig] = None,
+                 warm_up: Optional[Callable[[WhisperModel], None]] = None):
+        self.config = config or SchedulerConfig()
+        self._warm_up = warm_up  # Run on each replica's own thread before it decodes with a new model
+        self._replicas = [_Replica(i, m) for i, m in enumerate(models)]
+        self._queues: "OrderedDict[str, Deque[TranscriptionJob]]" = OrderedDict()
+        self._ready: Deque[str] = deque()       # Round-robin order of sessions with pending work
+        self._partials: "OrderedDict[str, TranscriptionJob]" = OrderedDict()  # At most one draft per session
+        self._stats: Dict[str, SessionWaitStats] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # --- 1. LIFECYCLE ---
+
+    def _schedule_warm_up(self, replica: _Replica, model: WhisperModel):
+        # The executor runs in order, so the replica's next batch waits for this
+        def report(future: concurrent.futures.Future):
+            if not future.cancelled() and future.exception():
+                logger.error(f"❌ Warm-up failed (replica {replica.index}): {future.exception()}")
+
+        replica.executor.submit(self._warm_up, model).add_done_callback(report)
+
+    def start(self, warm: bool = True):
+        """Spawns one dispatcher task per replica on the running event loop (after a warm-up, if `warm`)."""
+        if warm and self._warm_up:
+            for replica in self._replicas:
+                self._schedule_warm_up(replica, replica.model)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._replica_loop(r)) for r in self._replicas]
+        logger.info(f"🧵 Transcription scheduler started with {len(self._replicas)} replica(s), batch size {self.config.batch_size}.")
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for replica in self._replicas:
+            replica.executor.shutdown(wait=False, cancel_futures=True)
+        for session_id in list(self._queues):
+            self.unregister_session(session_id)
+
+    def swap_models(self, models: List[WhisperModel], warm: bool = True):
+        """
+        Hot-swaps the model behind every replica. A batch already decoding keeps its old model;
+        the next batch picks up the new one, after its warm-up. The replica count stays fixed.
+        """
+        if len(models) != len(self._replicas):
+            raise ValueError(f"Expected {len(self._replicas)} models, got {len(models)}")
+        for replica, model in zip(self._replicas, models):
+            if warm and self._warm_up:
+                self._schedule_warm_up(replica, model)
+            replica.model = model
+        logger.info("🔁 Transcription scheduler switched to the new Whisper models.")
+
+    # --- 2. SESSION API ---
+
+    def register_session(self, session_id: str):
+        self._queues.setdefault(session_id, deque())
+        self._stats.setdefault(session_id, SessionWaitStats())
+
+    def unregister_session(self, session_id: str):
+        """Drops a disconnected session and cancels anything it still had queued."""
+        for job in self._queues.pop(session_id, ()):
+            job.future.cancel()
+        draft = self._partials.pop(session_id, None)
+        if draft:
+            draft.future.cancel()
+        self._stats.pop(session_id, None)
+        try:
+            self._ready.remove(session_id)
+        except ValueError:
+            pass
+
+    def submit(self, session_id: str, samples: np.ndarray, beam_size: Optional[int] = None) -> asyncio.Future:
+        """
+        Queues a segment and returns a future resolving to its transcript.
+        An overloaded session can ask for a cheaper decode by passing a smaller beam_size.
+        """
+        self.register_session(session_id)
+        job = TranscriptionJob(
+            session_id, samples, asyncio.get_running_loop().create_future(),
+            beam_size or self.config.beam_size
+        )
+
+        queue = self._queues[session_id]
+        if not queue:
+            self._ready.append(session_id)
+        queue.append(job)
+
+        stats = self._stats[session_id]
+        stats.submitted += 1
+        stats.pending += 1
+        self._wakeup.set()
+        return job.future
+
+    def submit_partial(self, session_id: str, samples: np.ndarray) -> asyncio.Future:
+        """
+        Queues a low-priority draft decode of a still-open segment.
+        A newer draft replaces one that has not started yet, since only the latest buffer matters.
+        """
+        self.register_session(session_id)
+        stale = self._partials.pop(session_id, None)
+        if stale:
+            stale.future.cancel()
+
+        job = TranscriptionJob(
+            session_id, samples, asyncio.get_running_loop().create_future(),
+            self.config.partial_beam_size
+        )
+        self._partials[session_id] = job
+        self._wakeup.set()
+        return job.future
+
+    # --- 3. DISPATCH ---
+
+    def _take_batch(self) -> Tuple[List[TranscriptionJob], bool]:
+        """
+        Takes one job per session in round-robin order until the batch is full.
+        Final segments always win; drafts only run when no final segment is waiting.
+        A batch shares one beam size, so sessions whose next job differs wait for the next batch.
+        """
+        batch = []
+        skipped = []
+        while self._ready and len(batch) < self.config.batch_size:
+            session_id = self._ready.popleft()
+            queue = self._queues.get(session_id)
+            if not queue:
+                continue
+            if batch and queue[0].beam_size != batch[0].beam_size:
+                skipped.append(session_id)
+                continue
+            batch.append(queue.popleft())
+            if queue:
+                self._ready.append(session_id)
+        # Skipped sessions keep their turn at the front of the round-robin
+        self._ready.extendleft(reversed(skipped))
+        if batch:
+            return batch, False
+
+        while self._partials and len(batch) < self.config.batch_size:
+            _, job = self._partials.popitem(last=False)
+            batch.append(job)
+        return batch, True
+
+    async def _replica_loop(self, replica: _Replica):
+        loop = asyncio.get_running_loop()
+        cfg = self.config
+        while True:
+            batch, is_draft = self._take_batch()
+            if not batch:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            started = time.monotonic()
+            for job in batch:
+                stats = self._stats.get(job.session_id)
+                if not stats:
+                    continue
+                if is_draft:
+                    stats.partials += 1
+                    continue
+                stats.pending -= 1
+                stats.last_wait_s = started - job.enqueued_at
+                stats.total_wait_s += stats.last_wait_s
+
+            try:
+                texts = await loop.run_in_executor(
+                    replica.executor, decode_batch, replica.model,
+                    [job.samples for job in batch], batch[0].beam_size, cfg.language
+                )
+            except Exception as e:
+                logger.error(f"❌ Transcription Error (replica {replica.index}): {e}")
+                texts = [""] * len(batch)
+
+            replica.batches += 1
+            for job, text in zip(batch, texts):
+                stats = self._stats.get(job.session_id)
+                if stats and not is_draft:
+                    stats.completed += 1
+                if not job.future.done():
+                    job.future.set_result(text)
+
+    # --- 4. OBSERVABILITY ---
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": sum(len(q) for q in self._queues.values()),
+            "pending_partials": len(self._partials),
+            "replicas": [{"index": r.index, "batches": r.batches} for r in self._replicas],
+            "sessions": {sid: s.as_dict() for sid, s in self._stats.items()},
+        }
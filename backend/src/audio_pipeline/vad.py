@@ -0,0 +1,232 @@
+import copy
+import logging
+import time
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+
+from audio_pipeline.buffers import PCMRingBuffer
+
+logger = logging.getLogger("CallimacusAudio")
+
+SAMPLE_RATE = 16000
+
+#-----------------------
+# CONFIGURATION
+#-----------------------
+
+@dataclass
+class VADConfig:
+    """Hysteresis and padding knobs for the streaming Silero segmenter."""
+    threshold: float = 0.5          # Probability that opens a speech segment
+    neg_threshold: float = 0.35     # Probability under which a frame counts as silence
+    min_silence_ms: int = 400       # Silence needed to close a segment (end-of-utterance latency)
+    speech_pad_ms: int = 200        # Audio kept before the onset and after the last speech frame
+    min_speech_ms: int = 250        # Segments with less speech than this never reach Whisper
+    max_segment_s: float = 10.0     # Hard cutoff for a single segment
+    frame_samples: int = 512        # Silero v4+/v5 requires 512-sample frames at 16 kHz
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "VADConfig":
+        """Builds a config from the 'vad' section of config.json, ignoring unknown keys."""
+        if not data:
+            return cls()
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+    @property
+    def frame_ms(self) -> float:
+        return 1000.0 * self.frame_samples / SAMPLE_RATE
+
+
+@dataclass
+class SpeechSegment:
+    """A closed utterance, ready for transcription."""
+    samples: np.ndarray             # float32 PCM in [-1, 1] at 16 kHz
+    start: float                    # Seconds since the session started
+    end: float
+    speech_prob: float              # Mean Silero probability over the voiced frames
+    closed_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class VADStats:
+    frames: int = 0
+    speech_frames: int = 0
+    segments_emitted: int = 0
+    segments_discarded: int = 0     # Too short to be worth a Whisper decode
+
+    def as_dict(self) -> Dict[str, int]:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+#-----------------------
+# MODEL LOADING
+#-----------------------
+
+def load_silero_vad():
+    """Loads the Silero VAD model cached by setup_models.py, without touching the network."""
+    hub_dir = Path(torch.hub.get_dir())
+    candidates = sorted(hub_dir.glob("snakers4_silero-vad_*"))
+    if not candidates:
+        raise FileNotFoundError(f"Silero VAD not found in {hub_dir}. Did you run setup_models.py?")
+
+    model, _ = torch.hub.load(
+        repo_or_dir=str(candidates[0]),
+        model="silero_vad",
+        source="local",
+    )
+    model.eval()
+    return model
+
+#-----------------------
+# STREAMING SEGMENTER
+#-----------------------
+
+class StreamingVADSegmenter:
+    """
+    Frame-level speech segmenter for a single WebSocket session.
+    Silero keeps a recurrent state between calls, so every session gets its own model copy.
+
+    Incoming PCM is converted once, in place, into a preallocated float32 ring. Silero scores
+    zero-copy frame views of that ring, and the open segment is tracked as a sample range rather
+    than a list of chunks, so steady-state streaming allocates nothing per chunk.
+    """
+
+    def __init__(self, base_model, config: Optional[VADConfig] = None):
+        self.config = config or VADConfig()
+        self.model = copy.deepcopy(base_model)
+        self.model.reset_states()
+        self.stats = VADStats()
+
+        cfg = self.config
+        n = cfg.frame_samples
+        self._pad_frames = max(1, int(cfg.speech_pad_ms / cfg.frame_ms))
+        self._silence_frames_to_close = max(1, int(cfg.min_silence_ms / cfg.frame_ms))
+        self._min_speech_frames = max(1, int(cfg.min_speech_ms / cfg.frame_ms))
+        self._max_frames = int(cfg.max_segment_s * 1000 / cfg.frame_ms)
+
+        # Ring = padding + longest segment + one unscored frame + the chunk being written.
+        # A multiple of the frame size, so frame views never straddle the wrap point.
+        self._write_budget = -(-SAMPLE_RATE // n) * n
+        capacity = (self._pad_frames + self._max_frames + 1) * n + self._write_budget
+        self.ring = PCMRingBuffer(capacity)
+
+        self._next_frame = 0                            # Absolute index of the next unscored sample
+        self._floor = 0                                 # Padding may not reach back past the previous segment
+        self._triggered = False
+        self._segment_start = 0
+        self._segment_frames = 0
+        self._silence_run = 0
+        self._voiced_frames = 0
+        self._voiced_prob_sum = 0.0
+        self.utterances = 0                             # Onsets seen so far; identifies the open segment
+
+    # --- 1. FRAME SCORING ---
+
+    def _speech_prob(self, frame: np.ndarray) -> float:
+        with torch.no_grad():
+            return float(self.model(torch.from_numpy(frame), SAMPLE_RATE).item())
+
+    # --- 2. PUBLIC API ---
+
+    def feed(self, pcm) -> List[SpeechSegment]:
+        """Consumes raw Int16 PCM bytes and returns every segment closed by them."""
+        src = memoryview(pcm).cast("B")
+        step = self._write_budget * 2                   # Bytes per bounded write
+
+        closed = []
+        for offset in range(0, len(src), step):
+            self.ring.write_int16(src[offset:offset + step])
+            self._score_pending(closed)
+        return closed
+
+    def feed_float32(self, samples: np.ndarray) -> List[SpeechSegment]:
+        """Same as feed(), for audio already normalised to 16 kHz mono float32 (see resample.py)."""
+        closed = []
+        for offset in range(0, samples.size, self._write_budget):
+            self.ring.write_float32(samples[offset:offset + self._write_budget])
+            self._score_pending(closed)
+        return closed
+
+    def _score_pending(self, closed: List[SpeechSegment]):
+        n = self.config.frame_samples
+        while self.ring.written - self._next_frame >= n:
+            segment = self._push_frame(self._next_frame)
+            self._next_frame += n
+            if segment is not None:
+                closed.append(segment)
+
+    @property
+    def is_speaking(self) -> bool:
+        return self._triggered
+
+    def current_samples(self) -> Optional[np.ndarray]:
+        """Snapshot of the segment still being recorded, for partial decoding."""
+        if not self._triggered:
+            return None
+        return self.ring.copy(self._segment_start, self._next_frame)
+
+    # --- 3. STATE MACHINE ---
+
+    def _push_frame(self, frame_start: int) -> Optional[SpeechSegment]:
+        cfg = self.config
+        n = cfg.frame_samples
+        prob = self._speech_prob(self.ring.view(frame_start, frame_start + n))
+        self.stats.frames += 1
+
+        if not self._triggered:
+            if prob >= cfg.threshold:
+                # Onset: reach back `speech_pad_ms` so the first phoneme is not clipped
+                self._triggered = True
+                self.utterances += 1
+                self._segment_start = max(self._floor, frame_start - self._pad_frames * n)
+                self._segment_frames = (frame_start - self._segment_start) // n
+                self._silence_run = 0
+                self._voiced_frames = 0
+                self._voiced_prob_sum = 0.0
+                self._append(prob, voiced=True)
+            return None
+
+        voiced = prob >= cfg.neg_threshold
+        self._append(prob, voiced)
+        self._silence_run = 0 if voiced else self._silence_run + 1
+
+        if self._silence_run >= self._silence_frames_to_close:
+            return self._close_segment()
+        if self._segment_frames >= self._max_frames:
+            return self._close_segment()
+        return None
+
+    def _append(self, prob: float, voiced: bool):
+        self._segment_frames += 1
+        if voiced:
+            self._voiced_frames += 1
+            self._voiced_prob_sum += prob
+            self.stats.speech_frames += 1
+
+    def _close_segment(self) -> Optional[SpeechSegment]:
+        n = self.config.frame_samples
+        # Keep only `speech_pad_ms` of the trailing silence
+        trim = max(0, self._silence_run - self._pad_frames)
+        start = self._segment_start
+        end = start + (self._segment_frames - trim) * n
+
+        self._triggered = False
+        self._silence_run = 0
+        self._floor = end
+
+        if self._voiced_frames < self._min_speech_frames:
+            self.stats.segments_discarded += 1
+            return None
+
+        self.stats.segments_emitted += 1
+        return SpeechSegment(
+            # The one copy per segment: it has to outlive this region of the ring while it waits for Whisper
+            samples=self.ring.copy(start, end),
+            start=start / SAMPLE_RATE,
+            end=end / SAMPLE_RATE,
+            speech_prob=self._voiced_prob_sum / self._voiced_frames,
+        )
@@ -1,111 +1,332 @@
 import os
 import json
+import asyncio
 import uuid
 import re
-from typing import Any, List, Dict
+import time
+import shutil
+import logging
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Any, List, Dict, Optional, Set
 from dotenv import load_dotenv
+from image_store import ImageStore
+from storage import open_storage, op_block_id, apply_ops, JOURNAL_SUFFIX  # noqa: F401 (re-exported)
+from search_index import SearchIndex
+from paths import DOCS_DIR, CONTEXT_DIR, TRANSCRIPTS_DIR, RECORDINGS_DIR  # noqa: F401 (re-exported)
 
 load_dotenv()
 
-# Centralized Directory Management from .env
-DOCS_DIR = os.getenv("DOCS_DIR", "./docs")
-CONTEXT_DIR = os.getenv("CONTEXT_DIR", "./context")
+logger = logging.getLogger("CallimacusAPI")
 
-os.makedirs(DOCS_DIR, exist_ok=True)
-os.makedirs(CONTEXT_DIR, exist_ok=True)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # 'json' (one file per notebook) or 'sqlite'
+STORAGE_DB = os.getenv("STORAGE_DB", "./callimachus.db")
+SEARCH_DB = os.getenv("SEARCH_DB", "./search.db")
+
+# Matches any string that looks like our image files (e.g., img_123.png)
+IMAGE_NAME_RE = re.compile(r"(img_[a-zA-Z0-9_]+\.[a-zA-Z0-9]+)")
+
+def image_names(content: str) -> Set[str]:
+    return set(IMAGE_NAME_RE.findall(content))
+
+CONTEXT_FLUSH_DELAY_S = 0.5  # Context saves within this window are coalesced into one write
+
+class VersionConflict(Exception):
+    """A block patch was made against an older version of the document than the stored one."""
+
+    def __init__(self, current: int):
+        super().__init__(f"Document is at version {current}")
+        self.current = current
+
+STORAGE = open_storage(STORAGE_BACKEND, DOCS_DIR, CONTEXT_DIR, STORAGE_DB)
+SEARCH_INDEX = SearchIndex(SEARCH_DB)
 
 # --- DOCUMENT CLASS ---
 class Document():
+    # Shared image reference index, attached by the server: every save re-registers the notebook's images
+    image_store: Optional[ImageStore] = None
+
     def __init__(self, document_name):
         self.doc_name = document_name
         self._update_paths()
         self.paragraphs: Dict[str, Dict[str, Any]] = {} 
+        self._blocks: Optional[List[Dict]] = None  # Top-level UI blocks, loaded on first use
+        self._version = 0
+        self._image_counts: Optional[Counter] = None  # Image name -> number of blocks showing it
+        # Sections of the loaded blocks, {owner_id: (heading, notes)} in document order, kept up to date by
+        # patches; sync only reconciles the stale ones (None: all of them, e.g. after a full save)
+        self._sections: Optional[Dict[str, tuple]] = None
+        self._stale_sections: Optional[Set[str]] = None
+        self._order_stale = False    # Sections or paragraphs were added, moved or removed since the last sync
+        self._dirty_pars: Optional[Set[str]] = set()  # Paragraphs changed since the last write (None: all)
+        self._ui_bytes = 0       # Serialised size estimates, for the document cache's byte budget
+        self._context_bytes = 0
+        # Editor saves run on worker threads, agent tools on the event loop: every read-modify-write of
+        # the blocks or the context holds this lock (never across an await)
+        self._lock = threading.RLock()
+        self.context_version = 0                     # Bumped on every context change
+        self._par_revs: Dict[str, int] = {}          # Paragraph -> context_version of its last change
+        self._agent_writes: Dict[str, str] = {}      # Paragraph -> its UI text when the agent last wrote it
+        self._par_locks: Dict[str, asyncio.Lock] = {}
+        self._conflicts: Set[str] = set()            # Paragraphs whose compiled output replace_paragraph() rejected
+        self._pins = 0           # Requests and agent runs using this instance (see DocumentCache.pinned)
+        self.deleted = False     # Set by delete(): later context saves are dropped, not written back
         # Automatically load existing paragraphs when the document is instantiated
         self._load_context()
 
     def _update_paths(self):
-        """Updates internal file paths based on the current doc_name."""
-        self.doc_file_path = os.path.join(DOCS_DIR, f"{self.doc_name}.json")
-        self.context_file_path = os.path.join(CONTEXT_DIR, f"{self.doc_name}_cx.json")
+        """Updates internal file paths based on the current doc_name (the notebook itself lives in STORAGE)."""
+        self.transcript_file_path = os.path.join(TRANSCRIPTS_DIR, f"{self.doc_name}.jsonl")
+        self.refined_file_path = os.path.join(TRANSCRIPTS_DIR, f"{self.doc_name}.refined.jsonl")
+        self.recordings_dir = os.path.join(RECORDINGS_DIR, self.doc_name)
 
     # --- 1. CORE I/O METHODS ---
 
     def _load_context(self):
-        """Loads AI context from disk into memory."""
-        if os.path.exists(self.context_file_path):
+        """Loads AI context from storage into memory."""
+        try:
+            self.paragraphs = STORAGE.load_context(self.doc_name)
+        except Exception:
+            self.paragraphs = {}
+        self._context_bytes = len(json.dumps(self.paragraphs))
+
+    def _save_context(self, *par_ids: str):
+        """
+        Schedules a save of the AI context (write-behind: call flush() when it must be stored now).
+        With par_ids only those paragraphs are rewritten (row-based storage); without, the whole context.
+        """
+        if not par_ids:
+            self._dirty_pars = None
+        elif self._dirty_pars is not None:
+            self._dirty_pars.update(par_ids)
+        CONTEXT_WRITER.mark(self)
+
+    def _write_context(self) -> int:
+        """Writes the pending context changes to storage. Returns the bytes written."""
+        with self._lock:
+            if self.deleted:
+                return 0
+            changed, self._dirty_pars = self._dirty_pars, set()
             try:
-                with open(self.context_file_path, "r", encoding="utf-8") as f:
-                    self.paragraphs = json.load(f)
+                written = STORAGE.save_context(self.doc_name, self.paragraphs, changed)
             except Exception:
-                self.paragraphs = {}
-        else:
-            self.paragraphs = {}
+                self._dirty_pars = None  # Try everything again next time
+                raise
+            SEARCH_INDEX.index_context(self.doc_name, self.paragraphs, changed)
+        if changed is None:
+            self._context_bytes = written
+        return written
 
-    def _save_context(self):
-        """Saves the AI context to the context directory."""
-        try:
-            with open(self.context_file_path, "w", encoding="utf-8") as f:
-                json.dump(self.paragraphs, f, indent=4)
-        except Exception as e:
-            print(f"Error saving context for {self.doc_name}: {e}")
+    def flush(self):
+        """Writes a pending context save right away."""
+        CONTEXT_WRITER.flush(self)
     
+    @staticmethod
+    def holder(doc_name: str) -> str:
+        return f"doc:{doc_name}"
+
+    def paragraph_lock(self, par_id: str) -> asyncio.Lock:
+        """Serialises agent runs on one paragraph; runs on different paragraphs proceed in parallel."""
+        lock = self._par_locks.get(par_id)
+        if lock is None:
+            lock = self._par_locks[par_id] = asyncio.Lock()
+        return lock
+
+    def busy(self) -> bool:
+        """True while the instance is pinned or an agent run holds a paragraph lock (it must stay cached)."""
+        return self._pins > 0 or any(lock.locked() for lock in self._par_locks.values())
+
+    def _prune_locks(self, *par_ids: str):
+        """Drops idle paragraph locks: those of `par_ids`, or all of them."""
+        for par_id in par_ids or list(self._par_locks):
+            lock = self._par_locks.get(par_id)
+            if lock is not None and not lock.locked():
+                del self._par_locks[par_id]
+
+    def take_conflict(self, par_id: str) -> bool:
+        """Whether a compile of the paragraph was rejected since the last call; clears the flag."""
+        with self._lock:
+            if par_id not in self._conflicts:
+                return False
+            self._conflicts.discard(par_id)
+            return True
+
+    def paragraph_rev(self, par_id: str) -> int:
+        """The context version at which the paragraph last changed: the token for replace_paragraph()."""
+        return self._par_revs.get(par_id, 0)
+
+    def _touch(self, *par_ids: str):
+        """Records a context change to the given paragraphs and schedules their save."""
+        self.context_version += 1
+        for par_id in par_ids:
+            self._par_revs[par_id] = self.context_version
+        self._save_context(*par_ids)
+
     # --- PUBLIC METHODS ---
 
     @staticmethod
-    def get_all_documents() -> List[Dict[str, str]]:
-        """Static helper to list all available documents in the directory."""
-        docs = []
-        for file_name in os.listdir(DOCS_DIR):
-            if file_name.endswith(".json"):
-                stem = file_name[:-5]
-                docs.append({
-                    "id": stem,
-                    "name": stem.replace("_", " ").replace("-", " ").title()
-                })
-        return docs
+    def get_all_documents() -> List[Dict[str, Any]]:
+        """Static helper to list all available documents in storage."""
+        return STORAGE.catalog()[1]
+
+    @staticmethod
+    def catalog(sort: str = "name", descending: bool = False, offset: int = 0, limit: Optional[int] = None) -> Dict:
+        """
+        A page of the notebook catalog (id, name, mtime, bytes, paragraphs, compiled_at), served from the
+        storage's index rather than by opening the notebooks. Raises ValueError on an unknown sort.
+        """
+        total, items = STORAGE.catalog(sort, descending, offset, limit)
+        return {"total": total, "offset": offset, "items": items}
+
+    def exists(self) -> bool:
+        return STORAGE.exists(self.doc_name)
     
-    def save_ui_document(self, content: str):
-        """Saves the raw JSON string from the React frontend to disk."""
-        with open(self.doc_file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+    def _load_blocks(self) -> List[Dict]:
+        """The UI blocks, read from storage once and then kept in memory."""
+        if self._blocks is None:
+            self._blocks, self._version = STORAGE.load_blocks(self.doc_name)
+            self._ui_bytes = len(json.dumps(self._blocks))
+        return self._blocks
+
+    def memory_bytes(self) -> int:
+        """Rough in-memory footprint: the serialised size of the loaded blocks and contexts."""
+        return self._ui_bytes + self._context_bytes
+
+    @property
+    def version(self) -> int:
+        self._load_blocks()
+        return self._version
+
+    def save_ui_document(self, content: str) -> int:
+        """Saves the raw JSON string from the React frontend to disk, replacing every block. Returns the new version."""
+        blocks = json.loads(content)
+        if not isinstance(blocks, list):
+            raise ValueError("A document is a list of blocks")
+        with self._lock:
+            version = self.version + 1
+            STORAGE.save_blocks(self.doc_name, blocks, version, content)
+            self._blocks = blocks
+            self._version = version
+            self._ui_bytes = len(content)
+            self._image_counts = None
+            self._sections = self._stale_sections = None
+            if self.image_store is not None:
+                self.image_store.set_refs(self.holder(self.doc_name), image_names(content))
+            SEARCH_INDEX.index_blocks(self.doc_name, blocks)
+            return version
+
+    def apply_patch(self, base_version: int, ops: List[Dict]) -> int:
+        """
+        Applies block operations made against `base_version` and stores just the blocks they touched.
+        Returns the new version. Raises VersionConflict if the document moved on since, ValueError on a bad op.
+        """
+        with self._lock:
+            blocks = self._load_blocks()
+            if base_version != self._version:
+                raise VersionConflict(self._version)
+            new_blocks = apply_ops(blocks, ops)
+
+            version = self._version + 1
+            STORAGE.append_patch(self.doc_name, version, ops, new_blocks)
+            self._blocks = new_blocks
+            self._version = version
+
+            # Only the blocks the patch touched are re-serialised (and their sections reparsed)
+            touched = {op_block_id(op) for op in ops}
+            self._update_sections(blocks, new_blocks, ops, touched)
+            old_json = [json.dumps(b) for b in blocks if b.get("id") in touched]
+            new_json = [json.dumps(b) for b in new_blocks if b.get("id") in touched]
+            self._ui_bytes += sum(map(len, new_json)) - sum(map(len, old_json))
+            if self.image_store is not None:
+                self._update_image_refs(blocks, old_json, new_json)
+            SEARCH_INDEX.index_blocks(self.doc_name, new_blocks, touched)
+            return version
+
+    def _update_image_refs(self, old_blocks: List[Dict], old_json: List[str], new_json: List[str]):
+        if self._image_counts is None:
+            self._image_counts = Counter()
+            for block in old_blocks:
+                self._image_counts.update(image_names(json.dumps(block)))
+        for text in old_json:
+            self._image_counts.subtract(image_names(text))
+        for text in new_json:
+            self._image_counts.update(image_names(text))
+        names = {name for name, count in self._image_counts.items() if count > 0}
+        self.image_store.set_refs(self.holder(self.doc_name), names)
+
+    @staticmethod
+    def reindex_images(store: ImageStore) -> int:
+        """
+        Brings the image index in line with the stored notebooks. Only notebooks written after the index
+        was last saved (i.e. lost in a crash) are read, or all of them the first time; holders of notebooks
+        gone from storage are dropped. Returns the number of notebooks read.
+        """
+        read = 0
+        # Images of blocks deleted by a journaled patch stay held until the next save: harmless
+        for name, text in STORAGE.changed_since(store.notebooks_indexed_at):
+            store.set_refs(Document.holder(name), image_names(text))
+            read += 1
+        names = set(STORAGE.list_documents())
+        for holder in list(store.holders):
+            if holder.startswith("doc:") and holder[4:] not in names:
+                store.drop(holder)
+        store.notebooks_indexed = True
+        store.flush()
+        return read
     
     def get_ui_document(self) -> str:
-        """Reads the raw JSON string of the UI document from disk."""
-        if not os.path.exists(self.doc_file_path):
-            return "[]"
-        with open(self.doc_file_path, "r", encoding="utf-8") as f:
-            return f.read()
+        """The JSON string of the UI document, including patches not yet folded into the file."""
+        return json.dumps(self._load_blocks())
         
     def rename(self, new_name: str) -> bool:
         """Safely renames both the UI document and the Context document."""
-        new_doc_path = os.path.join(DOCS_DIR, f"{new_name}.json")
-        new_ctx_path = os.path.join(CONTEXT_DIR, f"{new_name}_cx.json")
-
-        if os.path.exists(new_doc_path):
+        self.flush()
+        if not STORAGE.rename(self.doc_name, new_name):
             return False # Target name already exists
 
-        # Rename UI doc
-        if os.path.exists(self.doc_file_path):
-            os.rename(self.doc_file_path, new_doc_path)
-        
-        # Rename Context doc
-        if os.path.exists(self.context_file_path):
-            os.rename(self.context_file_path, new_ctx_path)
+        # Rename the audio transcript log
+        if os.path.exists(self.transcript_file_path):
+            os.rename(self.transcript_file_path, os.path.join(TRANSCRIPTS_DIR, f"{new_name}.jsonl"))
+        if os.path.exists(self.refined_file_path):
+            os.rename(self.refined_file_path, os.path.join(TRANSCRIPTS_DIR, f"{new_name}.refined.jsonl"))
+
+        # Move the saved session audio
+        if os.path.isdir(self.recordings_dir):
+            shutil.move(self.recordings_dir, os.path.join(RECORDINGS_DIR, new_name))
+
+        if self.image_store is not None:
+            self.image_store.rename_holder(self.holder(self.doc_name), self.holder(new_name))
+        SEARCH_INDEX.rename(self.doc_name, new_name)
 
         self.doc_name = new_name
         self._update_paths()
         return True
+
+    def delete(self):
+        """Removes the notebook, its context, transcripts and saved audio."""
+        with self._lock:
+            self.deleted = True  # An agent run still holding the instance must not write the context back
+        CONTEXT_WRITER.discard(self.doc_name)
+        STORAGE.delete(self.doc_name)
+        SEARCH_INDEX.delete(self.doc_name)
+        for path in (self.transcript_file_path, self.refined_file_path):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(self.recordings_dir, ignore_errors=True)
     
     def update_paragraph_metadata(self, par_id: str, audio: str, ocr: str, notes: str = ""):
         """Updates just the AI inputs for a specific paragraph."""
-        if par_id not in self.paragraphs:
-            self.paragraphs[par_id] = {"audio": "", "ocr": "", "notes": "", "additional_notes": ""}
-        self.paragraphs[par_id]["audio"] = audio
-        self.paragraphs[par_id]["ocr"] = ocr
-        if notes:
-            self.paragraphs[par_id]["notes"] = notes
-            
-        self._save_context()
+        with self._lock:
+            if par_id not in self.paragraphs:
+                self.paragraphs[par_id] = {"audio": "", "ocr": "", "notes": "", "additional_notes": ""}
+                self._order_stale = True
+            self.paragraphs[par_id]["audio"] = audio
+            self.paragraphs[par_id]["ocr"] = ocr
+            if notes:
+                self.paragraphs[par_id]["notes"] = notes
+            self._recheck(par_id)  # Next sync compares the section with the UI again
+            self._touch(par_id)
 
     def get_paragraph(self, par_id: str) -> Dict:
         par_dict = self.paragraphs.get(par_id, {})
@@ -115,99 +336,432 @@ class Document():
                 "audio": par_dict.get("audio", ""), 
                 "ocr": par_dict.get("ocr", ""), 
                 "notes": par_dict.get("notes", ""), 
-                "additional": par_dict.get("additional_notes", "")
+                "additional": par_dict.get("additional_notes", ""),
+                "rev": self.paragraph_rev(par_id)
             }
         return {"success": False, "error": f"Paragraph {par_id} not found"}
 
-    def replace_paragraph(self, par_id: str, content: str):
-        """Updates the context memory AND the synchronized UI Document."""
-        if par_id not in self.paragraphs:
-            self.paragraphs[par_id] = {}
-        
-        self.paragraphs[par_id]["notes"] = content
-        
-        # 1. Save the backend context
-        self._save_context()
-        
+    def replace_paragraph(self, par_id: str, content: str, expected_rev: Optional[int] = None):
+        """
+        Updates the context memory AND the synchronized UI Document.
+        With `expected_rev` (from get_paragraph) the write is rejected if the paragraph changed since.
+        """
+        with self._lock:
+            if expected_rev is not None and self.paragraph_rev(par_id) != expected_rev:
+                self._conflicts.add(par_id)
+                return {"success": False, "error": f"Paragraph {par_id} was changed while it was being compiled"}
+            if par_id not in self.paragraphs:
+                self.paragraphs[par_id] = {}
+                self._order_stale = True
+
+            self.paragraphs[par_id]["notes"] = content
+            self._recheck(par_id)
+            # The UI shows the old text until the editor inserts the output: until then sync must not undo it
+            self._agent_writes[par_id] = self._section_map().get(par_id, ("", ""))[1]
+
+            # 1. Save the backend context
+            self._touch(par_id)
+            STORAGE.mark_compiled(self.doc_name, time.time())
+
         return {"success": True, "message": "Paragraph updated in both Context and UI Document."}
 
     def add_image(self, par_id: str, image_desc: str, image_url: str):
-        if par_id not in self.paragraphs:
-            self.paragraphs[par_id] = {}
-        
-        self.paragraphs[par_id]["image"] = {"description": image_desc, "url": image_url}
-        self._save_document()
+        with self._lock:
+            if par_id not in self.paragraphs:
+                self.paragraphs[par_id] = {}
+                self._order_stale = True
+
+            self.paragraphs[par_id]["image"] = {"description": image_desc, "url": image_url}
+            self._recheck(par_id)
+            self._touch(par_id)
         return {"success": True}
     
     def add_additional_note(self, par_id: str, note: str):
-        if par_id not in self.paragraphs:
-            return {"success": False, "error": f"Paragraph {par_id} not found"}
-            
-        existing = self.paragraphs[par_id].get("additional_notes", "")
-        self.paragraphs[par_id]["additional_notes"] = existing + "\n" + note if existing else note
-        
-        self._save_context()
+        with self._lock:
+            if par_id not in self.paragraphs:
+                return {"success": False, "error": f"Paragraph {par_id} not found"}
+
+            existing = self.paragraphs[par_id].get("additional_notes", "")
+            self.paragraphs[par_id]["additional_notes"] = existing + "\n" + note if existing else note
+            self._touch(par_id)
         return {"success": True, "message": f"Note added to {par_id}"}
     
     # --- 2. RECONCILIATION & AI MEMORY ---
 
-    def sync_context_from_ui(self):
+    @staticmethod
+    def _block_text(block: Dict) -> str:
+        return "".join([p.get("text", "") for p in block.get("content", []) if isinstance(p, dict)])
+
+    @staticmethod
+    def parse_sections(ui_blocks: List[Dict]) -> Dict[str, tuple]:
         """
-        Reads the latest UI JSON from disk and rebuilds the AI context.
-        This flawlessly handles MERGING paragraphs and PRUNING deleted ones.
+        Splits the UI blocks into heading sections, in document order: {owner_id: (heading, notes)}.
+        Text before the first heading belongs to "doc-start"; a section runs until the next heading.
         """
-        ui_content = self.get_ui_document()
-        if not ui_content or ui_content == "[]":
-            return
-            
-        try:
-            ui_blocks = json.loads(ui_content)
-        except Exception:
-            return
-
-        new_context = {}
+        sections = {}
         current_owner_id = "doc-start"
+        current_heading = "Document Start"
         accumulated_text = []
 
-        # Initialize the starting bucket, preserving existing AI metadata but wiping old notes
-        old_start = self.paragraphs.get("doc-start", {})
-        new_context["doc-start"] = {
-            "heading": "Document Start", 
-            "audio": old_start.get("audio", ""),
-            "ocr": old_start.get("ocr", ""),
-            "additional_notes": old_start.get("additional_notes", ""),
-            "notes": ""
-        }
-
         for block in ui_blocks:
             if block.get("type") == "heading":
                 # Flush text to previous owner
-                new_context[current_owner_id]["notes"] = "\n\n".join(accumulated_text)
-                
-                # Setup new owner
+                sections[current_owner_id] = (current_heading, "\n\n".join(accumulated_text))
                 current_owner_id = block["id"]
+                current_heading = Document._block_text(block).strip()
                 accumulated_text = []
-
-                heading_text = "".join([p.get("text", "") for p in block.get("content", []) if isinstance(p, dict)]).strip()
-                
-                old_meta = self.paragraphs.get(current_owner_id, {})
-                new_context[current_owner_id] = {
-                    "heading": heading_text,
-                    "audio": old_meta.get("audio", ""),
-                    "ocr": old_meta.get("ocr", ""),
-                    "additional_notes": old_meta.get("additional_notes", ""),
-                    "notes": ""
-                }
             elif block.get("content"):
-                text = "".join([p.get("text", "") for p in block["content"] if isinstance(p, dict)])
-                if text.strip(): 
+                text = Document._block_text(block)
+                if text.strip():
                     accumulated_text.append(text)
 
         # Final flush
-        new_context[current_owner_id]["notes"] = "\n\n".join(accumulated_text)
+        sections[current_owner_id] = (current_heading, "\n\n".join(accumulated_text))
+        return sections
+
+    @staticmethod
+    def _owner_at(blocks: List[Dict], i: int) -> str:
+        """The section the block at index `i` belongs to (its own, for a heading)."""
+        while i >= 0:
+            if blocks[i].get("type") == "heading":
+                return blocks[i]["id"]
+            i -= 1
+        return "doc-start"
+
+    @staticmethod
+    def _parse_section(blocks: List[Dict], owner_id: str, index: Dict[str, int]) -> tuple:
+        """(heading, notes) of one section, as parse_sections() reads it."""
+        if owner_id == "doc-start":
+            start, heading_text = 0, "Document Start"
+        else:
+            start = index[owner_id] + 1
+            heading_text = Document._block_text(blocks[start - 1]).strip()
+        accumulated_text = []
+        for block in blocks[start:]:
+            if block.get("type") == "heading":
+                break
+            if block.get("content"):
+                text = Document._block_text(block)
+                if text.strip():
+                    accumulated_text.append(text)
+        return heading_text, "\n\n".join(accumulated_text)
+
+    def _section_map(self) -> Dict[str, tuple]:
+        """The parsed sections of the current blocks; the first call parses the whole notebook."""
+        if self._sections is None:
+            self._sections = self.parse_sections(self._load_blocks())
+            self._stale_sections = None
+        return self._sections
+
+    def _recheck(self, par_id: str):
+        """Makes the next sync compare one paragraph with its section in the UI."""
+        if self._stale_sections is not None:
+            self._stale_sections.add(par_id)
+
+    def _update_sections(self, old_blocks: List[Dict], new_blocks: List[Dict], ops: List[Dict], touched: Set[str]):
+        """
+        Reparses the sections a patch touched: those its blocks left and joined and, around a heading that
+        was added, moved or removed, the section it split or merged into. The rest of the notebook is not read.
+        """
+        if self._sections is None:
+            return  # Parsed in full on first use
+        old_index = {b.get("id"): i for i, b in enumerate(old_blocks)}
+        new_index = {b.get("id"): i for i, b in enumerate(new_blocks)}
+
+        def headings(blocks, index):
+            return {b for b in touched if b in index and blocks[index[b]].get("type") == "heading"}
+
+        affected = set()
+        for blocks, index in ((old_blocks, old_index), (new_blocks, new_index)):
+            for block_id in touched:
+                i = index.get(block_id)
+                if i is None:
+                    continue
+                affected.add(self._owner_at(blocks, i))
+                if blocks[i].get("type") == "heading":
+                    affected.add(self._owner_at(blocks, i - 1))
+
+        for owner_id in affected:
+            if owner_id == "doc-start" or (owner_id in new_index and new_blocks[new_index[owner_id]].get("type") == "heading"):
+                self._sections[owner_id] = self._parse_section(new_blocks, owner_id, new_index)
+            else:
+                self._sections.pop(owner_id, None)
+
+        old_headings, new_headings = headings(old_blocks, old_index), headings(new_blocks, new_index)
+        placed = {op_block_id(op) for op in ops if op["op"] != "update"}
+        if old_headings != new_headings or (old_headings | new_headings) & placed:
+            # Sections were added, moved or removed: restore document order
+            order = ["doc-start"] + [b["id"] for b in new_blocks if b.get("type") == "heading"]
+            self._sections = {
+                owner_id: self._sections.get(owner_id) or self._parse_section(new_blocks, owner_id, new_index)
+                for owner_id in order
+            }
+            self._order_stale = True
+        if self._stale_sections is not None:
+            self._stale_sections.update(affected)
+
+    def sync_context_from_ui(self):
+        """
+        Reconciles the AI context with the latest UI blocks.
+        Only sections whose heading or text changed are rewritten (keeping their audio/ocr/additional
+        notes); sections gone from the UI are pruned, so deleting a heading MERGES its text upward.
+        Only changed paragraphs are stored, and nothing at all if the UI is unchanged.
+        Notes the agent wrote are kept for as long as the section's text in the UI is the one it replaced.
+        """
+        with self._lock:
+            ui_blocks = self._load_blocks()
+            if not ui_blocks or self._stale_sections == set():
+                return
+
+            # After a patch only the sections it touched are compared; otherwise every one of them
+            full = self._sections is None or self._stale_sections is None
+            sections = self._section_map()
+            check = set(sections) | set(self.paragraphs) if full else self._stale_sections
+            changed = set()
+
+            for owner_id in [k for k in self.paragraphs if k in check and k not in sections]:
+                del self.paragraphs[owner_id]
+                self._agent_writes.pop(owner_id, None)
+                changed.add(owner_id)
+            gone = [par_id for par_id in self._par_locks if (full or par_id in check) and par_id not in sections]
+            if gone:
+                self._prune_locks(*gone)
+
+            for owner_id in list(sections) if full else check & sections.keys():
+                heading_text, notes = sections[owner_id]
+                meta = self.paragraphs.get(owner_id)
+                if owner_id in self._agent_writes:
+                    if notes != self._agent_writes[owner_id]:
+                        del self._agent_writes[owner_id]
+                    elif meta is not None:
+                        notes = meta.get("notes", "")
+                if meta is not None and meta.get("heading") == heading_text and meta.get("notes") == notes:
+                    continue
+                if meta is None:
+                    meta = self.paragraphs[owner_id] = {"audio": "", "ocr": "", "additional_notes": ""}
+                    self._order_stale = True
+                # Updated in place: a paragraph's entry is never swapped under a concurrent writer
+                meta["heading"] = heading_text
+                meta["notes"] = notes
+                changed.add(owner_id)
+
+            self._stale_sections = set()
+            # Keep the context in document order when sections were inserted or moved (a full rewrite)
+            reordered = (full or self._order_stale) and list(self.paragraphs) != list(sections)
+            self._order_stale = False
+            if reordered:
+                self.paragraphs = {owner_id: self.paragraphs[owner_id] for owner_id in sections}
+            if changed or reordered:
+                self._touch(*changed)
+            if reordered:
+                self._dirty_pars = None
+
+
+# --- DOCUMENT CACHE ---
+
+class DocumentCache():
+    """
+    The open notebooks, by id. Least recently used ones are dropped once there are more than
+    `max_entries` of them or their estimated footprint exceeds `max_bytes`; a pending context save is
+    flushed first (blocks are always stored synchronously). A miss on a stored notebook reloads it.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._docs: "OrderedDict[str, Document]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, doc_id: str, default: Optional[Document] = None) -> Optional[Document]:
+        """The cached instance, else the stored notebook (loaded and cached), else `default`."""
+        with self._lock:
+            doc = self._docs.get(doc_id)
+            if doc is not None:
+                self.hits += 1
+                self._docs.move_to_end(doc_id)
+                return doc
+            if not STORAGE.exists(doc_id):
+                return default
+            self.misses += 1
+            doc = Document(doc_id)
+            self[doc_id] = doc
+            return doc
+
+    @contextmanager
+    def pinned(self, doc_id: str, create: bool = True):
+        """
+        Yields the instance (get(), or open() with `create`; None if it is missing) and keeps it from
+        being evicted until the block exits, so a second instance can never be loaded while it is in use.
+        """
+        with self._lock:
+            doc = self.open(doc_id) if create else self.get(doc_id)
+            if doc is not None:
+                doc._pins += 1
+        try:
+            yield doc
+        finally:
+            if doc is not None:
+                with self._lock:
+                    doc._pins -= 1
+                    self.evict()
+
+    def open(self, doc_id: str) -> Document:
+        """Like get(), but creates an empty Document for an id that is not stored yet."""
+        with self._lock:
+            doc = self.get(doc_id)
+            if doc is None:
+                self.misses += 1
+                doc = Document(doc_id)
+                self[doc_id] = doc
+            return doc
+
+    def __getitem__(self, doc_id: str) -> Document:
+        doc = self.get(doc_id)
+        if doc is None:
+            raise KeyError(doc_id)
+        return doc
+
+    def __setitem__(self, doc_id: str, doc: Document):
+        with self._lock:
+            self._docs[doc_id] = doc
+            self._docs.move_to_end(doc_id)
+            self.evict()
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def pop(self, doc_id: str, default: Optional[Document] = None) -> Optional[Document]:
+        with self._lock:
+            return self._docs.pop(doc_id, default)
+
+    def rename(self, old_id: str, new_id: str):
+        with self._lock:
+            doc = self._docs.pop(old_id, None)
+            if doc is not None:
+                self[new_id] = doc
+
+    def memory_bytes(self) -> int:
+        return sum(doc.memory_bytes() for doc in self._docs.values())
+
+    def evict(self) -> int:
+        """
+        Drops least recently used documents until both limits hold (the newest one always stays).
+        Busy documents (pinned by a request, or with an agent run in progress) are skipped.
+        """
+        with self._lock:
+            evicted = 0
+            total = self.memory_bytes()
+            for doc_id in list(self._docs)[:-1]:
+                if len(self._docs) <= self.max_entries and total <= self.max_bytes:
+                    break
+                doc = self._docs[doc_id]
+                if doc.busy():
+                    continue
+                del self._docs[doc_id]
+                doc._prune_locks()
+                doc.flush()
+                total -= doc.memory_bytes()
+                evicted += 1
+            self.evictions += evicted
+            return evicted
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "open": len(self._docs),
+            "bytes": self.memory_bytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+# --- CONTEXT WRITE-BEHIND ---
+
+class ContextWriter():
+    """
+    Coalesces context saves: a document marked dirty is written once, `delay_s` after its first save
+    request, however many requests arrive in between. A single daemon thread does the writing.
+    """
+
+    def __init__(self, delay_s: float = CONTEXT_FLUSH_DELAY_S):
+        self.delay_s = delay_s
+        self.requested = 0
+        self.written = 0
+        self.bytes_written = 0
+        self._pending: Dict[Document, float] = {}  # Document -> when it is due
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def mark(self, doc: Document):
+        if doc.deleted:
+            return
+        with self._cond:
+            self.requested += 1
+            if doc not in self._pending:
+                self._pending[doc] = time.monotonic() + self.delay_s
+                self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="context-writer", daemon=True)
+                self._thread.start()
+
+    def discard(self, doc_name: str):
+        """Forgets the pending saves of every instance of a notebook, e.g. because it is being deleted."""
+        with self._cond:
+            for doc in [doc for doc in self._pending if doc.doc_name == doc_name]:
+                del self._pending[doc]
+
+    def flush(self, doc: Document):
+        with self._cond:
+            due = self._pending.pop(doc, None) is not None
+        if due:
+            self._write(doc)
+
+    def flush_all(self):
+        with self._cond:
+            due = list(self._pending)
+            self._pending.clear()
+        for doc in due:
+            self._write(doc)
+
+    def _write(self, doc: Document):
+        try:
+            size = doc._write_context()
+        except Exception:
+            logger.exception(f"❌ Error saving context for {doc.doc_name}")
+            return
+        with self._cond:
+            self.written += 1
+            self.bytes_written += size
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                wait = min(self._pending.values()) - now
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                due = [doc for doc, at in self._pending.items() if at <= now]
+                for doc in due:
+                    del self._pending[doc]
+            for doc in due:
+                self._write(doc)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requested": self.requested,
+            "written": self.written,
+            "coalesced": self.requested - self.written - len(self._pending),
+            "pending": len(self._pending),
+            "bytes_written": self.bytes_written,
+        }
 
-        # Atomic swap and save
-        self.paragraphs = new_context
-        self._save_context()
 
-        
\ No newline at end of file
+CONTEXT_WRITER = ContextWriter()
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import uuid
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger("CallimacusAPI")
+
+DIGEST_CHARS = 24
+IMAGE_PREFIXES = ("temp_", "img_")
+VARIANTS_DIRNAME = "variants"   # Transcoded copies: {images_dir}/variants/{stem}/ (see image_variants)
+
+# --- CONTENT ADDRESSING ---
+
+def store_image(images_dir: Path, data: bytes, ext: str, prefix: str = "temp") -> Tuple[str, bool]:
+    """
+    Writes image bytes under {prefix}_{sha256}.{ext}; returns the filename and whether it had to be
+    written (False: an identical file was already there). Identical bytes map to
+    the same file, so a logo repeated on every slide (or an image uploaded twice) is written once.
+    Safe across threads and processes: files appear atomically, and a duplicate write is a no-op.
+    """
+    name = f"{prefix}_{hashlib.sha256(data).hexdigest()[:DIGEST_CHARS]}.{ext.lower()}"
+    path = images_dir / name
+    if path.exists():
+        return name, False
+    partial = images_dir / f"temp_{uuid.uuid4().hex}.part"  # A crash leaves an ordinary temp orphan
+    with open(partial, "wb") as f:
+        f.write(data)
+    os.replace(partial, path)
+    return name, True
+
+
+def variant_dir(images_dir: Path, name: str) -> Path:
+    return images_dir / VARIANTS_DIRNAME / Path(name).stem
+
+
+def discard_variants(images_dir: Path, name: str):
+    """Deletes the transcoded copies of an image; call whenever the image itself is deleted."""
+    shutil.rmtree(variant_dir(images_dir, name), ignore_errors=True)
+
+# --- IMAGE STORE CLASS ---
+
+class ImageStore():
+    """
+    Reference counts for the shared image files. Each holder (e.g. "pdf:{cache key}", "doc:{doc id}")
+    owns a set of filenames; a file's count is the number of holders that list it, and a temp file
+    nobody holds is deleted as soon as its last holder lets go. Permanent img_ files that lose their
+    last holder (or were written and never picked up) become candidates, reclaimed by sweep() after a
+    grace period. Holders and candidates are persisted to a small JSON index (write-behind: call
+    flush()), so sweeps never have to rediscover references by scanning.
+    """
+
+    def __init__(self, images_dir: Path, index_path: Path):
+        self.images_dir = images_dir
+        self.index_path = index_path
+        self.holders: Dict[str, Set[str]] = {}
+        self.refs: Dict[str, int] = {}
+        self.candidates: Dict[str, float] = {}  # Unreferenced files, by when they became so
+        self.saved_at = 0.0
+        self.notebooks_indexed = False          # Set once every notebook has registered its images
+        self.notebooks_indexed_at = 0.0         # Notebooks written after this may be missing from the index
+        self.swept = 0
+        self.deduplicated = 0
+        self.written = 0
+        self.on_delete: Optional[Callable[[str], None]] = None  # Told about every deleted file (e.g. to drop cached variants)
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            data = json.loads(self.index_path.read_text())
+        except Exception:
+            return  # Unreadable index: holders re-register as they are used
+        self.saved_at = data.get("saved_at", 0.0)
+        self.notebooks_indexed = data.get("notebooks_indexed", False)
+        if self.notebooks_indexed:
+            self.notebooks_indexed_at = self.saved_at
+        self.candidates = data.get("candidates", {})
+        for holder, names in data.get("holders", {}).items():
+            self._set(holder, set(names))
+
+    # --- 1. WRITES ---
+
+    def put(self, data: bytes, ext: str, prefix: str = "temp") -> str:
+        name, written = store_image(self.images_dir, data, ext, prefix)
+        self.count(written)
+        self.track(name)
+        return name
+
+    def track(self, name: str):
+        """Registers a file just handed out: unless something picks it up in time, sweep() reclaims it."""
+        with self._lock:
+            if not self.refs.get(name):
+                self.candidates[name] = time.time()
+                self._dirty = True
+
+    def count(self, written: bool):
+        with self._lock:
+            if written:
+                self.written += 1
+            else:
+                self.deduplicated += 1
+
+    # --- 2. REFERENCES ---
+
+    def _set(self, holder: str, names: Set[str]) -> List[str]:
+        """Replaces a holder's set; returns the names whose count dropped to zero. Caller holds the lock."""
+        old = self.holders.get(holder, set())
+        for name in names - old:
+            self.refs[name] = self.refs.get(name, 0) + 1
+            self.candidates.pop(name, None)
+        released = []
+        for name in old - names:
+            self.refs[name] -= 1
+            if self.refs[name] <= 0:
+                del self.refs[name]
+                released.append(name)
+        if names:
+            self.holders[holder] = names
+        else:
+            self.holders.pop(holder, None)
+        self._dirty = self._dirty or names != old
+        return released
+
+    def add_refs(self, holder: str, names: Iterable[str]):
+        with self._lock:
+            self._set(holder, self.holders.get(holder, set()) | set(names))
+
+    def set_refs(self, holder: str, names: Iterable[str]) -> int:
+        """Replaces everything a holder references. Returns the number of temp files deleted as a result."""
+        with self._lock:
+            released = self._set(holder, set(names))
+        return self._release(released)
+
+    def drop(self, holder: str) -> int:
+        return self.set_refs(holder, ())
+
+    def rename_holder(self, old: str, new: str):
+        with self._lock:
+            names = self.holders.pop(old, None)
+            if names is not None:
+                self.holders[new] = names
+                self._dirty = True
+
+    def refcount(self, name: str) -> int:
+        return self.refs.get(name, 0)
+
+    def _delete(self, name: str):
+        (self.images_dir / name).unlink(missing_ok=True)
+        if self.on_delete is not None:
+            self.on_delete(name)
+        else:
+            discard_variants(self.images_dir, name)
+
+    def _release(self, names: List[str]) -> int:
+        # Only temp files are owned outright; permanent img_ files may be re-inserted (undo), so they wait for sweep()
+        count = 0
+        now = time.time()
+        for name in names:
+            if name.startswith("temp_"):
+                self._delete(name)
+                count += 1
+            else:
+                with self._lock:
+                    if not self.refs.get(name):
+                        self.candidates.setdefault(name, now)
+        return count
+
+    # --- 3. RECLAIMING ---
+
+    def adopt_orphans(self) -> int:
+        """
+        Lists the images directory once (no file is read) and makes every unreferenced image a candidate:
+        files written just before a crash, and those left behind by an index that predates candidates.
+        """
+        now = time.time()
+        adopted = 0
+        with self._lock:
+            for entry in os.scandir(self.images_dir):
+                name = entry.name
+                if not entry.is_file() or not name.startswith(IMAGE_PREFIXES):
+                    continue
+                if not self.refs.get(name) and name not in self.candidates:
+                    self.candidates[name] = now
+                    adopted += 1
+            self._dirty = self._dirty or adopted > 0
+        return adopted
+
+    def sweep(self, grace_s: float) -> int:
+        """Deletes the candidates that stayed unreferenced for `grace_s` seconds. Returns the number deleted."""
+        cutoff = time.time() - grace_s
+        with self._lock:
+            expired = [name for name, since in self.candidates.items() if since <= cutoff]
+            for name in expired:
+                del self.candidates[name]
+            expired = [name for name in expired if not self.refs.get(name)]
+            self._dirty = self._dirty or bool(expired)
+        for name in expired:
+            self._delete(name)
+        self.swept += len(expired)
+        return len(expired)
+
+    # --- 4. PERSISTENCE ---
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self.saved_at = time.time()
+            data = {
+                "saved_at": self.saved_at,
+                "notebooks_indexed": self.notebooks_indexed,
+                "holders": {h: sorted(n) for h, n in self.holders.items()},
+                "candidates": dict(self.candidates),
+            }
+            self._dirty = False
+        tmp_path = self.index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data))
+        os.replace(tmp_path, self.index_path)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "files": len(self.refs),
+            "holders": len(self.holders),
+            "candidates": len(self.candidates),
+            "swept": self.swept,
+            "written": self.written,
+            "deduplicated": self.deduplicated,
+        }
+
+
+# --- BACKGROUND SWEEPER CLASS ---
+
+class ImageSweeper():
+    """
+    Reclaims unreferenced images in the background, so neither startup nor shutdown has to scan.
+    The first pass re-reads the notebooks the index may have missed (`reindex`) and adopts crash
+    orphans; every pass then deletes the candidates older than `grace_s` and saves the index.
+    """
+
+    def __init__(self, store: ImageStore, reindex: Callable[[ImageStore], int], interval_s: float = 300.0, grace_s: float = 3600.0):
+        self.store = store
+        self.reindex = reindex
+        self.interval_s = interval_s
+        self.grace_s = grace_s
+        self.passes = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def _first_pass(self):
+        read = self.reindex(self.store)
+        adopted = self.store.adopt_orphans()
+        logger.info(f"🧹 Image index ready: {read} notebooks re-read, {adopted} unreferenced images queued for GC.")
+
+    def _pass(self) -> int:
+        if not self.passes:
+            self._first_pass()
+        removed = self.store.sweep(self.grace_s)
+        self.store.flush()
+        self.passes += 1
+        return removed
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                removed = await loop.run_in_executor(None, self._pass)
+                if removed:
+                    logger.info(f"✅ GC Deleted {removed} unused images.")
+            except Exception as e:
+                logger.warning(f"Could not run image garbage collection: {e}")
+            await asyncio.sleep(self.interval_s)
@@ -0,0 +1,209 @@
+import io
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from PIL import Image, ImageOps, features
+
+from image_store import variant_dir, discard_variants
+
+logger = logging.getLogger("CallimacusAPI")
+
+VARIANT_WIDTHS = (480, 960, 1440)   # The notebook column at 1x, 2x and 3x
+MAX_MASTER_WIDTH = 2560             # Wider sources are scaled down for the full-size copy too
+QUALITY = 80
+MANIFEST = "manifest.json"          # Written last: its presence marks an image as transcoded
+MEDIA_TYPES = {".webp": "image/webp", ".jpg": "image/jpeg"}
+MAX_MANIFESTS = 4096                # Manifests kept in memory (least recently used dropped); the rest are re-read from disk
+
+# --- TRANSCODING ---
+
+def output_format() -> Tuple[str, str]:
+    """WebP where Pillow was built with it (every current browser shows it), JPEG otherwise."""
+    return ("WEBP", ".webp") if features.check("webp") else ("JPEG", ".jpg")
+
+
+def _write_atomic(path: Path, data: bytes):
+    partial = path.with_name(f"{uuid.uuid4().hex}.part")
+    with open(partial, "wb") as f:
+        f.write(data)
+    os.replace(partial, path)
+
+
+def transcode(images_dir: Path, name: str) -> dict:
+    """
+    Writes a compressed full-size master and narrower variants of one image and returns its manifest:
+    {"width", "height", "variants": [{"width", "file", "bytes"}, ...]} sorted by width, with files
+    relative to images_dir. Blocking and CPU-bound. The original stays the full-size entry whenever
+    re-encoding would not make it smaller (already compact JPEGs, tiny PNGs, animations).
+    """
+    source = images_dir / name
+    source_bytes = source.stat().st_size
+    out_dir = variant_dir(images_dir, name)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    fmt, suffix = output_format()
+
+    with Image.open(source) as img:
+        width, height = img.size
+        if getattr(img, "is_animated", False):
+            variants = [{"width": width, "file": name, "bytes": source_bytes}]
+        else:
+            img = ImageOps.exif_transpose(img)
+            width, height = img.size
+            has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha and fmt == "WEBP" else "RGB")
+
+            # Widest first: a narrower variant is only kept if it is smaller than every wider entry
+            master_width = min(width, MAX_MASTER_WIDTH)
+            ceiling = source_bytes if master_width == width else float("inf")
+            variants = []
+            for target in [master_width] + [w for w in reversed(VARIANT_WIDTHS) if w < master_width]:
+                resized = img if target == width else img.resize(
+                    (target, max(1, round(height * target / width))), Image.LANCZOS
+                )
+                buffer = io.BytesIO()
+                if fmt == "WEBP":
+                    resized.save(buffer, fmt, quality=QUALITY, method=4)
+                else:
+                    resized.save(buffer, fmt, quality=QUALITY, optimize=True, progressive=True)
+                data = buffer.getvalue()
+
+                if len(data) >= ceiling:
+                    if target == width:
+                        variants.append({"width": width, "file": name, "bytes": source_bytes})
+                    continue
+                path = out_dir / f"{target}{suffix}"
+                _write_atomic(path, data)
+                variants.append({"width": target, "file": path.relative_to(images_dir).as_posix(), "bytes": len(data)})
+                ceiling = len(data)
+            variants.reverse()
+
+    manifest = {"width": width, "height": height, "source_bytes": source_bytes, "variants": variants}
+    _write_atomic(out_dir / MANIFEST, json.dumps(manifest).encode("utf-8"))
+    return manifest
+
+
+def pick_variant(manifest: dict, width: Optional[int]) -> dict:
+    """The narrowest variant at least `width` pixels wide; the full-size one without a width."""
+    variants: List[dict] = manifest["variants"]
+    if width:
+        for variant in variants:
+            if variant["width"] >= width:
+                return variant
+    return variants[-1]
+
+# --- BACKGROUND TRANSCODER CLASS ---
+
+class ImageTranscoder():
+    """
+    Transcodes images on a single background thread, so uploads and page loads never wait for it.
+    Until an image's manifest exists, requests get the original file (and trigger the job).
+    """
+
+    def __init__(self, images_dir: Path):
+        self.images_dir = images_dir
+        self.manifests: "OrderedDict[str, dict]" = OrderedDict()
+        self.pending: Set[str] = set()
+        self.failed: Set[str] = set()
+        self.transcoded = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.busy_s = 0.0
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-transcoder")
+
+    def manifest(self, name: str) -> Optional[dict]:
+        with self._lock:
+            manifest = self.manifests.get(name)
+            if manifest is not None:
+                self.manifests.move_to_end(name)
+                return manifest
+        try:
+            manifest = json.loads((variant_dir(self.images_dir, name) / MANIFEST).read_text())
+        except Exception:
+            return None
+        self._remember(name, manifest)
+        return manifest
+
+    def _remember(self, name: str, manifest: dict):
+        with self._lock:
+            self.manifests[name] = manifest
+            self.manifests.move_to_end(name)
+            while len(self.manifests) > MAX_MANIFESTS:
+                self.manifests.popitem(last=False)
+
+    def schedule(self, name: str):
+        with self._lock:
+            if name in self.pending or name in self.failed:
+                return
+            self.pending.add(name)
+        self._executor.submit(self._run, name)
+
+    def _run(self, name: str):
+        try:
+            if self.manifest(name) is not None:
+                return
+            started = time.perf_counter()
+            manifest = transcode(self.images_dir, name)
+            self._remember(name, manifest)
+            self.transcoded += 1
+            self.bytes_in += manifest["source_bytes"]
+            self.bytes_out += manifest["variants"][-1]["bytes"]
+            self.busy_s += time.perf_counter() - started
+        except FileNotFoundError:
+            pass  # Deleted while queued
+        except Exception as e:
+            logger.warning(f"⚠️ Could not transcode image {name}: {e}")
+            self.failed.add(name)
+            discard_variants(self.images_dir, name)
+        finally:
+            with self._lock:
+                self.pending.discard(name)
+
+    def resolve(self, name: str, width: Optional[int] = None) -> Tuple[Path, bool]:
+        """
+        The file to serve for `name` at `width`, and whether it is a finished variant
+        (immutable, so it can be cached for good) rather than the original standing in for one.
+        """
+        manifest = self.manifest(name)
+        if manifest is not None:
+            path = self.images_dir / pick_variant(manifest, width)["file"]
+            if path.exists():
+                return path, True
+            with self._lock:
+                self.manifests.pop(name, None)  # Variants swept from under us: redo them
+            discard_variants(self.images_dir, name)
+        self.schedule(name)
+        return self.images_dir / name, False
+
+    def discard(self, name: str):
+        """Forgets a deleted image and removes its variants (the ImageStore calls it for every file it deletes)."""
+        with self._lock:
+            self.manifests.pop(name, None)
+            self.failed.discard(name)
+        discard_variants(self.images_dir, name)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "transcoded": self.transcoded,
+            "pending": len(self.pending),
+            "failed": len(self.failed),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "busy_s": round(self.busy_s, 2),
+        }
+
+
+def media_type(path: Path) -> Optional[str]:
+    """Content type for transcoded files (older mimetypes tables lack WebP); None lets the response guess."""
+    return MEDIA_TYPES.get(path.suffix)
@@ -17,7 +17,7 @@ from langgraph.types import interrupt, Command
 
 from learning_assistant.prompts import content_system_prompt, agent_system_prompt, default_background, default_content_preferences, content_user_prompt, content_user_additional_prompt, tools_prompt, MEMORY_UPDATE_INSTRUCTIONS
 from learning_assistant.state import MessagesState
-from document import Document
+from document import Document, DocumentCache
 from dotenv import load_dotenv
 
 from langchain_openai import ChatOpenAI
@@ -95,7 +95,7 @@ def get_dynamic_llm(model_name: str, api_key: str, temperature: float = 0.0):
 #-----------------------
 # DOCUMENT REGISTER
 #-----------------------
-DOCUMENT_STORAGE: Dict[str, Document] = {}
+DOCUMENT_STORAGE = DocumentCache()  # Bounded: 'doc_cache_entries' / 'doc_cache_mb' in config.json
 
 #-----------------------
 # TOOL DEFINITION
@@ -184,8 +184,11 @@ async def create_paragraph(doc_id: str, par_id: str, config: Annotated[RunnableC
     if not produced_output:
         return {"success": False, "content": "Failed execution of compiling model"}
 
-    # Save the finalized text to the Document storage
-    doc_ref.replace_paragraph(par_id, produced_output.content)
+    # Save the finalized text to the Document storage, unless the sources changed while compiling
+    saved = doc_ref.replace_paragraph(par_id, produced_output.content, expected_rev=par_ref["rev"])
+    if not saved.get("success", False):
+        logger.warning(f"Compiling Model: {saved['error']} (doc {doc_id}), output discarded.")
+        return saved
 
     logger.info(f"Compiling Model: Successfully generated and saved paragraph {par_id} for doc {doc_id}.")
     logger.debug(f"Generated text: {produced_output.content}")
@@ -232,8 +235,13 @@ async def extract_image(doc_id: str, par_id: str, image_filename: Any):
     perm_filename = safe_filename.replace("temp_", "img_")
     perm_path = images_dir / perm_filename
     
-    # Move/Rename the file so it escapes the cleanup script
-    shutil.move(str(temp_path), str(perm_path))
+    # Copy it so it escapes the cleanup script; the temp file stays shared with the PDF cache.
+    # Names are content hashes, so an existing img_ file already holds these exact bytes.
+    if not perm_path.exists():
+        shutil.copyfile(str(temp_path), str(perm_path))
+    # Reclaimed by the image sweeper unless the notebook picks it up
+    if doc_ref.image_store is not None:
+        doc_ref.image_store.track(perm_filename)
     
     image_markdown = f"![Visual Reference](http://localhost:8000/imgs/{perm_filename})"
     instruction = (
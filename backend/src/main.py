@@ -22,11 +22,9 @@ from pathlib import Path
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from pydub import AudioSegment
-from faster_whisper import WhisperModel
+from typing import List, Optional
 
 # ------------------------------------------
 # LANGGRAPH IMPORTS 
@@ -37,7 +35,12 @@ from langgraph.types import Command
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain_groq import ChatGroq
-from document import Document
+from document import Document, VersionConflict, CONTEXT_WRITER, STORAGE, SEARCH_INDEX
+from paths import RECORDINGS_DIR
+from transcripts import TranscriptLog
+from image_store import ImageStore, ImageSweeper
+from image_variants import ImageTranscoder, media_type
+from pdf_extraction import PDFCache, PDFSession, PDFSessionClosed, extract_pages, DEFAULT_WORKERS
 from learning_assistant.learning_assistant import (
     agent, 
     DOCUMENT_STORAGE, 
@@ -49,6 +52,53 @@ from learning_assistant.utils import (
     save_global_memory
 )
 from learning_assistant.prompts import agent_user_prompt
+from audio_pipeline.vad import (
+    VADConfig,
+    StreamingVADSegmenter,
+    load_silero_vad
+)
+from audio_pipeline.scheduler import (
+    SchedulerConfig,
+    TranscriptionScheduler
+)
+from audio_pipeline.partials import (
+    StreamingConfig,
+    LocalAgreement
+)
+from audio_pipeline.models import (
+    WhisperConfig,
+    ModelRegistry,
+    WHISPER_SIZES,
+    benchmark,
+    warm_up
+)
+from audio_pipeline.offline import (
+    OfflineConfig,
+    OfflineTranscriber,
+    SUPPORTED_EXTENSIONS
+)
+from audio_pipeline.resample import (
+    InputFormat,
+    make_normalizer
+)
+from audio_pipeline.codecs import (
+    negotiate_codec,
+    make_decoder
+)
+from audio_pipeline.refine import (
+    RefineConfig,
+    RefinementWorker,
+    SessionRecorder,
+    recording_path
+)
+from audio_pipeline.backpressure import (
+    BackpressureConfig,
+    SessionCounters,
+    SegmentBacklog,
+    put_dropping_oldest,
+    put_droppable,
+    put_keeping
+)
 
 # ------------------------------------------
 # CONFIG & LOGGING
@@ -70,13 +120,28 @@ Path(CONTEXT_DIR).mkdir(parents=True, exist_ok=True)
 CONFIG_FILE = CALLIMACHUS_DIR / "config.json"
 IMAGES_DIR = CALLIMACHUS_DIR / "imgs"
 IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+PDF_CACHE_DIR = CALLIMACHUS_DIR / "pdf_cache"  # Uploaded decks and their extracted pages, by SHA-256
+IMAGE_REFS_FILE = CALLIMACHUS_DIR / "image_refs.json"  # Who still uses which content-addressed image
 
 # ------------------------------------------
 # GLOBAL ML MODELS
 # ------------------------------------------
 
-audio_model = None
-ml_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+vad_model = None
+model_registry: ModelRegistry = None
+offline_transcriber: OfflineTranscriber = None
+transcription_scheduler: TranscriptionScheduler = None
+refinement_worker: RefinementWorker = None
+model_swap_lock = asyncio.Lock()
+vad_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+AUDIO_SESSIONS: dict[str, SessionCounters] = {}  # Live audio WebSockets, for /api/audio/stats
+PDF_SESSIONS: dict[str, PDFSession] = {}         # Open slide decks, by extraction session_id
+image_store: ImageStore = None
+image_sweeper: ImageSweeper = None
+image_transcoder = ImageTranscoder(IMAGES_DIR)   # WebP copies and narrower variants, made in the background
+pdf_cache: PDFCache = None
+pdf_workers = DEFAULT_WORKERS                    # Worker processes per extraction ('pdf_workers' in config.json)
+pdf_session_reaper: asyncio.Task = None
 
 # ------------------------------------------
 # TESTING FUNCTION
@@ -127,11 +192,8 @@ def run_document_sanity_checks():
         logger.info("✅ All Document Sanity Checks Passed! Architecture is rock solid.")
         
     finally:
-        # Cleanup the dummy files so we don't clutter your directories
-        if os.path.exists(doc.doc_file_path):
-            os.remove(doc.doc_file_path)
-        if os.path.exists(doc.context_file_path):
-            os.remove(doc.context_file_path)
+        # Cleanup the dummy notebook so we don't clutter your storage
+        doc.delete()
 
 # ------------------------------------------
 # LIFESPAN
@@ -139,7 +201,7 @@ def run_document_sanity_checks():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global audio_model
+    global vad_model, model_registry, transcription_scheduler, offline_transcriber, refinement_worker, image_store, image_sweeper, pdf_cache, pdf_workers, pdf_session_reaper
     logger.info("🚀 Starting up Callimacus FastAPI Server...")
 
     # 0. Run unified architecture tests
@@ -148,53 +210,21 @@ async def lifespan(app: FastAPI):
     # 1. Load LangGraph Memory
     load_global_memory(in_memory_store)
 
-    # 2. GARBAGE COLLECTION: Sweep orphaned temp files and deleted img files from previous sessions
-    logger.info("🧹🗑️ Running Garbage Collection on images...")
-    try:
-        used_images = set()
-        
-        # A. First, build the map of active images from the notebooks
-        for doc_file in Path(DOCS_DIR).glob("*.json"):
-            try:
-                content = doc_file.read_text()
-                # Matches any string that looks like our image files (e.g., img_123.png)
-                import re
-                found = re.findall(r"(img_[a-zA-Z0-9_]+\.[a-zA-Z0-9]+)", content)
-                used_images.update(found)
-            except Exception:
-                continue
-
-        # B. Single pass through the images directory
-        for file_path in IMAGES_DIR.iterdir():
-            if not file_path.is_file():
-                continue
-                
-            filename = file_path.name
-            
-            # Condition 1: It's a leftover temporary file from a crash
-            if filename.startswith("temp_"):
-                try:
-                    file_path.unlink()
-                    # logger.debug(f"🧹 Swept temp orphan: {filename}") # Optional debug
-                except Exception as e:
-                    logger.warning(f"Could not delete temp orphan {filename}: {e}")
-                    
-            # Condition 2: It's an uploaded/extracted image no longer in any notebook
-            elif filename.startswith("img_") and filename not in used_images:
-                try:
-                    file_path.unlink()
-                    logger.info(f"✅ GC Deleted unused image: {filename}")
-                except Exception as e:
-                    logger.warning(f"Could not delete unused image {filename}: {e}")
+    # Referenced temp_ images belong to the PDF extraction cache: they are shared between sessions, not orphans
+    image_store = ImageStore(IMAGES_DIR, IMAGE_REFS_FILE)
+    image_store.on_delete = image_transcoder.discard  # Swept images take their cached manifest and variants along
+    pdf_cache = PDFCache(PDF_CACHE_DIR, image_store)
 
-    except Exception as e:
-         logger.warning(f"Could not run garbage collection: {e}")
+    # 2. GARBAGE COLLECTION: notebooks keep their images registered on every save, so nothing is scanned
+    # here; the sweeper reclaims unreferenced and orphaned images in the background once the server is up
+    Document.image_store = image_store
 
     # 3. Auto-Load Anti-API
+    config_data = {}
     if CONFIG_FILE.exists():
         try:
-            config = json.loads(CONFIG_FILE.read_text())
-            if config.get("auto_start"):
+            config_data = json.loads(CONFIG_FILE.read_text())
+            if config_data.get("auto_start"):
                 logger.info("Memory shows Anti-API is active. Auto-starting in background...")
                 proxy_dir = CALLIMACHUS_DIR / "anti-api-server" # 💡 NEW CLONE PATH
                 if proxy_dir.exists():
@@ -202,26 +232,64 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.error(f"Failed to read config: {e}")
     
-    # 4. Boot up Faster-Whisper (Using the 'base' or 'small' model for real-time speed)
-    logger.info("🧠 Loading Faster-Whisper model...")
-    cache_path = os.path.expanduser("~/.cache/huggingface/hub/models--Systran--faster-whisper-base/snapshots/")
+    # Size cap of the PDF extraction cache ('pdf_cache_mb' in config.json)
+    pdf_cache.max_bytes = int(config_data.get("pdf_cache_mb", 1024)) * 1024 * 1024
+    pdf_cache.evict()
+    pdf_workers = int(config_data.get("pdf_workers", DEFAULT_WORKERS))
+    # Decks the client never closed (tab closed, stream dropped) are released once idle ('pdf_session_idle_s')
+    pdf_session_reaper = asyncio.create_task(reap_pdf_sessions(float(config_data.get("pdf_session_idle_s", 1800))))
+
+    # Open notebooks kept in memory ('doc_cache_entries' and 'doc_cache_mb' in config.json)
+    DOCUMENT_STORAGE.max_entries = int(config_data.get("doc_cache_entries", 32))
+    DOCUMENT_STORAGE.max_bytes = int(config_data.get("doc_cache_mb", 256)) * 1024 * 1024
+    DOCUMENT_STORAGE.evict()
+
+    # Unreferenced images are kept for a grace period (an undo in the editor may bring them back)
+    image_sweeper = ImageSweeper(
+        image_store,
+        Document.reindex_images,
+        interval_s=float(config_data.get("image_gc_interval_s", 300)),
+        grace_s=float(config_data.get("image_gc_grace_s", 3600)),
+    )
+    image_sweeper.start()
+
+    # Notebooks changed while the search index was not watching (e.g. the first run) are indexed in the background
+    SEARCH_INDEX.start_reindex(STORAGE)
+
+    # 4. Boot up Faster-Whisper from the registry ('whisper' section of config.json; 'base' by default)
+    scheduler_config = SchedulerConfig.from_dict(config_data.get("transcription"))
+    model_registry = ModelRegistry(WhisperConfig.from_dict(config_data.get("whisper")), scheduler_config.replicas)
     
-    # Find the specific snapshot folder string inside
+    # One independent instance per replica, each pinned to its own scheduler thread and warmed up
     try:
-        snapshot_folder = os.listdir(cache_path)[0]
-        local_model_path = os.path.join(cache_path, snapshot_folder)
-        
-        # Load directly from the hard drive, bypassing network requests completely!
-        audio_model = WhisperModel(
-            local_model_path, 
-            device="cpu", 
-            compute_type="default", 
-            local_files_only=True,
-            cpu_threads=2 
-        )
-        
-    except FileNotFoundError:
-        logger.error("❌ Faster-Whisper cache not found! Did you run setup_models.py?")
+        replicas = model_registry.load()
+    except FileNotFoundError as e:
+        logger.error(f"❌ {e}")
+        raise
+
+    transcription_scheduler = TranscriptionScheduler(replicas, scheduler_config, warm_up=warm_up)
+    transcription_scheduler.start(warm=model_registry.active.warmup)
+
+    # Recorded lectures get their own worker pool, started on the first upload
+    offline_transcriber = OfflineTranscriber(
+        CALLIMACHUS_DIR / "uploads", model_registry.active, OfflineConfig.from_dict(config_data.get("offline"))
+    )
+
+    # Second pass: saved session audio is re-transcribed with a larger model while the live pipeline is idle
+    refine_config = RefineConfig.from_dict(config_data.get("refine"))
+    refinement_worker = RefinementWorker(
+        refine_config,
+        is_busy=lambda: bool(AUDIO_SESSIONS) or any(j.status in ("decoding", "transcribing") for j in offline_transcriber.jobs.values())
+    )
+    if refine_config.enabled:
+        refinement_worker.start()
+
+    # 5. Boot up Silero VAD (each audio session clones it, since the model is stateful)
+    logger.info("🧠 Loading Silero VAD model...")
+    try:
+        vad_model = load_silero_vad()
+    except FileNotFoundError as e:
+        logger.error(f"❌ {e}")
         raise
 
     logger.info("✅ Server startup complete.")
@@ -229,50 +297,19 @@ async def lifespan(app: FastAPI):
     yield # Server is running...
     
     logger.info("🛑 Shutting down server. Flushing RAM memory to disk...")
+    await transcription_scheduler.shutdown()
+    offline_transcriber.shutdown()
+    await refinement_worker.shutdown()
+    image_transcoder.shutdown()
+    await image_sweeper.shutdown()
+    pdf_session_reaper.cancel()
+
     # Save cross-thread preferences from RAM to JSON
     save_global_memory(in_memory_store)
-
-    # GARBAGE COLLECTION: Sweep orphaned temp files and deleted img files from previous sessions
-    logger.info("🧹🗑️ Running Garbage Collection on images...")
-    try:
-        used_images = set()
-        
-        # A. First, build the map of active images from the notebooks
-        for doc_file in Path(DOCS_DIR).glob("*.json"):
-            try:
-                content = doc_file.read_text()
-                # Matches any string that looks like our image files (e.g., img_123.png)
-                import re
-                found = re.findall(r"(img_[a-zA-Z0-9_]+\.[a-zA-Z0-9]+)", content)
-                used_images.update(found)
-            except Exception:
-                continue
-
-        # B. Single pass through the images directory
-        for file_path in IMAGES_DIR.iterdir():
-            if not file_path.is_file():
-                continue
-                
-            filename = file_path.name
-            
-            # Condition 1: It's a leftover temporary file from a crash
-            if filename.startswith("temp_"):
-                try:
-                    file_path.unlink()
-                    # logger.debug(f"🧹 Swept temp orphan: {filename}") # Optional debug
-                except Exception as e:
-                    logger.warning(f"Could not delete temp orphan {filename}: {e}")
-                    
-            # Condition 2: It's an uploaded/extracted image no longer in any notebook
-            elif filename.startswith("img_") and filename not in used_images:
-                try:
-                    file_path.unlink()
-                    logger.info(f"✅ GC Deleted unused image: {filename}")
-                except Exception as e:
-                    logger.warning(f"Could not delete unused image {filename}: {e}")
-    
-    except Exception as e:
-         logger.warning(f"Could not run garbage collection: {e}")
+    CONTEXT_WRITER.flush_all()
+    SEARCH_INDEX.close()
+    STORAGE.close()
+    image_store.flush()
 
 app = FastAPI(title="Callimacus Agent API", lifespan=lifespan)
 
@@ -285,8 +322,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount("/imgs", StaticFiles(directory=str(IMAGES_DIR)), name="imgs")
-
 # ------------------------------------------
 # UTILS
 # ------------------------------------------
@@ -299,11 +334,12 @@ def safe_doc_path(doc_id: str) -> Path:
 def safe_id(value: str) -> str:
     return re.sub(r"[^a-zA-Z0-9_-]", "", value)
 
-def get_document(doc_id: str) -> Document:
-    """Ensures a single instance of a document exists in memory."""
-    if doc_id not in DOCUMENT_STORAGE:
-        DOCUMENT_STORAGE[doc_id] = Document(doc_id)
-    return DOCUMENT_STORAGE[doc_id]
+def get_document(doc_id: str):
+    """
+    Ensures a single instance of a document exists in memory: use as `with get_document(id) as doc:`.
+    The instance stays pinned in the cache (never evicted, so never loaded twice) until the block exits.
+    """
+    return DOCUMENT_STORAGE.pinned(doc_id)
 
 def get_dynamic_llm(model_name: str, api_key: str):
     """
@@ -391,52 +427,74 @@ def save_settings(payload: SettingsPayload):
 
 @app.post("/api/docs/{doc_id}/rename")
 def rename_doc(doc_id: str, payload: RenameUpdate):
-    doc = get_document(doc_id)
-    
-    success = doc.rename(payload.new_id)
-    if not success:
-        raise HTTPException(status_code=400, detail="Cannot rename. Target exists or original missing.")
+    with DOCUMENT_STORAGE.pinned(doc_id, create=False) as doc:
+        if doc is None:
+            raise HTTPException(status_code=404, detail=f"Document {doc_id} not found")
+
+        success = doc.rename(payload.new_id)
+        if not success:
+            raise HTTPException(status_code=400, detail="Cannot rename. Target exists or original missing.")
     
-    # Update global storage dictionary key
-    DOCUMENT_STORAGE[payload.new_id] = DOCUMENT_STORAGE.pop(doc_id)
-    return {"ok": True, "oldId": doc_id, "newId": payload.new_id, "newName": payload.new_name}
+        # Update global storage dictionary key
+        DOCUMENT_STORAGE.rename(doc_id, payload.new_id)
+        return {"ok": True, "oldId": doc_id, "newId": payload.new_id, "newName": payload.new_name}
 
 class DocUpdate(BaseModel):
     content: str
 
 # --- DOCUMENT ENDPOINTS ---
 @app.get("/api/docs")
-def list_docs():
-    return Document.get_all_documents()
+def list_docs(sort: str = "name", order: str = "asc", offset: int = 0, limit: int = 100):
+    """A page of the notebook catalog, e.g. ?sort=mtime&order=desc&offset=0&limit=100."""
+    if order not in ("asc", "desc") or offset < 0 or not 0 < limit <= 1000:
+        raise HTTPException(status_code=400, detail="Invalid order, offset or limit")
+    try:
+        return Document.catalog(sort, order == "desc", offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/api/docs/{doc_id}")
 def get_doc(doc_id: str):
-    doc = get_document(doc_id)
-    content = doc.get_ui_document()
-    if not content or content == "[]":
-        # Create it if it's completely empty
-        doc.save_ui_document("[]")
-    return {"docId": doc_id, "content": content}
+    with get_document(doc_id) as doc:
+        content = doc.get_ui_document()
+        if content == "[]" and not doc.exists():
+            # Create it if it's completely empty
+            doc.save_ui_document("[]")
+        return {"docId": doc_id, "content": content, "version": doc.version}
 
 @app.put("/api/docs/{doc_id}")
 def put_doc(doc_id: str, payload: DocUpdate):
-    doc = get_document(doc_id)
-    doc.save_ui_document(payload.content)
-    return {"ok": True, "docId": doc_id}
+    with get_document(doc_id) as doc:
+        try:
+            version = doc.save_ui_document(payload.content)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"ok": True, "docId": doc_id, "version": version}
+
+class DocPatch(BaseModel):
+    base_version: int
+    ops: List[dict]   # insert / update / delete / move, by block id (see document.apply_ops)
+
+@app.patch("/api/docs/{doc_id}")
+def patch_doc(doc_id: str, payload: DocPatch):
+    """Applies block-level edits; 409 (with the current version) if they were made against an older version."""
+    with get_document(doc_id) as doc:
+        try:
+            version = doc.apply_patch(payload.base_version, payload.ops)
+        except VersionConflict as e:
+            raise HTTPException(status_code=409, detail={"message": str(e), "version": e.current})
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"ok": True, "docId": doc_id, "version": version}
 
 @app.delete("/api/docs/{doc_id}")
 def delete_document(doc_id: str):
-    """Deletes the document and its AI memory context from the hard drive."""
-    # Assuming get_document is your helper function to fetch the Document class instance
-    from document import Document # Or however you import it
-    doc = Document(doc_id)
-    
-    # Remove files from disk
-    import os
-    if os.path.exists(doc.doc_file_path):
-        os.remove(doc.doc_file_path)
-    if os.path.exists(doc.context_file_path):
-        os.remove(doc.context_file_path)
+    """Deletes the document and its AI memory context from storage."""
+    # Drop the cached instance too, or its in-memory blocks would outlive the files
+    doc = DOCUMENT_STORAGE.pop(doc_id, None) or Document(doc_id)
+    doc.delete()
+    # Its images become GC candidates
+    image_store.drop(Document.holder(doc_id))
         
     return {"ok": True, "message": "Document deleted"}
 
@@ -444,82 +502,217 @@ def delete_document(doc_id: str):
 async def upload_image(file: UploadFile = File(...)):
     """Allows BlockNote to upload images directly to the backend."""
     ext = file.filename.split(".")[-1]
-    filename = f"img_{uuid.uuid4().hex}.{ext}"
-    filepath = IMAGES_DIR / filename
-    with open(filepath, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    data = await file.read()
+    # Named by content: uploading the same picture again reuses the existing file
+    filename = await asyncio.get_running_loop().run_in_executor(None, image_store.put, data, ext, "img")
+    image_transcoder.schedule(filename)
     return {"url": f"http://localhost:8000/imgs/{filename}"}
 
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "public, max-age=60"  # The original, standing in until its variants exist
+
+@app.get("/imgs/{filename}")
+async def get_image(filename: str, request: Request, w: Optional[int] = None):
+    """
+    Serves a notebook or slide image. With ?w= it picks the narrowest transcoded variant at least
+    that wide; without it, the compressed full-size copy. Files never change under a given name and
+    width, so responses carry a strong ETag and may be cached for a year.
+    """
+    if os.path.basename(filename) != filename or not (IMAGES_DIR / filename).is_file():
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    path, final = image_transcoder.resolve(filename, w)
+    stat = path.stat()
+    headers = {
+        "ETag": f'"{Path(filename).stem}-{path.stem}-{stat.st_mtime_ns:x}"',
+        "Cache-Control": IMMUTABLE_CACHE if final else REVALIDATE_CACHE,
+    }
+    if headers["ETag"] in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type(path), headers=headers)
+
+@app.get("/api/storage/stats")
+def docs_stats():
+    """Document cache counters, and context writes requested vs. actually performed (the rest were coalesced)."""
+    return {"backend": type(STORAGE).__name__, "documents": DOCUMENT_STORAGE.stats(), "context": CONTEXT_WRITER.stats()}
+
+@app.get("/api/search")
+def search_notes(q: str, limit: int = 20, offset: int = 0, doc_id: Optional[str] = None):
+    """Full-text search over every notebook's blocks and paragraph contexts, best matches first."""
+    if offset < 0 or not 0 < limit <= 100:
+        raise HTTPException(status_code=400, detail="Invalid offset or limit")
+    return {"query": q, "results": SEARCH_INDEX.search(q, limit, offset, doc_id)}
+
+@app.post("/api/search/reindex")
+def reindex_search(full: bool = False):
+    """Re-indexes notebooks changed since they were last indexed (all of them with ?full=true), in the background."""
+    return {"started": SEARCH_INDEX.start_reindex(STORAGE, full)}
+
+@app.get("/api/search/stats")
+def search_stats():
+    return SEARCH_INDEX.stats()
+
+@app.get("/api/media/stats")
+async def media_stats():
+    return {"pdf_cache": pdf_cache.stats(), "transcoder": image_transcoder.stats()}
+
 # --- MEDIA ENDPOINTS ---
+async def open_pdf_session(file: UploadFile) -> PDFSession:
+    """Streams the upload to disk in a worker thread and registers the deck under a fresh session_id."""
+    loop = asyncio.get_running_loop()
+    session = await loop.run_in_executor(None, PDFSession.from_upload, file.file, pdf_cache)
+    PDF_SESSIONS[session.session_id] = session
+    return session
+
 # Update your extraction endpoint to use Session IDs
 @app.post("/api/media/extract")
 async def extract_pdf_text(file: UploadFile = File(...)):
     try:
-        content = await file.read()
-        doc = fitz.open(stream=content, filetype="pdf")
-        
-        session_id = uuid.uuid4().hex # 💡 Unique session ID guarantees no collisions!
-        
-        pages_text = {}
-        for i in range(len(doc)):
-            page = doc[i]
-            raw_text = page.get_text("text").replace('\n', ' ')
-            
-            image_list = page.get_images(full=True)
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-
-                # Filter out small artifacts and point images
-                if base_image["width"] < 150 or base_image["height"] < 150:
-                    continue 
+        session = await open_pdf_session(file) # 💡 Unique session ID guarantees no collisions!
 
-                image_bytes = base_image["image"]
-                ext = base_image["ext"]
-                
-                # Save as a TEMP file
-                filename = f"temp_{session_id}_p{i+1}_i{img_index}.{ext}"
-                with open(IMAGES_DIR / filename, "wb") as f:
-                    f.write(image_bytes)
-                
-                raw_text += f"\n[IMAGE AVAILABLE: '{filename}']"
-                
-            pages_text[str(i + 1)] = raw_text
+        # Page ranges go to worker processes; results come back merged in page order
+        pages_text = {}
+        with session.in_use():
+            async for number, text in extract_pages(session, list(range(1, session.total_pages + 1)), pdf_workers):
+                pages_text[str(number)] = text
             
         return {
             "status": "completed",
-            "session_id": session_id, # 💡 Send this back to React
-            "total_pages": len(doc),
+            "session_id": session.session_id, # 💡 Send this back to React
+            "total_pages": session.total_pages,
             "pages": pages_text
         }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@app.post("/api/media/extract/stream")
+async def extract_pdf_stream(file: UploadFile = File(...), first_page: int = 1):
+    """
+    Same extraction, streamed as NDJSON: a 'meta' record, then one 'page' record as soon as each page
+    is ready (starting at `first_page`), then 'done'. Pages can also be pulled out of order via
+    /api/media/extract/{session_id}/pages/{page}.
+    """
+    started = time.perf_counter()
+    try:
+        session = await open_pdf_session(file)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+    loop = asyncio.get_running_loop()
+
+    def line(record: dict) -> str:
+        record["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return json.dumps(record) + "\n"
+
+    async def records():
+        # In use until the stream ends or the client goes away, so the idle reaper never closes it mid-stream
+        with session.in_use():
+            yield line({"type": "meta", "session_id": session.session_id, "total_pages": session.total_pages})
+            first, *rest = session.order_from(first_page) or [None]
+            if first is None:
+                yield line({"type": "done"})
+                return
+            try:
+                # The page on screen is extracted right here, before any worker process has even started
+                text = await loop.run_in_executor(None, session.page, first)
+                yield line({"type": "page", "page": first, "text": text})
+
+                # The rest is split across worker processes and streamed back in order
+                async for number, text in extract_pages(session, rest, pdf_workers):
+                    if session.session_id not in PDF_SESSIONS:
+                        return  # The user closed the deck mid-stream
+                    yield line({"type": "page", "page": number, "text": text})
+            except PDFSessionClosed:
+                return  # Closed by the client while a page was being extracted
+            except Exception as e:
+                yield line({"type": "error", "message": str(e)})
+                return
+            yield line({"type": "done"})
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+@app.get("/api/media/extract/{session_id}/pages/{page}")
+async def get_pdf_page(session_id: str, page: int):
+    """One page of an open deck, extracted now if the stream has not reached it yet."""
+    session = PDF_SESSIONS.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Extraction session not found")
+    try:
+        with session.in_use():
+            text = await asyncio.get_running_loop().run_in_executor(None, session.page, page)
+    except IndexError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PDFSessionClosed as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"session_id": session_id, "page": page, "text": text}
+
+async def reap_pdf_sessions(idle_s: float):
+    """Releases the decks nobody has read a page of for `idle_s`: /api/media/cleanup is never called for a closed tab."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(min(60.0, idle_s / 2))
+        for session_id, session in list(PDF_SESSIONS.items()):
+            if session.users or session.idle_s() < idle_s:
+                continue  # Still streaming or serving a page, however slowly
+            PDF_SESSIONS.pop(session_id, None)
+            try:
+                await loop.run_in_executor(None, session.close)
+                logger.info(f"🧹 Released PDF session {session_id[:8]} after {session.idle_s():.0f}s idle.")
+            except Exception as e:
+                logger.warning(f"Could not release PDF session {session_id[:8]}: {e}")
+
 # CLEANUP: Wipes unused images when the user closes the PDF
 @app.delete("/api/media/cleanup/{session_id}")
 async def cleanup_media(session_id: str):
-    """Deletes all unused temporary images from a PDF extraction session."""
+    """
+    Releases a PDF extraction session. Its deck and temp images stay cached for the next upload of
+    the same file; they are deleted once the cache outgrows its size cap and nobody holds them.
+    """
+    session = PDF_SESSIONS.pop(session_id, None)
     count = 0
-    # Find all images starting with this specific temp session ID
-    for file_path in IMAGES_DIR.glob(f"temp_{session_id}_*"):
-        try:
-            file_path.unlink()
-            count += 1
-        except Exception as e:
-            logger.error(f"Failed to delete temp image {file_path}: {e}")
-    return {"status": "cleaned", "deleted_files": count}
+    if session:
+        count = await asyncio.get_running_loop().run_in_executor(None, session.close)
+    return {"status": "cleaned", "deleted_files": count, "cache": pdf_cache.stats()}
 
 # ------------------------------------------
 # AI AGENT ENDPOINTS (LANGGRAPH)
 # ------------------------------------------
 
+class TranscriptRange(BaseModel):
+    from_offset: Optional[int] = None  # Byte offsets into the document's transcript log
+    to_offset: Optional[int] = None
+    start: Optional[float] = None      # Wall-clock epoch seconds
+    end: Optional[float] = None
+
 class ProcessPayload(BaseModel):
     doc_id: str
     par_id: str
     audio: str = ""
+    audio_refs: List[int] = []                   # Transcript log offsets, as sent over the audio WebSocket
+    audio_range: Optional[TranscriptRange] = None
     ocr: str = ""
     notes: str = ""
 
+def resolve_audio(payload: ProcessPayload) -> str:
+    """Returns the raw audio text, or rebuilds it from the server-side transcript log."""
+    if payload.audio or not (payload.audio_refs or payload.audio_range):
+        return payload.audio
+
+    log = TranscriptLog(safe_id(payload.doc_id))
+    records = log.read_refs(payload.audio_refs)
+    if payload.audio_range:
+        records += log.read_range(**payload.audio_range.dict())
+    return TranscriptLog.join(records)
+
+def compile_conflict(doc: Document, par_id: str) -> Optional[dict]:
+    """The response for a run whose compiled output was discarded (the paragraph changed meanwhile), else None."""
+    if not doc.take_conflict(par_id):
+        return None
+    return {
+        "status": "conflict",
+        "message": "The paragraph changed while it was being compiled: the output was discarded, try again.",
+        "markdown": doc.get_paragraph(par_id).get("notes", "")
+    }
+
 @app.post("/api/llm/process")
 async def process_paragraph(payload: ProcessPayload, request: Request):
     """Triggers the LangGraph agent to analyze sources and either compile or pause for HITL."""
@@ -532,56 +725,63 @@ async def process_paragraph(payload: ProcessPayload, request: Request):
     llm_model = config_data.get("llm_model", "gpt-4o")
     
     # 1. Ensure document is loaded in storage
-    doc = get_document(payload.doc_id)
+    with get_document(payload.doc_id) as doc:
     
-    # 2. Update the AI Context safely
-    doc.update_paragraph_metadata(payload.par_id, payload.audio, payload.ocr, payload.notes)
-
-    # 3. Setup LangGraph Thread
-    thread_id = f"{payload.doc_id}_{payload.par_id}"
-    config = {
-        "configurable": {
-            "thread_id": thread_id,
-            "api_key": api_key,
-            "llm_model": llm_model
-        }
-    }
-
-    # Fetch perfectly reconciled notes
-    par_data = doc.get_paragraph(payload.par_id)
-    current_notes = par_data.get("notes", "")
+        # Runs on the same paragraph take turns (they share a LangGraph thread); other paragraphs run in parallel
+        async with doc.paragraph_lock(payload.par_id):
+            # 2. Update the AI Context safely
+            audio = resolve_audio(payload)
+            doc.update_paragraph_metadata(payload.par_id, audio, payload.ocr, payload.notes)
+
+            # 3. Setup LangGraph Thread
+            thread_id = f"{payload.doc_id}_{payload.par_id}"
+            config = {
+                "configurable": {
+                    "thread_id": thread_id,
+                    "api_key": api_key,
+                    "llm_model": llm_model
+                }
+            }
+
+            # Fetch perfectly reconciled notes
+            par_data = doc.get_paragraph(payload.par_id)
+            current_notes = par_data.get("notes", "")
     
-    agent_prompt = agent_user_prompt.format(
-        doc_id = payload.doc_id,
-        par_id = payload.par_id,
-        audio = payload.audio,
-        ocr = payload.ocr,
-        notes = current_notes
-    )
+            agent_prompt = agent_user_prompt.format(
+                doc_id = payload.doc_id,
+                par_id = payload.par_id,
+                audio = audio,
+                ocr = payload.ocr,
+                notes = current_notes
+            )
 
-    initial_state = {
-        "messages": [HumanMessage(content=agent_prompt)],
-        "doc_id": payload.doc_id,
-        "par_id": payload.par_id
-    }
+            initial_state = {
+                "messages": [HumanMessage(content=agent_prompt)],
+                "doc_id": payload.doc_id,
+                "par_id": payload.par_id
+            }
 
-    # 4. Run the Agent
-    await agent.ainvoke(initial_state, config)
+            # 4. Run the Agent
+            doc.take_conflict(payload.par_id)
+            await agent.ainvoke(initial_state, config)
 
-    # 5. Check if Agent Paused (HITL)
-    state = agent.get_state(config)
-    if state.tasks and state.tasks[0].interrupts:
-        interrupt_payload = state.tasks[0].interrupts[0].value
-        return {"status": "paused", "interrupt": interrupt_payload}
+            # 5. Check if Agent Paused (HITL) or its output lost to a concurrent change
+            state = agent.get_state(config)
+            if state.tasks and state.tasks[0].interrupts:
+                interrupt_payload = state.tasks[0].interrupts[0].value
+                return {"status": "paused", "interrupt": interrupt_payload}
+            conflict = compile_conflict(doc, payload.par_id)
+            if conflict:
+                return conflict
 
-    par_data = doc.get_paragraph(payload.par_id)
-    new_notes = par_data.get("notes", "")
+            par_data = doc.get_paragraph(payload.par_id)
+            new_notes = par_data.get("notes", "")
 
-    return {
-        "status": "completed", 
-        "message": "Paragraph successfully generated.",
-        "markdown": new_notes
-    }
+            return {
+                "status": "completed", 
+                "message": "Paragraph successfully generated.",
+                "markdown": new_notes
+            }
 
 
 class ResumePayload(BaseModel):
@@ -613,24 +813,29 @@ async def resume_agent(payload: ResumePayload, request: Request):
         "args": payload.answer
     }
     
-    # Resume the graph execution
-    await agent.ainvoke(Command(resume=user_response), config)
-    
-    # Check state just in case it asked another question
-    state = agent.get_state(config)
-    if state.tasks and state.tasks[0].interrupts:
-        interrupt_payload = state.tasks[0].interrupts[0].value
-        return {"status": "paused", "interrupt": interrupt_payload}
-        
-    doc = get_document(payload.doc_id)
-    par_data = doc.get_paragraph(payload.par_id)
-    new_notes = par_data.get("notes", "")
+    with get_document(payload.doc_id) as doc:
+        async with doc.paragraph_lock(payload.par_id):
+            # Resume the graph execution
+            doc.take_conflict(payload.par_id)
+            await agent.ainvoke(Command(resume=user_response), config)
+
+            # Check state just in case it asked another question
+            state = agent.get_state(config)
+            if state.tasks and state.tasks[0].interrupts:
+                interrupt_payload = state.tasks[0].interrupts[0].value
+                return {"status": "paused", "interrupt": interrupt_payload}
+            conflict = compile_conflict(doc, payload.par_id)
+            if conflict:
+                return conflict
+
+            par_data = doc.get_paragraph(payload.par_id)
+        new_notes = par_data.get("notes", "")
 
-    return {
-        "status": "completed", 
-        "message": "Conflict resolved and paragraph updated.",
-        "markdown": new_notes
-    }
+        return {
+            "status": "completed", 
+            "message": "Conflict resolved and paragraph updated.",
+            "markdown": new_notes
+        }
 
 
 class RequestPayload(BaseModel):
@@ -648,12 +853,7 @@ async def request_rewrite(payload: RequestPayload, request: Request):
     api_key = config_data.get("api_key", "")
     llm_model = config_data.get("llm_model", "gpt-4o")
 
-    doc = get_document(payload.doc_id)
-
-    # 1. Trigger the atomic sync here too!
-    doc.sync_context_from_ui()
-
-    # 2. Tell the graph to regenerate the paragraph
+    # 1. Tell the graph to regenerate the paragraph
     thread_id = f"{payload.doc_id}_{payload.par_id}"
     config = {
         "configurable": {
@@ -662,20 +862,26 @@ async def request_rewrite(payload: RequestPayload, request: Request):
             "llm_model": llm_model
         }
     }
-    
-    # 3. Learn from the request! Target the Compiler Profile so it learns stylistic choices.
-    update_memory(
-        in_memory_store, 
-        ("learning_assistant", "compiler_profile"), 
-        [{"role": "user", "content": f"User requested a formatting/style change: {payload.instruction}"}],
-        config
-    )
-    par_data = doc.get_paragraph(payload.par_id)
-    current_notes = par_data.get("notes", "")
 
-    current_ocr = par_data.get("ocr", "")
+    with get_document(payload.doc_id) as doc:
+        # Sync, memory update and rewrite hold the paragraph's lock together, like /process
+        async with doc.paragraph_lock(payload.par_id):
+            # 2. Trigger the atomic sync here too!
+            doc.sync_context_from_ui()
+
+            # 3. Learn from the request! Target the Compiler Profile so it learns stylistic choices.
+            update_memory(
+                in_memory_store, 
+                ("learning_assistant", "compiler_profile"), 
+                [{"role": "user", "content": f"User requested a formatting/style change: {payload.instruction}"}],
+                config
+            )
+            par_data = doc.get_paragraph(payload.par_id)
+            current_notes = par_data.get("notes", "")
+
+            current_ocr = par_data.get("ocr", "")
     
-    rewrite_prompt = f"""The user requested a rewrite: '{payload.instruction}'. 
+            rewrite_prompt = f"""The user requested a rewrite: '{payload.instruction}'. 
 
     [SOURCES]
     OCR: {current_ocr}
@@ -685,17 +891,20 @@ async def request_rewrite(payload: RequestPayload, request: Request):
     1. You MUST apply rich Markdown formatting (bolding, bullet points).
     2. If the user asks for an image, you MUST use the 'extract_image' tool using the exact filename found in the OCR source.
     2. Please invoke 'create_paragraph' using exactly doc_id: '{payload.doc_id}' and par_id: '{payload.par_id}'."""
-    # 4. Invoke the agend and update
-    await agent.ainvoke({"messages": [HumanMessage(content=rewrite_prompt)]}, config)
-
-    par_data = doc.get_paragraph(payload.par_id)
-    new_notes = par_data.get("notes", "")
+            # 4. Invoke the agend and update
+            doc.take_conflict(payload.par_id)
+            await agent.ainvoke({"messages": [HumanMessage(content=rewrite_prompt)]}, config)
+            conflict = compile_conflict(doc, payload.par_id)
+            if conflict:
+                return conflict
+            par_data = doc.get_paragraph(payload.par_id)
+        new_notes = par_data.get("notes", "")
 
-    return {
-        "status": "completed", 
-        "message": "Memory updated and paragraph rewritten.",
-        "markdown": new_notes
-    }
+        return {
+            "status": "completed", 
+            "message": "Memory updated and paragraph rewritten.",
+            "markdown": new_notes
+        }
 
 # ------------------------------------------
 # REAL-TIME AUDIO WEBSOCKET
@@ -706,93 +915,198 @@ async def websocket_audio_endpoint(websocket: WebSocket):
     await websocket.accept()
     logger.info("🎤 Client connected to Audio WebSocket")
     
+    config_data = json.loads(CONFIG_FILE.read_text()) if CONFIG_FILE.exists() else {}
+    limits = BackpressureConfig.from_dict(config_data.get("backpressure"))
+    counters = SessionCounters()
+
+    session_id = uuid.uuid4().hex
+    session_started_at = time.time()
+
+    # Optional ?doc_id=...: finalised segments are also appended to that document's transcript log
+    doc_id = safe_id(websocket.query_params.get("doc_id", ""))
+    transcript_log = TranscriptLog(doc_id) if doc_id else None
+
+    # Optional ?codec=webm-opus: compressed frames, decoded server-side. The first message tells the
+    # client what was accepted; anything else (or an old client) streams raw Int16 PCM.
+    counters.codec = negotiate_codec(websocket.query_params.get("codec"))
+    # Raw PCM may come at any rate / format / channel count the client declares (?rate=48000&format=f32&channels=2);
+    # it is downmixed and resampled server-side. Decoded codecs always arrive as 16 kHz mono Int16.
+    input_format = InputFormat.from_query(websocket.query_params) if counters.codec == "pcm16" else InputFormat()
+    normalizer = make_normalizer(input_format)
+
     # 💡 THE FIX: 3 Dedicated Queues to enforce strict single-file processing
-    audio_queue = asyncio.Queue()  # Holds raw binary chunks from frontend
-    ml_queue = asyncio.Queue()     # Holds completed sentences waiting for the AI
-    msg_queue = asyncio.Queue()    # Holds text waiting to be sent back to React
+    # All of them are bounded, so a slow transcriber can never grow memory without limit.
+    audio_queue = asyncio.Queue(maxsize=limits.max_audio_chunks)  # Holds raw binary chunks from frontend
+    ml_queue = SegmentBacklog(limits, counters)                    # Holds SpeechSegments (voiced audio only) waiting for the AI
+    msg_queue = asyncio.Queue(maxsize=limits.max_messages)         # Holds text waiting to be sent back to React
+    audio_bytes = {"queued": 0}
+
+    # Drafts and status updates are superseded by later ones, so a slow client may lose them; final text never
+    def is_droppable(msg: dict) -> bool:
+        return "partial" in msg or "status" in msg
+
+    def send_droppable(msg: dict):
+        if put_droppable(msg_queue, msg, is_droppable) is not None:
+            counters.dropped_messages += 1
 
     # --- STAGE 1: THE RECEIVER (FastAPI -> audio_queue) ---
+    def enqueue_pcm(chunk: bytes):
+        audio_bytes["queued"] += len(chunk)
+        # Never block the socket: if the VAD fell behind, the oldest audio goes first
+        evicted = put_dropping_oldest(audio_queue, chunk)
+        if evicted is not None:
+            audio_bytes["queued"] -= len(evicted)
+            counters.dropped_chunks += 1
+            counters.dropped_bytes += len(evicted)
+
+    # Sessions bound to a document also save their audio (Opus) next to it, for the background refinement pass
+    recorder = None
+    if transcript_log and refinement_worker.config.enabled:
+        recorder = SessionRecorder(
+            recording_path(doc_id, session_id, session_started_at),
+            refinement_worker.config.bitrate,
+            input_format.ffmpeg_args()
+        )
+
+    loop = asyncio.get_running_loop()
+    # Compressed sessions: a decoder thread turns the stream into PCM and hands it back to the loop
+    decoder = make_decoder(counters.codec, lambda pcm: loop.call_soon_threadsafe(enqueue_pcm, pcm))
+
     async def receiver():
         try:
             while True:
                 chunk = await websocket.receive_bytes()
-                await audio_queue.put(chunk)
+                counters.received_bytes += len(chunk)
+                if decoder:
+                    decoder.feed(chunk)
+                    counters.decoded_bytes = decoder.decoded_bytes
+                    counters.decode_cpu_s = decoder.cpu_s
+                else:
+                    counters.decoded_bytes += len(chunk)
+                    enqueue_pcm(chunk)
         except WebSocketDisconnect:
             logger.info("🎤 Client disconnected normally.")
         except Exception as e:
             logger.error(f"❌ WebSocket Receiver Error: {e}")
 
-    # --- STAGE 2: THE ENERGY GATE (audio_queue -> ml_queue) ---
-    async def energy_gate():
-        audio_buffer = bytearray()
-        silence_chunks = 0
-        is_recording = False
-        
+    # --- STAGE 2: THE VAD GATE (audio_queue -> ml_queue) ---
+    segmenter = StreamingVADSegmenter(vad_model, VADConfig.from_dict(config_data.get("vad")))
+
+    # Optional streaming mode: draft decodes of the open segment, sent as {"partial": ...}
+    streaming = StreamingConfig.from_dict(config_data.get("streaming"))
+    if websocket.query_params.get("partials") in ("1", "true"):
+        streaming.enabled = True
+    agreement = LocalAgreement()
+    partial_state = {"task": None, "last": 0.0}
+
+    async def forward_partial(utterance: int, future: asyncio.Future):
+        try:
+            hypothesis = await future
+        except asyncio.CancelledError:
+            return
+        # Drop drafts that arrive after their segment was committed
+        if not hypothesis or not segmenter.is_speaking or segmenter.utterances != utterance:
+            return
+        stable, _ = agreement.update(hypothesis)
+        send_droppable({"partial": hypothesis, "stable": stable})
+
+    def maybe_schedule_partial():
+        task = partial_state["task"]
+        if task is not None and not task.done():
+            return  # One draft in flight per session
+        now = time.monotonic()
+        if not segmenter.is_speaking or now - partial_state["last"] < streaming.min_interval_s:
+            return
+        draft = segmenter.current_samples()
+        if draft is None or draft.size < streaming.min_audio_s * 16000:
+            return
+
+        partial_state["last"] = now
+        future = transcription_scheduler.submit_partial(session_id, draft)
+        partial_state["task"] = asyncio.create_task(forward_partial(segmenter.utterances, future))
+
+    def ingest(chunk: bytes):
+        if normalizer:
+            return segmenter.feed_float32(normalizer.process(chunk))
+        return segmenter.feed(chunk)
+
+    async def vad_gate():
         while True:
             chunk = await audio_queue.get()
-            if len(chunk) == 0: 
+            audio_bytes["queued"] -= len(chunk)
+            if len(chunk) == 0:
                 continue
-                
-            pcm_array = np.frombuffer(chunk, dtype=np.int16)
-            rms_volume = np.sqrt(np.mean(pcm_array.astype(np.float32)**2))
-            
-            if rms_volume > 200:
-                is_recording = True
-                silence_chunks = 0
-                audio_buffer.extend(chunk)
-                
-                # HARD CUTOFF: 10 seconds. (Failsafe if they literally scream for 10s straight)
-                if len(audio_buffer) > 320000:
-                    await ml_queue.put(bytes(audio_buffer))
-                    is_recording = False
-                    audio_buffer = bytearray()
-            else:
-                if is_recording:
-                    silence_chunks += 1
-                    audio_buffer.extend(chunk) 
-                    
-                    # SMART BREATH DETECTION
-                    # 1. Normal breath: ~0.5 seconds (2 chunks)
-                    # 2. Aggressive cutoff: If the buffer is over 5 seconds long, cut on a micro-pause (1 chunk)
-                    is_long_sentence = len(audio_buffer) > 160000
-                    
-                    if (is_long_sentence and silence_chunks >= 1) or (silence_chunks >= 2):
-                        await ml_queue.put(bytes(audio_buffer))
-                        is_recording = False
-                        audio_buffer = bytearray()
-                        silence_chunks = 0
-
-    # --- STAGE 3: THE STRICT ML WORKER (ml_queue -> msg_queue) ---
-    def run_transcription(buffer_bytes):
-        """This function is now safely isolated."""
-        try:
-            pcm_array = np.frombuffer(buffer_bytes, dtype=np.int16)
-            samples = pcm_array.astype(np.float32) / 32768.0
-            
-            # CTranslate2 is completely safe here because we only process one at a time!
-            segments, _ = audio_model.transcribe(
-                samples, beam_size=5, language="en", condition_on_previous_text=False
-            )
-            return " ".join([s.text for s in segments]).strip()
-        except Exception as e:
-            logger.error(f"❌ Transcription Error: {e}")
-            return ""
+            # Recorded on the VAD's timeline, so refined text lines up with the draft segments
+            if recorder:
+                recorder.write(chunk)
+
+            # PCM is converted in place into the session's ring buffer; Silero scores 32 ms frames of it.
+            # Keep the torch work (and any resampling) off the event loop.
+            segments = await loop.run_in_executor(vad_executor, ingest, chunk)
+            for segment in segments:
+                agreement.reset()
+                ml_queue.put(segment)
+            report_lag()
+
+            if streaming.enabled:
+                maybe_schedule_partial()
+
+    # --- STAGE 3: THE ML WORKER (ml_queue -> shared scheduler -> msg_queue) ---
+    pending_queue = asyncio.Queue()  # Holds (segment, future) pairs in utterance order
+    inflight = asyncio.Semaphore(limits.max_inflight)
+    last_latency = {"s": 0.0}
+
+    def report_lag():
+        """Refreshes the lag counters and tells the client when it crosses the warning line."""
+        counters.lag_s = max(ml_queue.oldest_age(), last_latency["s"])
+        counters.queued_bytes = audio_bytes["queued"] + ml_queue.nbytes
+        lagging = counters.lag_s > limits.lag_warn_s or ml_queue.overloaded
+        if lagging != counters.lagging:
+            counters.lagging = lagging
+            status = "lagging" if lagging else "ok"
+            logger.warning(f"🐢 Audio session {session_id[:8]} is {status} (lag {counters.lag_s:.1f}s, policy {limits.policy}).")
+            send_droppable({"status": status, "lag_s": round(counters.lag_s, 2), "policy": limits.policy})
 
     async def ml_worker():
-        loop = asyncio.get_running_loop()
         while True:
-            # Wait for a sentence to be ready
-            buffer_bytes = await ml_queue.get() 
-            
-            # 💡 THE FIX: Force the math into the immortal thread!
-            # Because it's always the exact same OS thread, the C++ memory never corrupts.
-            transcript = await loop.run_in_executor(
-                ml_executor, run_transcription, buffer_bytes
-            )
-            
+            # Only `max_inflight` segments sit in the scheduler; the rest wait here, under the overload policy
+            await inflight.acquire()
+            segment, degraded = await ml_queue.get()
+
+            # 💡 Hand it to the cross-session scheduler without waiting, so a backlog can be batched
+            future = transcription_scheduler.submit(session_id, segment.samples, beam_size=1 if degraded else None)
+            await pending_queue.put((segment, future))
+
+    async def result_forwarder():
+        while True:
+            segment, future = await pending_queue.get()
+            try:
+                transcript = await future
+            finally:
+                inflight.release()
+            last_latency["s"] = time.monotonic() - segment.closed_at
+            report_lag()
+
             if transcript:
-                logger.debug(f"🗣️ Transcribed: {transcript}")
-                await msg_queue.put({"text": f" {transcript} "})
+                logger.debug(f"🗣️ Transcribed [{segment.start:.2f}-{segment.end:.2f}s, p={segment.speech_prob:.2f}]: {transcript}")
+                msg = {
+                    "text": f" {transcript} ",
+                    "start": round(segment.start, 2),
+                    "end": round(segment.end, 2),
+                    "speech_prob": round(segment.speech_prob, 3)
+                }
+                if transcript_log:
+                    record = transcript_log.append(
+                        transcript,
+                        session_started_at + segment.start,
+                        session_started_at + segment.end,
+                        segment.speech_prob,
+                        session_id
+                    )
+                    # The client keeps this reference instead of resending the text to /api/llm/process
+                    msg["offset"] = record["offset"]
+                if await put_keeping(msg_queue, msg, is_droppable) is not None:
+                    counters.dropped_messages += 1
 
     # --- STAGE 4: THE SENDER (msg_queue -> FastAPI) ---
     async def sender():
@@ -803,18 +1117,146 @@ async def websocket_audio_endpoint(websocket: WebSocket):
         except Exception as e:
             logger.error(f"❌ Sender Error: {e}")
 
-    # Boot up the background workers
-    gate_task = asyncio.create_task(energy_gate())
-    ml_task = asyncio.create_task(ml_worker())
-    send_task = asyncio.create_task(sender())
-    
-    # The endpoint locks onto the receiver. If the browser disconnects, clean up.
+    # Everything registered from here on is released in the finally, whatever fails first
+    tasks: List[asyncio.Task] = []
     try:
+        AUDIO_SESSIONS[session_id] = counters
+        transcription_scheduler.register_session(session_id)
+        await websocket.send_json({"codec": counters.codec, "input": input_format.as_dict()})
+        if recorder:
+            await recorder.start()
+        if decoder:
+            decoder.start()
+
+        # Boot up the background workers
+        tasks = [
+            asyncio.create_task(vad_gate()),
+            asyncio.create_task(ml_worker()),
+            asyncio.create_task(result_forwarder()),
+            asyncio.create_task(sender()),
+        ]
+
+        # The endpoint locks onto the receiver. If the browser disconnects, clean up.
         await receiver()
     finally:
-        gate_task.cancel()
-        ml_task.cancel()
-        send_task.cancel()
+        for task in tasks:
+            task.cancel()
+        if partial_state["task"] is not None:
+            partial_state["task"].cancel()
+        transcription_scheduler.unregister_session(session_id)
+        AUDIO_SESSIONS.pop(session_id, None)
+        if decoder:
+            decoder.close()
+            counters.decode_cpu_s = decoder.cpu_s
+        if recorder:
+            await recorder.close()
+        logger.info(f"🎤 VAD session stats: {segmenter.stats.as_dict()}, overload: {counters.as_dict()}")
+
+@app.get("/api/audio/stats")
+def audio_stats():
+    """Scheduler queue depth and wait times, per-session overload counters and the refinement backlog."""
+    return {
+        "scheduler": transcription_scheduler.stats(),
+        "refine": refinement_worker.describe(),
+        "sessions": {sid: c.as_dict() for sid, c in AUDIO_SESSIONS.items()}
+    }
+
+class WhisperSettingsPayload(BaseModel):
+    model: str = "base"
+    compute_type: str = "default"
+    cpu_threads: int = 2
+    warmup: bool = True
+
+class BenchmarkPayload(BaseModel):
+    configs: List[WhisperSettingsPayload] = []  # Empty = every size x {int8, int8_float32, float32}
+    audio_path: Optional[str] = None            # Optional saved recording, relative to the recordings directory (and reference text) to also get a WER
+    reference: Optional[str] = None
+    seconds: float = 10.0
+
+@app.get("/api/audio/model")
+def get_audio_model():
+    return model_registry.describe()
+
+@app.post("/api/audio/model")
+async def swap_audio_model(payload: WhisperSettingsPayload):
+    """Loads a new Whisper configuration in the background, then hot-swaps it in (each replica warms it up first)."""
+    try:
+        config = WhisperConfig.from_dict(payload.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async with model_swap_lock:
+        loop = asyncio.get_running_loop()
+        try:
+            models = await loop.run_in_executor(None, model_registry.load, config)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        transcription_scheduler.swap_models(models, warm=config.warmup)
+        offline_transcriber.follow(config)
+
+    # Remember the choice for the next boot
+    data = json.loads(CONFIG_FILE.read_text()) if CONFIG_FILE.exists() else {}
+    data["whisper"] = config.as_dict()
+    CONFIG_FILE.write_text(json.dumps(data))
+    return model_registry.describe()
+
+@app.post("/api/audio/benchmark")
+async def benchmark_audio_models(payload: BenchmarkPayload):
+    """Reports the real-time factor of each Whisper configuration on this CPU (slow: minutes, not seconds)."""
+    try:
+        if payload.configs:
+            configs = [WhisperConfig.from_dict(c.dict()) for c in payload.configs]
+        else:
+            configs = [
+                WhisperConfig(model=size, compute_type=ct, cpu_threads=model_registry.active.cpu_threads)
+                for size in WHISPER_SIZES if size in model_registry.describe()["cached_sizes"]
+                for ct in ("int8", "int8_float32", "float32")
+            ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Only saved session recordings can be benchmarked: the path never leaves the recordings directory
+    audio_path = None
+    if payload.audio_path:
+        recordings = Path(RECORDINGS_DIR).resolve()
+        audio_path = (recordings / payload.audio_path).resolve()
+        if not audio_path.is_relative_to(recordings):
+            raise HTTPException(status_code=400, detail="audio_path must be inside the recordings directory")
+        if not audio_path.is_file():
+            raise HTTPException(status_code=404, detail=f"Recording {payload.audio_path} not found")
+
+    scheduler_config = transcription_scheduler.config
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(
+        None, benchmark, configs, str(audio_path) if audio_path else None, payload.reference, payload.seconds,
+        VADConfig().max_segment_s, scheduler_config.batch_size, scheduler_config.beam_size
+    )
+    return {"results": results}
+
+@app.post("/api/audio/transcribe")
+async def transcribe_recording(file: UploadFile = File(...)):
+    """Queues a recorded lecture (wav/mp3/m4a) for parallel offline transcription. Poll the returned job."""
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{ext}'. Use one of {SUPPORTED_EXTENSIONS}.")
+
+    # Stream the upload to disk in a worker thread instead of reading it into memory
+    job_id, upload_path = offline_transcriber.new_upload_path(file.filename)
+    def _store():
+        with open(upload_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer, length=1024 * 1024)
+    await asyncio.get_running_loop().run_in_executor(None, _store)
+
+    job = offline_transcriber.submit(job_id, upload_path, file.filename)
+    return job.as_dict(include_segments=False)
+
+@app.get("/api/audio/transcribe/{job_id}")
+def get_transcription_job(job_id: str):
+    """Progress of an offline job; the timestamped transcript is included once it completes."""
+    job = offline_transcriber.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Transcription job not found")
+    return job.as_dict()
 
 # ------------------------------------------
 # ANTI-API ENDPOINTS
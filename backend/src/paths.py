@@ -0,0 +1,16 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Centralized Directory Management from .env. Kept apart from document.py, so modules that only need
+# a directory (and child processes like the refinement pass) don't open the storage and search index
+DOCS_DIR = os.getenv("DOCS_DIR", "./docs")
+CONTEXT_DIR = os.getenv("CONTEXT_DIR", "./context")
+TRANSCRIPTS_DIR = os.getenv("TRANSCRIPTS_DIR", "./transcripts")
+RECORDINGS_DIR = os.getenv("RECORDINGS_DIR", "./recordings")
+
+os.makedirs(DOCS_DIR, exist_ok=True)
+os.makedirs(CONTEXT_DIR, exist_ok=True)
+os.makedirs(TRANSCRIPTS_DIR, exist_ok=True)
+os.makedirs(RECORDINGS_DIR, exist_ok=True)
@@ -0,0 +1,387 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import fitz
+
+from image_store import ImageStore, store_image
+
+MIN_IMAGE_SIZE = 150                # Smaller images are icons, bullets and other slide artifacts
+MIN_PAGES_PER_WORKER = 16           # Below this, a worker process costs more to start than it saves
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("CallimacusAPI")
+
+# --- PAGE EXTRACTION ---
+
+def extract_page(doc: "fitz.Document", index: int, images_dir: Path,
+                 xrefs: Dict[int, Optional[str]]) -> Tuple[str, List[str]]:
+    """
+    Text of one page, with its images saved as content-addressed temp files and referenced inline
+    for the agent. Returns the text and the image filenames. `xrefs` maps the document's image xrefs
+    to their filename (None: too small) and is shared across the pages of a document, so an image
+    repeated on every slide is decoded and hashed once.
+    """
+    page = doc[index]
+    raw_text = page.get_text("text").replace('\n', ' ')
+
+    images = []
+    for img in page.get_images(full=True):
+        xref, width, height = img[0], img[2], img[3]
+        if xref not in xrefs:
+            # Filter out small artifacts and point images (get_images already knows the size: no decoding)
+            if width < MIN_IMAGE_SIZE or height < MIN_IMAGE_SIZE:
+                xrefs[xref] = None
+            else:
+                base_image = doc.extract_image(xref)
+                xrefs[xref] = store_image(images_dir, base_image["image"], base_image["ext"])[0]
+
+        filename = xrefs[xref]
+        if filename is None or filename in images:
+            continue
+        images.append(filename)
+        raw_text += f"\n[IMAGE AVAILABLE: '{filename}']"
+
+    return raw_text, images
+
+# --- EXTRACTION CACHE CLASS ---
+
+class PDFCache():
+    """
+    Extraction results on disk, addressed by the SHA-256 of the PDF bytes:
+    {cache_dir}/{key}/deck.pdf and pages.jsonl (one extracted page per line, with its images).
+    The page images live in the shared image store, held as "pdf:{key}" for as long as the entry exists.
+    Open sessions hold a reference on their entry; unreferenced entries are evicted least recently
+    used first (directory mtime) once the cache outgrows `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: Path, image_store: ImageStore, max_bytes: int = 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.image_store = image_store
+        self.images_dir = image_store.images_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Half-written uploads from a crash
+        for incoming in self.cache_dir.glob("incoming_*.pdf"):
+            incoming.unlink(missing_ok=True)
+        self._reconcile()
+
+    @staticmethod
+    def holder(key: str) -> str:
+        return f"pdf:{key}"
+
+    def _reconcile(self):
+        """
+        Brings the image store in line with the entries on disk. Only pages.jsonl files written after
+        the store's index was last saved (i.e. lost in a crash) are read; entries gone from disk are dropped.
+        """
+        keys = set()
+        for entry in self.cache_dir.iterdir():
+            if not entry.is_dir():
+                continue
+            keys.add(entry.name)
+            pages_path = entry / "pages.jsonl"
+            if pages_path.exists() and pages_path.stat().st_mtime >= self.image_store.saved_at:
+                images = set()
+                for record in read_pages(pages_path):
+                    images.update(record.get("images", ()))
+                self.image_store.add_refs(self.holder(entry.name), images)
+        for holder in list(self.image_store.holders):
+            if holder.startswith("pdf:") and holder[4:] not in keys:
+                self.image_store.drop(holder)
+        self.image_store.flush()
+
+    def store(self, fileobj) -> str:
+        """
+        Streams an upload into the cache, hashing it on the way. Blocking.
+        Returns its key, already referenced (so it cannot be evicted) until the caller releases it.
+        """
+        digest = hashlib.sha256()
+        incoming = self.cache_dir / f"incoming_{uuid.uuid4().hex}.pdf"
+        with open(incoming, "wb") as buffer:
+            while True:
+                block = fileobj.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+                buffer.write(block)
+
+        key = digest.hexdigest()[:32]
+        entry = self.cache_dir / key
+        with self._lock:
+            if (entry / "deck.pdf").exists():
+                self.hits += 1
+                incoming.unlink()
+            else:
+                self.misses += 1
+                entry.mkdir(exist_ok=True)
+                incoming.replace(entry / "deck.pdf")
+            self.refs[key] = self.refs.get(key, 0) + 1
+            os.utime(entry)  # Most recently used
+        return key
+
+    def release(self, key: str) -> int:
+        """Drops a session's reference. Returns the number of files evicted as a result."""
+        with self._lock:
+            self.refs[key] = max(0, self.refs.get(key, 0) - 1)
+            if not self.refs[key]:
+                del self.refs[key]
+        removed = self.evict()
+        self.image_store.flush()
+        return removed
+
+    def _entry_size(self, key: str) -> int:
+        # Shared images are counted in full against every entry holding them: eviction errs on the early side
+        size = sum(f.stat().st_size for f in (self.cache_dir / key).iterdir())
+        for name in self.image_store.holders.get(self.holder(key), ()):
+            try:
+                size += (self.images_dir / name).stat().st_size
+            except OSError:
+                continue
+        return size
+
+    def evict(self) -> int:
+        with self._lock:
+            entries = []
+            for entry in self.cache_dir.iterdir():
+                if not entry.is_dir():
+                    continue
+                entries.append((entry.stat().st_mtime, entry.name, self._entry_size(entry.name)))
+
+            total = sum(e[2] for e in entries)
+            removed = 0
+            for _, key, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if self.refs.get(key):
+                    continue  # Open in MediaWindow right now
+                removed += len(list((self.cache_dir / key).iterdir()))
+                shutil.rmtree(self.cache_dir / key, ignore_errors=True)
+                # Images still shown by another cached deck keep their other holder
+                removed += self.image_store.drop(self.holder(key))
+                total -= size
+                self.evictions += 1
+            return removed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "open": len(self.refs),
+            "images": self.image_store.stats(),
+        }
+
+def read_pages(pages_path: Path) -> List[dict]:
+    """The records of a pages.jsonl file, skipping a torn tail from a crash mid-write."""
+    records = []
+    if pages_path.exists():
+        with open(pages_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except Exception:
+                    continue
+    return records
+
+# --- PDF SESSION CLASS ---
+
+class PDFSessionClosed(Exception):
+    """A page was asked of a session that was already closed (by the client or the idle reaper)."""
+
+
+class PDFSession():
+    """
+    One opened slide deck. Its cache entry stays referenced for the whole session, so any page can
+    be extracted on demand (the one on screen first) while a stream fills in the rest; pages already
+    extracted by an earlier session on the same bytes are served from the cache without touching PyMuPDF.
+    PyMuPDF documents are not thread-safe: every page goes through the session lock.
+    """
+
+    def __init__(self, cache: PDFCache, key: str):
+        """`key` must already be referenced (see PDFCache.store); the session releases it on close."""
+        self.session_id = uuid.uuid4().hex
+        self.cache = cache
+        self.key = key
+        self.entry = cache.cache_dir / key
+        self.images_dir = cache.images_dir
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.users = 0        # Streams and page requests in progress (see in_use); touched on the event loop only
+        self.closed = False
+        self._lock = threading.Lock()
+        self.pdf_path = self.entry / "deck.pdf"
+        self._pages_path = self.entry / "pages.jsonl"
+        self.pages: Dict[int, str] = {r["page"]: r["text"] for r in read_pages(self._pages_path)}
+        self.cached_pages = len(self.pages)
+        self._xrefs: Dict[int, Optional[str]] = {}
+        try:
+            self._doc = fitz.open(str(self.pdf_path))  # Lazy: only the xref table is read here
+        except Exception:
+            cache.release(key)
+            raise
+        self.total_pages = len(self._doc)
+
+    @classmethod
+    def from_upload(cls, fileobj, cache: PDFCache) -> "PDFSession":
+        """Streams an upload into the cache (never fully into memory) and opens it. Blocking."""
+        return cls(cache, cache.store(fileobj))
+
+    def page(self, number: int) -> str:
+        """Text of a 1-based page, extracted on first access. Blocking: call from a worker thread."""
+        if not 1 <= number <= self.total_pages:
+            raise IndexError(f"Page {number} out of range (1-{self.total_pages})")
+        self.last_used = time.time()
+        with self._lock:
+            if number not in self.pages:
+                if self.closed:
+                    raise PDFSessionClosed(f"PDF session {self.session_id[:8]} is closed")
+                self._record(number, *extract_page(self._doc, number - 1, self.images_dir, self._xrefs))
+            return self.pages[number]
+
+    def record(self, number: int, text: str, images: List[str]):
+        """Stores a page extracted elsewhere (by a worker process)."""
+        self.last_used = time.time()
+        with self._lock:
+            if number not in self.pages and not self.closed:
+                self._record(number, text, images)
+
+    def _record(self, number: int, text: str, images: List[str]):
+        # Referenced before the page is visible, so a concurrent sweep can never take its images
+        self.cache.image_store.add_refs(PDFCache.holder(self.key), images)
+        with open(self._pages_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"page": number, "text": text, "images": images}, ensure_ascii=False) + "\n")
+        self.pages[number] = text
+
+    def order_from(self, first_page: int = 1) -> List[int]:
+        """Every page number, starting with `first_page` and wrapping around."""
+        first_page = min(max(first_page, 1), max(self.total_pages, 1))
+        return list(range(first_page, self.total_pages + 1)) + list(range(1, first_page))
+
+    def idle_s(self) -> float:
+        """Seconds since a page was last read or recorded."""
+        return time.time() - self.last_used
+
+    @contextmanager
+    def in_use(self):
+        """Marks a stream or page request as using the session for the `with` block: the idle reaper skips it."""
+        self.users += 1
+        try:
+            yield self
+        finally:
+            self.users -= 1
+            self.last_used = time.time()
+
+    def close(self) -> int:
+        """
+        Releases the cache entry (the deck and its images stay for the next session). Returns files evicted.
+        Pages already extracted can still be read; asking for any other raises PDFSessionClosed.
+        """
+        with self._lock:
+            if self.closed:
+                return 0
+            self.closed = True
+            self._doc.close()
+        return self.cache.release(self.key)
+
+# --- PARALLEL EXTRACTION ---
+
+def _split(numbers: List[int], parts: int) -> List[List[int]]:
+    """Contiguous, near-equal runs of pages (neighbouring pages tend to share images and fonts)."""
+    size, extra = divmod(len(numbers), parts)
+    runs, first = [], 0
+    for i in range(parts):
+        last = first + size + (i < extra)
+        runs.append(numbers[first:last])
+        first = last
+    return runs
+
+
+async def extract_pages(session: PDFSession, numbers: List[int], workers: int = DEFAULT_WORKERS) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Yields (page, text) for `numbers`, in that order. Pages missing from the cache are split into
+    contiguous runs, one worker process per run (`python -m pdf_extraction`), each opening its own
+    fitz document on the cached deck; small jobs stay on a worker thread. The event loop only waits.
+    """
+    loop = asyncio.get_running_loop()
+    missing = [n for n in numbers if n not in session.pages]
+    parts = min(workers, len(missing) // MIN_PAGES_PER_WORKER)
+    if parts < 2:
+        for number in numbers:
+            yield number, await loop.run_in_executor(None, session.page, number)
+        return
+
+    futures: Dict[int, asyncio.Future] = {n: loop.create_future() for n in missing}
+    procs: List[asyncio.subprocess.Process] = []
+
+    async def run(pages: List[int]):
+        try:
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (SRC_DIR, os.environ.get("PYTHONPATH")))))
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "pdf_extraction", str(session.pdf_path),
+                str(session.images_dir), ",".join(map(str, pages)),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                env=env, limit=16 * 1024 * 1024,
+            )
+            procs.append(proc)
+            async for line in proc.stdout:
+                if not line.startswith(b"{"):
+                    continue  # Library chatter (e.g. PyMuPDF deprecation notices), not a page record
+                record = json.loads(line)
+                await loop.run_in_executor(None, session.record, record["page"], record["text"], record["images"])
+                futures[record["page"]].set_result(record["text"])
+            await proc.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"PDF worker for pages {pages[0]}-{pages[-1]} failed: {e}")
+        # Whatever the worker did not deliver (it crashed, or the deck upset it) is done in-process
+        for number in pages:
+            if not futures[number].done():
+                try:
+                    futures[number].set_result(await loop.run_in_executor(None, session.page, number))
+                except Exception as e:
+                    futures[number].set_exception(e)
+
+    tasks = [asyncio.create_task(run(pages)) for pages in _split(missing, parts)]
+    try:
+        for number in numbers:
+            yield number, (await futures[number] if number in futures else session.pages[number])
+        await asyncio.gather(*tasks)  # Every page is in: just reap the workers
+    finally:
+        # Consumer gone (the user closed the deck) or a page failed: stop the rest
+        for task in tasks:
+            task.cancel()
+        for proc in procs:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+
+if __name__ == "__main__":
+    # Worker process: extract_pages() runs `python -m pdf_extraction <pdf> <images_dir> <p1,p2,...>`
+    # and reads one JSON line per page from stdout.
+    pdf_path, images_dir, pages = sys.argv[1:4]
+    doc = fitz.open(pdf_path)
+    xrefs: Dict[int, Optional[str]] = {}
+    for number in map(int, pages.split(",")):
+        text, images = extract_page(doc, number - 1, Path(images_dir), xrefs)
+        sys.stdout.write(json.dumps({"page": number, "text": text, "images": images}, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
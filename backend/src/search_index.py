@@ -0,0 +1,270 @@
+import re
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+from storage import Transaction
+
+logger = logging.getLogger("CallimacusAPI")
+
+SNIPPET_TOKENS = 12   # Words of context around the matched terms
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MIN_PREFIX_CHARS = 3  # A shorter last word is matched whole: a 1-2 letter prefix matches most of the index
+
+# Block and paragraph texts live in `entries`; `entries_fts` is the FTS5 inverted index over them
+# (external content, kept in step by triggers), ranked with its built-in BM25
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    rowid INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (doc_id, kind, ref)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    text, content='entries', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', prefix='3'
+);
+CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE OF text ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    INSERT INTO entries_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TABLE IF NOT EXISTS indexed (
+    doc_id TEXT PRIMARY KEY,
+    indexed_at REAL NOT NULL
+);
+"""
+
+def block_text(block: Dict) -> str:
+    """All the text of a block: its inline content, table cells and nested children."""
+    parts = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("text"), str):
+                parts.append(node["text"])
+            for key in ("content", "rows", "cells", "children"):
+                walk(node.get(key))
+        elif isinstance(node, list):
+            for child in node:
+                walk(child)
+
+    walk(block)
+    return " ".join(p for p in parts if p.strip())
+
+def context_text(paragraph: Dict) -> str:
+    """The searchable text of a paragraph context: heading, notes and the sources they were compiled from."""
+    fields = ("heading", "notes", "additional_notes", "ocr", "audio")
+    return "\n".join(paragraph[f] for f in fields if isinstance(paragraph.get(f), str) and paragraph[f].strip())
+
+
+class SearchIndex():
+    """
+    Full-text index over every notebook's blocks ("block" entries, by block id) and paragraph contexts
+    ("context" entries, by paragraph id, i.e. the id of the section's heading block), in a SQLite FTS5
+    database. Saves update it incrementally, rewriting only the entries whose text changed; reindex()
+    rebuilds it from storage, on a background thread via start_reindex(). It holds derived data only:
+    write failures are logged rather than raised, and a full reindex repairs them.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self.queries = 0
+        self.last_query_ms = 0.0
+        self.reindexed = 0
+        self._reindex_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # --- 1. INCREMENTAL UPDATES ---
+
+    def _sync(self, cur, doc_id: str, kind: str, texts: Dict[str, str], refs: Optional[Set[str]]) -> int:
+        """Makes the doc's `kind` entries match `texts` (only those in `refs`, if given). Returns the entries written."""
+        existing = dict(cur.execute("SELECT ref, text FROM entries WHERE doc_id = ? AND kind = ?", (doc_id, kind)))
+        written = 0
+        for ref in (existing.keys() | texts.keys()) if refs is None else refs:
+            old, new = existing.get(ref), texts.get(ref) or None
+            if old == new:
+                continue
+            if new is None:
+                cur.execute("DELETE FROM entries WHERE doc_id = ? AND kind = ? AND ref = ?", (doc_id, kind, ref))
+            elif old is None:
+                cur.execute("INSERT INTO entries (doc_id, kind, ref, text) VALUES (?, ?, ?, ?)", (doc_id, kind, ref, new))
+            else:
+                cur.execute("UPDATE entries SET text = ? WHERE doc_id = ? AND kind = ? AND ref = ?", (new, doc_id, kind, ref))
+            written += 1
+        return written
+
+    def _update(self, doc_id: str, kind: str, texts: Dict[str, str], refs: Optional[Set[str]], as_of: Optional[float]):
+        """One transaction; with `as_of` (a reindex), skipped if a save indexed the notebook after that time."""
+        try:
+            with Transaction(self._conn, self._lock) as cur:
+                if as_of is not None:
+                    row = cur.execute("SELECT indexed_at FROM indexed WHERE doc_id = ?", (doc_id,)).fetchone()
+                    if row and row[0] > as_of:
+                        return
+                self._sync(cur, doc_id, kind, texts, refs)
+                cur.execute(
+                    "INSERT INTO indexed (doc_id, indexed_at) VALUES (?, ?) "
+                    "ON CONFLICT (doc_id) DO UPDATE SET indexed_at = excluded.indexed_at",
+                    (doc_id, as_of or time.time()),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Search index update failed for {doc_id}: {e}")
+
+    def index_blocks(self, doc_id: str, blocks: List[Dict], touched: Optional[Set[str]] = None,
+                     as_of: Optional[float] = None):
+        """Indexes a notebook's blocks; with `touched` (a patch) only those block ids are looked at."""
+        texts = {b["id"]: block_text(b) for b in blocks
+                 if isinstance(b, dict) and b.get("id") and (touched is None or b["id"] in touched)}
+        self._update(doc_id, "block", texts, touched, as_of)
+
+    def index_context(self, doc_id: str, paragraphs: Dict[str, Dict], changed: Optional[Set[str]] = None,
+                      as_of: Optional[float] = None):
+        """Indexes a notebook's paragraph contexts; with `changed` only those paragraph ids are looked at."""
+        texts = {par_id: context_text(par) for par_id, par in paragraphs.items() if changed is None or par_id in changed}
+        self._update(doc_id, "context", texts, changed, as_of)
+
+    def rename(self, old: str, new: str):
+        try:
+            with Transaction(self._conn, self._lock) as cur:
+                cur.execute("UPDATE entries SET doc_id = ? WHERE doc_id = ?", (new, old))
+                cur.execute("UPDATE indexed SET doc_id = ? WHERE doc_id = ?", (new, old))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Search index rename failed for {old}: {e}")
+
+    def delete(self, doc_id: str):
+        try:
+            with Transaction(self._conn, self._lock) as cur:
+                cur.execute("DELETE FROM entries WHERE doc_id = ?", (doc_id,))
+                cur.execute("DELETE FROM indexed WHERE doc_id = ?", (doc_id,))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Search index delete failed for {doc_id}: {e}")
+
+    # --- 2. QUERIES ---
+
+    @staticmethod
+    def match_expression(query: str) -> Optional[str]:
+        """
+        The FTS5 expression for free text: every word must occur, and the last one may be a prefix (search
+        as you type, from MIN_PREFIX_CHARS letters). Words are quoted, so punctuation is never FTS5 syntax.
+        """
+        words = TOKEN_RE.findall(query.lower())
+        if not words:
+            return None
+        last = f'"{words[-1]}"*' if len(words[-1]) >= MIN_PREFIX_CHARS else f'"{words[-1]}"'
+        return " ".join([f'"{w}"' for w in words[:-1]] + [last])
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, doc_id: Optional[str] = None) -> List[Dict]:
+        """
+        The best matches, by BM25: {doc_id, block_id, source ('block' or 'context'), score, snippet},
+        where the snippet marks the matched words with **.
+        """
+        expression = self.match_expression(query)
+        if expression is None:
+            return []
+        # Ranked and paged inside FTS5 (ORDER BY rank), so snippets are only built for the returned page
+        where = "entries_fts MATCH ?"
+        params: list = [expression]
+        if doc_id is not None:
+            where += " AND rowid IN (SELECT rowid FROM entries WHERE doc_id = ?)"
+            params.append(doc_id)
+        sql = (
+            "SELECT e.doc_id, e.ref, e.kind, hit.rank, hit.snippet FROM ("
+            f"SELECT rowid, rank, snippet(entries_fts, 0, '**', '**', '…', {SNIPPET_TOKENS}) AS snippet "
+            f"FROM entries_fts WHERE {where} ORDER BY rank LIMIT ? OFFSET ?"
+            ") AS hit JOIN entries e ON e.rowid = hit.rowid ORDER BY hit.rank"
+        )
+        params += [limit, offset]
+
+        start = time.perf_counter()
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        self.queries += 1
+        self.last_query_ms = (time.perf_counter() - start) * 1000
+        # FTS5's rank (bm25) is negative, lower being better: flipped so that higher scores rank first
+        return [
+            {"doc_id": d, "block_id": ref, "source": kind, "score": round(-score, 4), "snippet": snippet}
+            for d, ref, kind, score, snippet in rows
+        ]
+
+    # --- 3. REINDEX ---
+
+    def reindex(self, storage, full: bool = False) -> int:
+        """
+        Brings the index in line with storage: notebooks modified since they were last indexed (all of
+        them if `full`) are read and re-indexed, and those gone from storage dropped. Returns the number read.
+        """
+        with self._lock:
+            indexed = dict(self._conn.execute("SELECT doc_id, indexed_at FROM indexed"))
+        _, catalog = storage.catalog()
+        mtimes = {entry["id"]: entry["mtime"] for entry in catalog}
+        for doc_id in indexed.keys() - mtimes.keys():
+            self.delete(doc_id)
+
+        read = 0
+        for doc_id, mtime in mtimes.items():
+            if self._stop.is_set():
+                break
+            if not full and doc_id in indexed and indexed[doc_id] >= mtime:
+                continue
+            as_of = time.time()
+            blocks, _ = storage.load_blocks(doc_id)
+            self.index_blocks(doc_id, blocks, as_of=as_of)
+            self.index_context(doc_id, storage.load_context(doc_id), as_of=as_of)
+            read += 1
+        self.reindexed += read
+        return read
+
+    def start_reindex(self, storage, full: bool = False) -> bool:
+        """Runs reindex() on a background thread. False if one is already running."""
+        if self._reindex_thread is not None and self._reindex_thread.is_alive():
+            return False
+
+        def run():
+            start = time.time()
+            try:
+                read = self.reindex(storage, full)
+            except Exception as e:
+                logger.error(f"❌ Search reindex failed: {e}")
+                return
+            if read:
+                logger.info(f"🔎 Search index: {read} notebooks indexed in {time.time() - start:.1f}s")
+
+        self._stop.clear()
+        self._reindex_thread = threading.Thread(target=run, name="search-reindex", daemon=True)
+        self._reindex_thread.start()
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            notebooks = self._conn.execute("SELECT COUNT(*) FROM indexed").fetchone()[0]
+        return {
+            "notebooks": notebooks,
+            "entries": entries,
+            "reindexing": self._reindex_thread is not None and self._reindex_thread.is_alive(),
+            "reindexed": self.reindexed,
+            "queries": self.queries,
+            "last_query_ms": round(self.last_query_ms, 3),
+        }
+
+    def close(self):
+        self._stop.set()
+        if self._reindex_thread is not None:
+            self._reindex_thread.join()
+        with self._lock:
+            self._conn.close()
@@ -2,22 +2,24 @@ import os
 # Ignore the duplicate OpenMP library warning on Mac
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
+import argparse
 import torch
 from faster_whisper import WhisperModel
 
-def cache_models():
+def cache_models(sizes):
     print("🚀 Starting model caching process...")
 
-    print("\n🧠 1/2: Downloading and compiling Faster-Whisper 'base'...")
-    # This downloads the weights to ~/.cache/huggingface and compiles the CTranslate2 binaries
-    WhisperModel("base", device="cpu", compute_type="default")
-    print("✅ Faster-Whisper cached successfully!")
+    for size in sizes:
+        print(f"\n🧠 1/2: Downloading and compiling Faster-Whisper '{size}'...")
+        # This downloads the weights to ~/.cache/huggingface and compiles the CTranslate2 binaries
+        WhisperModel(size, device="cpu", compute_type="default")
+        print(f"✅ Faster-Whisper '{size}' cached successfully!")
 
     print("\n🧠 2/2: Downloading Silero VAD from GitHub...")
     # This downloads the repo to ~/.cache/torch/hub and bypasses the security prompt
     torch.hub.load(
-        repo_or_dir='snakers4/silero-vad', 
-        model='silero_vad', 
+        repo_or_dir='snakers4/silero-vad',
+        model='silero_vad',
         force_reload=True, # Force a clean download
         trust_repo=True
     )
@@ -25,5 +27,34 @@ def cache_models():
 
     print("\n🎉 All ML models are securely cached to your hard drive. You can now start FastAPI!")
 
+def run_benchmark(sizes, threads, audio_path=None, reference=None):
+    """Prints the real-time factor of every cached size x compute type on this CPU."""
+    from audio_pipeline.models import WhisperConfig, benchmark
+
+    configs = [
+        WhisperConfig(model=size, compute_type=ct, cpu_threads=threads)
+        for size in sizes
+        for ct in ("int8", "int8_float32", "float32")
+    ]
+    print(f"⏱️ Benchmarking {len(configs)} configurations (lower RTF is faster)...\n")
+    for row in benchmark(configs, audio_path, reference):
+        cfg = row["config"]
+        if "error" in row:
+            print(f"  {cfg['model']:<6} {cfg['compute_type']:<13} ❌ {row['error']}")
+            continue
+        wer = f"  WER {row['wer']:.1%}" if "wer" in row else ""
+        print(f"  {cfg['model']:<6} {cfg['compute_type']:<13} RTF {row['rtf']:.3f}  (load {row['load_s']}s){wer}")
+
 if __name__ == "__main__":
-    cache_models()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Cache (or benchmark) the local audio models.")
+    parser.add_argument("--sizes", nargs="+", default=["base"], choices=["tiny", "base", "small"])
+    parser.add_argument("--benchmark", action="store_true", help="Benchmark the cached sizes instead of downloading")
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--audio", help="Optional recording to benchmark on (default: synthetic audio)")
+    parser.add_argument("--reference", help="Reference transcript of --audio, to report the word error rate")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.sizes, args.threads, args.audio, args.reference)
+    else:
+        cache_models(args.sizes)
@@ -0,0 +1,680 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger("CallimacusAPI")
+
+# Block patches are appended here and folded into the UI file once they outgrow it (JSON backend)
+JOURNAL_SUFFIX = ".ops.jsonl"
+COMPACT_MIN_BYTES = 64 * 1024
+MIN_POSITION_GAP = 1e-9   # Below this, fractional block positions are renumbered (SQLite backend)
+CATALOG_FILE = "catalog.json"  # Notebook catalog snapshot, in the context directory (JSON backend)
+CATALOG_FLUSH_S = 5.0          # The snapshot is rewritten at most this often (and on close)
+# "bytes" is a notebook's stored size as each backend keeps it: the UI file plus its journal (JSON), the block
+# bodies (SQLite). It orders notebooks within one backend; the same notebook measures differently across them
+CATALOG_SORTS = ("name", "mtime", "bytes", "paragraphs", "compiled_at")
+
+def notebook_title(name: str) -> str:
+    """The display name derived from a notebook id."""
+    return name.replace("_", " ").replace("-", " ").title()
+
+# --- BLOCK PATCHES ---
+
+def _position_after(blocks: List[Dict], after: Optional[str]) -> int:
+    if after is None:
+        return 0
+    for i, block in enumerate(blocks):
+        if block.get("id") == after:
+            return i + 1
+    raise ValueError(f"Unknown block '{after}'")
+
+def apply_ops(blocks: List[Dict], ops: List[Dict]) -> List[Dict]:
+    """
+    Applies block operations to the top-level block list and returns the new list (the input is untouched).
+    Ops address blocks by id: {"op": "insert", "block", "after"}, {"op": "update", "block"},
+    {"op": "delete", "id"} and {"op": "move", "id", "after"}, where "after" is a block id or None for the top.
+    They are idempotent, so a journal replayed over a file that already contains it converges:
+    inserting an existing id moves and replaces it, and deleting, updating or moving a missing one is a no-op.
+    Raises ValueError on a malformed op.
+    """
+    blocks = list(blocks)
+    for op in ops:
+        kind = op.get("op")
+        if kind in ("insert", "update"):
+            block = op.get("block")
+            if not isinstance(block, dict) or not block.get("id"):
+                raise ValueError(f"'{kind}' needs a block with an id")
+            block_id = block["id"]
+        elif kind in ("delete", "move"):
+            block_id = op.get("id")
+            if not block_id:
+                raise ValueError(f"'{kind}' needs an id")
+        else:
+            raise ValueError(f"Unknown op '{kind}'")
+
+        index = next((i for i, b in enumerate(blocks) if b.get("id") == block_id), None)
+        if kind == "update":
+            if index is not None:
+                blocks[index] = block
+        elif kind == "delete":
+            if index is not None:
+                del blocks[index]
+        elif kind == "move":
+            if index is not None:
+                moved = blocks.pop(index)
+                blocks.insert(_position_after(blocks, op.get("after")), moved)
+        else:
+            if index is not None:
+                del blocks[index]
+            blocks.insert(_position_after(blocks, op.get("after")), block)
+    return blocks
+
+def op_block_id(op: Dict) -> str:
+    return op.get("id") or op["block"]["id"]
+
+# --- JSON BACKEND ---
+
+class JSONStorage():
+    """
+    The original layout: {docs_dir}/{id}.json holds the UI blocks (with {id}.ops.jsonl, the patches not
+    yet folded into it) and {context_dir}/{id}_cx.json the paragraph contexts. Writes rewrite whole files.
+    """
+
+    def __init__(self, docs_dir: str, context_dir: str):
+        self.docs_dir = docs_dir
+        self.context_dir = context_dir
+        self._sizes: Dict[str, List[int]] = {}  # id -> [UI file bytes, journal bytes]
+        self._catalog: Optional[Dict[str, Dict]] = None  # id -> catalog entry, loaded on first use
+        self._catalog_lock = threading.RLock()
+        self._catalog_dirty = False
+        self._catalog_saved = 0.0
+
+    def _doc_path(self, name: str) -> str:
+        return os.path.join(self.docs_dir, f"{name}.json")
+
+    def _journal_path(self, name: str) -> str:
+        return os.path.join(self.docs_dir, f"{name}{JOURNAL_SUFFIX}")
+
+    def _context_path(self, name: str) -> str:
+        return os.path.join(self.context_dir, f"{name}_cx.json")
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._doc_path(name))
+
+    def list_documents(self) -> List[str]:
+        return [f[:-5] for f in os.listdir(self.docs_dir) if f.endswith(".json")]
+
+    # --- 1. UI BLOCKS ---
+
+    def load_blocks(self, name: str) -> Tuple[List[Dict], int]:
+        """The UI blocks (the file with the journal replayed on top) and their version."""
+        blocks, doc_bytes, journal_bytes, version = [], 0, 0, 0
+        doc_path, journal_path = self._doc_path(name), self._journal_path(name)
+        if os.path.exists(doc_path):
+            try:
+                with open(doc_path, "r", encoding="utf-8") as f:
+                    blocks = json.load(f)
+                doc_bytes = os.path.getsize(doc_path)
+            except Exception:
+                blocks = []
+        if not isinstance(blocks, list):
+            blocks = []
+
+        if os.path.exists(journal_path):
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        if "base" in entry:
+                            version = entry["base"]
+                        else:
+                            blocks = apply_ops(blocks, entry["ops"])
+                            version = entry["version"]
+                    except Exception:
+                        continue  # Torn tail from a crash mid-write
+            journal_bytes = os.path.getsize(journal_path)
+        self._sizes[name] = [doc_bytes, journal_bytes]
+        return blocks, version
+
+    def _write_journal_base(self, name: str, version: int):
+        with open(self._journal_path(name), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"base": version}) + "\n")
+        self._sizes.setdefault(name, [0, 0])[1] = 0
+
+    def _write_ui_file(self, name: str, content: str):
+        path = self._doc_path(name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        self._sizes.setdefault(name, [0, 0])[0] = len(content)
+
+    def save_blocks(self, name: str, blocks: List[Dict], version: int, content: Optional[str] = None):
+        # Version first: a crash in between loses this save rather than replaying old patches over it
+        self._write_journal_base(name, version)
+        self._write_ui_file(name, content if content is not None else json.dumps(blocks))
+        self._catalog_update(name, mtime=time.time(), bytes=sum(self._sizes[name]))
+
+    def append_patch(self, name: str, version: int, ops: List[Dict], blocks: List[Dict]):
+        """Journals a patch; `blocks` is the result of applying it, folded into the file once the journal outgrows it."""
+        line = json.dumps({"version": version, "ops": ops}) + "\n"
+        with open(self._journal_path(name), "a", encoding="utf-8") as f:
+            f.write(line)
+        sizes = self._sizes.setdefault(name, [0, 0])
+        sizes[1] += len(line)
+        if sizes[1] > max(COMPACT_MIN_BYTES, sizes[0]):
+            # File first: replaying the idempotent ops over it is harmless
+            self._write_ui_file(name, json.dumps(blocks))
+            self._write_journal_base(name, version)
+        self._catalog_update(name, mtime=time.time(), bytes=sum(sizes))
+
+    # --- 2. PARAGRAPH CONTEXTS ---
+
+    def load_context(self, name: str) -> Dict[str, Dict]:
+        path = self._context_path(name)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def save_context(self, name: str, paragraphs: Dict[str, Dict], changed: Optional[Set[str]] = None) -> int:
+        """Writes the context atomically (always in full: `changed` is for row-based backends). Returns the bytes written."""
+        data = json.dumps(paragraphs, indent=4)
+        path = self._context_path(name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._catalog_update(name, paragraphs=len(paragraphs))
+        return len(data)
+
+    # --- 3. NOTEBOOK CATALOG ---
+
+    def _catalog_entries(self) -> Dict[str, Dict]:
+        """
+        The catalog, loaded from its snapshot on first use. Notebooks written since the snapshot was taken
+        (lost in a crash) or missing from it are re-read, and deleted ones dropped: one stat per notebook.
+        """
+        with self._catalog_lock:
+            if self._catalog is not None:
+                return self._catalog
+            entries, saved_at = {}, 0.0
+            try:
+                with open(os.path.join(self.context_dir, CATALOG_FILE), "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+                entries, saved_at = snapshot["entries"], snapshot["saved_at"]
+            except Exception:
+                pass
+
+            self._catalog = {}
+            for name in self.list_documents():
+                entry = entries.get(name)
+                paths = [p for p in (self._doc_path(name), self._journal_path(name), self._context_path(name))
+                         if os.path.exists(p)]
+                try:
+                    stale = entry is None or max(os.path.getmtime(p) for p in paths) >= saved_at
+                    if stale:
+                        entry = self._read_entry(name, entry)
+                except (OSError, ValueError):
+                    continue
+                self._catalog[name] = entry
+            self._catalog_dirty = self._catalog != entries
+            return self._catalog
+
+    def _read_entry(self, name: str, old: Optional[Dict]) -> Dict:
+        ui_paths = [p for p in (self._doc_path(name), self._journal_path(name)) if os.path.exists(p)]
+        return {
+            "id": name,
+            "name": notebook_title(name),
+            "mtime": max(os.path.getmtime(p) for p in ui_paths),
+            "bytes": sum(os.path.getsize(p) for p in ui_paths),
+            "paragraphs": len(self.load_context(name)),
+            "compiled_at": (old or {}).get("compiled_at"),
+        }
+
+    def _catalog_update(self, doc_id: str, **fields):
+        with self._catalog_lock:
+            entries = self._catalog_entries()
+            entry = entries.get(doc_id)
+            if entry is None:
+                if not self.exists(doc_id):
+                    return  # A context saved for a notebook that was never stored
+                entry = entries[doc_id] = {"id": doc_id, "name": notebook_title(doc_id), "mtime": time.time(),
+                                         "bytes": 0, "paragraphs": 0, "compiled_at": None}
+            entry.update(fields)
+            self._catalog_dirty = True
+            if time.time() - self._catalog_saved >= CATALOG_FLUSH_S:
+                self._flush_catalog()
+
+    def _flush_catalog(self):
+        """Snapshots the catalog (atomically); saved_at is taken first, so later writes count as unsaved."""
+        with self._catalog_lock:
+            if not self._catalog_dirty:
+                return
+            saved_at = time.time()
+            path = os.path.join(self.context_dir, CATALOG_FILE)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"saved_at": saved_at, "entries": self._catalog}, f)
+            os.replace(tmp_path, path)
+            self._catalog_dirty = False
+            self._catalog_saved = saved_at
+
+    def mark_compiled(self, name: str, when: float):
+        self._catalog_update(name, compiled_at=when)
+
+    def catalog(self, sort: str = "name", descending: bool = False, offset: int = 0,
+                limit: Optional[int] = None) -> Tuple[int, List[Dict]]:
+        """(total, page) of catalog entries ordered by `sort` (one of CATALOG_SORTS), ties broken by id."""
+        if sort not in CATALOG_SORTS:
+            raise ValueError(f"Unknown sort '{sort}'")
+        with self._catalog_lock:
+            entries = list(self._catalog_entries().values())
+        # Never-compiled notebooks (None) sort as oldest
+        entries.sort(key=lambda e: e["id"], reverse=descending)
+        entries.sort(key=lambda e: e[sort] if e[sort] is not None else 0, reverse=descending)
+        end = None if limit is None else offset + limit
+        return len(entries), [dict(e) for e in entries[offset:end]]
+
+    # --- 4. LIFECYCLE ---
+
+    def rename(self, old: str, new: str) -> bool:
+        if self.exists(new):
+            return False
+        for path_of in (self._doc_path, self._journal_path, self._context_path):
+            if os.path.exists(path_of(old)):
+                os.rename(path_of(old), path_of(new))
+        self._sizes.pop(old, None)
+        with self._catalog_lock:
+            entry = self._catalog_entries().pop(old, None)
+            if entry is not None:
+                self._catalog[new] = entry
+                self._catalog_update(new, id=new, name=notebook_title(new))
+        return True
+
+    def delete(self, name: str):
+        for path_of in (self._doc_path, self._journal_path, self._context_path):
+            if os.path.exists(path_of(name)):
+                os.remove(path_of(name))
+        self._sizes.pop(name, None)
+        with self._catalog_lock:
+            if self._catalog_entries().pop(name, None) is not None:
+                self._catalog_dirty = True
+
+    def changed_since(self, since: float) -> Iterator[Tuple[str, str]]:
+        """(id, raw text) of the notebooks written at or after `since`; the text includes journaled patches."""
+        for name in self.list_documents():
+            paths = [p for p in (self._doc_path(name), self._journal_path(name)) if os.path.exists(p)]
+            try:
+                if max(os.path.getmtime(p) for p in paths) < since:
+                    continue
+                text = []
+                for path in paths:
+                    with open(path, "r", encoding="utf-8") as f:
+                        text.append(f.read())
+            except (OSError, ValueError):
+                continue
+            yield name, "\n".join(text)
+
+    def close(self):
+        self._flush_catalog()
+
+# --- SQLITE BACKEND ---
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_updated ON documents (updated_at);
+CREATE TABLE IF NOT EXISTS blocks (
+    doc_id TEXT NOT NULL,
+    block_id TEXT NOT NULL,
+    position REAL NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (doc_id, block_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS blocks_order ON blocks (doc_id, position);
+CREATE TABLE IF NOT EXISTS paragraphs (
+    doc_id TEXT NOT NULL,
+    par_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (doc_id, par_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS paragraphs_order ON paragraphs (doc_id, position);
+CREATE TABLE IF NOT EXISTS catalog (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    paragraphs INTEGER NOT NULL DEFAULT 0,
+    compiled_at REAL
+);
+CREATE INDEX IF NOT EXISTS catalog_name ON catalog (name, id);
+CREATE INDEX IF NOT EXISTS catalog_mtime ON catalog (mtime, id);
+CREATE INDEX IF NOT EXISTS catalog_bytes ON catalog (bytes, id);
+CREATE INDEX IF NOT EXISTS catalog_paragraphs ON catalog (paragraphs, id);
+CREATE INDEX IF NOT EXISTS catalog_compiled ON catalog (compiled_at, id);
+"""
+
+class SQLiteStorage():
+    """
+    Notebooks as rows of one WAL-mode SQLite database: a block per row (ordered by a fractional position,
+    so inserting or moving one block rewrites one row) and a paragraph context per row. Each save is a
+    single transaction touching only the rows that changed. One connection, serialised by a lock.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._backfill_catalog()
+
+    def _backfill_catalog(self):
+        """Adds catalog rows for notebooks stored before the catalog existed."""
+        with self._transaction() as cur:
+            missing = cur.execute(
+                "SELECT id, updated_at FROM documents WHERE id NOT IN (SELECT id FROM catalog)"
+            ).fetchall()
+            for name, updated_at in missing:
+                size = cur.execute(
+                    "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM blocks WHERE doc_id = ?", (name,)
+                ).fetchone()[0]
+                self._index(cur, name, updated_at, size=size)
+                self._count_paragraphs(cur, name)
+
+    def _transaction(self):
+        return Transaction(self._conn, self._lock)
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM documents WHERE id = ?", (name,)).fetchone() is not None
+
+    def list_documents(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM documents ORDER BY id")]
+
+    # --- 1. UI BLOCKS ---
+
+    def load_blocks(self, name: str) -> Tuple[List[Dict], int]:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM documents WHERE id = ?", (name,)).fetchone()
+            bodies = self._conn.execute(
+                "SELECT body FROM blocks WHERE doc_id = ? ORDER BY position", (name,)
+            ).fetchall()
+        return [json.loads(body) for (body,) in bodies], (row[0] if row else 0)
+
+    def _touch(self, cur, name: str, version: int, size: Optional[int] = None, delta: int = 0):
+        now = time.time()
+        cur.execute(
+            "INSERT INTO documents (id, version, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at",
+            (name, version, now),
+        )
+        self._index(cur, name, now, size, delta)
+
+    def _index(self, cur, name: str, mtime: float, size: Optional[int] = None, delta: int = 0):
+        """
+        Refreshes a notebook's catalog row after its blocks changed. Its byte size is set to `size` by full
+        rewrites and moved by `delta` (the rows a patch rewrote), so a patch never sums the whole notebook.
+        """
+        update = "excluded.bytes" if size is not None else "catalog.bytes + excluded.bytes"
+        cur.execute(
+            "INSERT INTO catalog (id, name, mtime, bytes) VALUES (?, ?, ?, ?) "
+            f"ON CONFLICT (id) DO UPDATE SET mtime = excluded.mtime, bytes = {update}",
+            (name, notebook_title(name), mtime, size if size is not None else delta),
+        )
+
+    def _write_all_blocks(self, cur, name: str, blocks: List[Dict]) -> int:
+        """Rewrites every row of the notebook. Returns the bytes of its block bodies."""
+        rows = [(name, b.get("id") or uuid.uuid4().hex, float(i), json.dumps(b)) for i, b in enumerate(blocks)]
+        cur.execute("DELETE FROM blocks WHERE doc_id = ?", (name,))
+        cur.executemany("INSERT OR REPLACE INTO blocks (doc_id, block_id, position, body) VALUES (?, ?, ?, ?)", rows)
+        # A repeated id keeps only its last row
+        return sum(len(body) for body in {row[1]: row[3] for row in rows}.values())
+
+    def save_blocks(self, name: str, blocks: List[Dict], version: int, content: Optional[str] = None):
+        with self._transaction() as cur:
+            size = self._write_all_blocks(cur, name, blocks)
+            self._touch(cur, name, version, size=size)
+
+    def _position(self, cur, name: str, block_id: str) -> Optional[float]:
+        row = cur.execute("SELECT position FROM blocks WHERE doc_id = ? AND block_id = ?", (name, block_id)).fetchone()
+        return row[0] if row else None
+
+    def _body_bytes(self, cur, name: str, block_id: str) -> int:
+        row = cur.execute("SELECT LENGTH(body) FROM blocks WHERE doc_id = ? AND block_id = ?", (name, block_id)).fetchone()
+        return row[0] if row else 0
+
+    def append_patch(self, name: str, version: int, ops: List[Dict], blocks: List[Dict]):
+        """Writes the rows a patch touched; `blocks` is the result of applying it."""
+        index = {b.get("id"): i for i, b in enumerate(blocks)}
+        placed = {op_block_id(op) for op in ops if op["op"] in ("insert", "move")} & index.keys()
+        updated = {op_block_id(op) for op in ops if op["op"] == "update"} & index.keys() - placed
+        deleted = {op_block_id(op) for op in ops if op["op"] == "delete"} - index.keys()
+
+        with self._transaction() as cur:
+            delta = 0  # Change in the notebook's byte size, row by row
+            for block_id in deleted:
+                delta -= self._body_bytes(cur, name, block_id)
+                cur.execute("DELETE FROM blocks WHERE doc_id = ? AND block_id = ?", (name, block_id))
+            for block_id in updated:
+                body = json.dumps(blocks[index[block_id]])
+                delta += len(body) - self._body_bytes(cur, name, block_id)
+                cur.execute("UPDATE blocks SET body = ? WHERE doc_id = ? AND block_id = ?", (body, name, block_id))
+
+            # Each placed block goes halfway between its neighbours (those not themselves being placed later)
+            assigned: Dict[str, float] = {}
+            renumber = False
+            for block_id in sorted(placed, key=index.get):
+                i = index[block_id]
+                before = assigned.get(blocks[i - 1].get("id")) if i > 0 else None
+                if i > 0 and before is None:
+                    before = self._position(cur, name, blocks[i - 1].get("id"))
+                    renumber = renumber or before is None
+                after = None
+                for nxt in blocks[i + 1:]:
+                    if nxt.get("id") not in placed:
+                        after = self._position(cur, name, nxt.get("id"))
+                        renumber = renumber or after is None
+                        break
+                if before is None and after is None:
+                    position = 0.0
+                elif before is None:
+                    position = after - 1.0
+                elif after is None:
+                    position = before + 1.0
+                else:
+                    position = (before + after) / 2
+                    renumber = renumber or after - before < MIN_POSITION_GAP
+                assigned[block_id] = position
+                body = json.dumps(blocks[i])
+                delta += len(body) - self._body_bytes(cur, name, block_id)
+                cur.execute(
+                    "INSERT INTO blocks (doc_id, block_id, position, body) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (doc_id, block_id) DO UPDATE SET position = excluded.position, body = excluded.body",
+                    (name, block_id, position, body),
+                )
+            if renumber:
+                # Positions ran out of precision (or rows went missing): rewrite the document once
+                self._touch(cur, name, version, size=self._write_all_blocks(cur, name, blocks))
+            else:
+                self._touch(cur, name, version, delta=delta)
+
+    # --- 2. PARAGRAPH CONTEXTS ---
+
+    def load_context(self, name: str) -> Dict[str, Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT par_id, body FROM paragraphs WHERE doc_id = ? ORDER BY position", (name,)
+            ).fetchall()
+        return {par_id: json.loads(body) for par_id, body in rows}
+
+    def save_context(self, name: str, paragraphs: Dict[str, Dict], changed: Optional[Set[str]] = None) -> int:
+        """Writes the `changed` paragraphs (all of them, in order, if None) in one transaction. Returns the bytes written."""
+        written = 0
+        with self._transaction() as cur:
+            if changed is None:
+                cur.execute("DELETE FROM paragraphs WHERE doc_id = ?", (name,))
+                rows = [(name, par_id, i, json.dumps(body)) for i, (par_id, body) in enumerate(paragraphs.items())]
+                cur.executemany("INSERT INTO paragraphs (doc_id, par_id, position, body) VALUES (?, ?, ?, ?)", rows)
+                self._count_paragraphs(cur, name)
+                return sum(len(row[3]) for row in rows)
+
+            for par_id in changed:
+                if par_id not in paragraphs:
+                    cur.execute("DELETE FROM paragraphs WHERE doc_id = ? AND par_id = ?", (name, par_id))
+                    continue
+                body = json.dumps(paragraphs[par_id])
+                written += len(body)
+                # New paragraphs go last; existing ones keep their place
+                cur.execute(
+                    "INSERT INTO paragraphs (doc_id, par_id, position, body) VALUES "
+                    "(?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM paragraphs WHERE doc_id = ?), ?) "
+                    "ON CONFLICT (doc_id, par_id) DO UPDATE SET body = excluded.body",
+                    (name, par_id, name, body),
+                )
+            self._count_paragraphs(cur, name)
+        return written
+
+    def _count_paragraphs(self, cur, name: str):
+        cur.execute(
+            "UPDATE catalog SET paragraphs = (SELECT COUNT(*) FROM paragraphs WHERE doc_id = ?) WHERE id = ?",
+            (name, name),
+        )
+
+    # --- 3. NOTEBOOK CATALOG ---
+
+    def mark_compiled(self, name: str, when: float):
+        with self._transaction() as cur:
+            cur.execute("UPDATE catalog SET compiled_at = ? WHERE id = ?", (when, name))
+
+    def catalog(self, sort: str = "name", descending: bool = False, offset: int = 0,
+                limit: Optional[int] = None) -> Tuple[int, List[Dict]]:
+        """(total, page) of catalog rows ordered by `sort` (one of CATALOG_SORTS) through its index."""
+        if sort not in CATALOG_SORTS:
+            raise ValueError(f"Unknown sort '{sort}'")
+        direction = "DESC" if descending else "ASC"
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM catalog").fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT id, name, mtime, bytes, paragraphs, compiled_at FROM catalog "
+                f"ORDER BY {sort} {direction}, id {direction} LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+        columns = ("id", "name", "mtime", "bytes", "paragraphs", "compiled_at")
+        return total, [dict(zip(columns, row)) for row in rows]
+
+    # --- 4. LIFECYCLE ---
+
+    def rename(self, old: str, new: str) -> bool:
+        with self._transaction() as cur:
+            if cur.execute("SELECT 1 FROM documents WHERE id = ?", (new,)).fetchone():
+                return False
+            for table, column in (("documents", "id"), ("blocks", "doc_id"), ("paragraphs", "doc_id")):
+                cur.execute(f"UPDATE {table} SET {column} = ? WHERE {column} = ?", (new, old))
+            cur.execute("UPDATE catalog SET id = ?, name = ? WHERE id = ?", (new, notebook_title(new), old))
+        return True
+
+    def delete(self, name: str):
+        with self._transaction() as cur:
+            for table, column in (("documents", "id"), ("blocks", "doc_id"), ("paragraphs", "doc_id"), ("catalog", "id")):
+                cur.execute(f"DELETE FROM {table} WHERE {column} = ?", (name,))
+
+    def changed_since(self, since: float) -> Iterator[Tuple[str, str]]:
+        with self._lock:
+            names = [row[0] for row in self._conn.execute("SELECT id FROM documents WHERE updated_at >= ?", (since,))]
+        for name in names:
+            with self._lock:
+                bodies = self._conn.execute("SELECT body FROM blocks WHERE doc_id = ?", (name,)).fetchall()
+            yield name, "\n".join(body for (body,) in bodies)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Transaction():
+    """
+    BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error) under the connection lock; yields a cursor.
+    Shared with other SQLite databases of the app (e.g. the search index), opened with isolation_level=None.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Cursor:
+        self.lock.acquire()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        return self.cursor
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.cursor.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+        return False
+
+# --- SETUP & MIGRATION ---
+
+def migrate(source: JSONStorage, target: SQLiteStorage) -> int:
+    """Copies every notebook and its context from the JSON layout into SQLite. Returns the number copied."""
+    count = 0
+    for name in source.list_documents():
+        blocks, version = source.load_blocks(name)
+        target.save_blocks(name, blocks, version)
+        target.save_context(name, source.load_context(name))
+        count += 1
+    return count
+
+
+def open_storage(backend: str, docs_dir: str, context_dir: str, db_path: str):
+    """
+    'json' (the file layout) or 'sqlite'. A fresh SQLite database is filled from the JSON layout once
+    (PRAGMA user_version marks it done); the JSON files are left in place, so switching back is possible.
+    """
+    if backend == "json":
+        return JSONStorage(docs_dir, context_dir)
+    if backend != "sqlite":
+        raise ValueError(f"Unknown storage backend '{backend}'. Use 'json' or 'sqlite'.")
+
+    storage = SQLiteStorage(db_path)
+    with storage._lock:
+        migrated = storage._conn.execute("PRAGMA user_version").fetchone()[0]
+    if not migrated:
+        count = migrate(JSONStorage(docs_dir, context_dir), storage)
+        with storage._lock:
+            storage._conn.execute("PRAGMA user_version = 1")
+        if count:
+            logger.info(f"📦 Migrated {count} notebooks from JSON files into {db_path}")
+    return storage
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy notebooks from the JSON layout into a SQLite database.")
+    parser.add_argument("--docs-dir", default=os.getenv("DOCS_DIR", "./docs"))
+    parser.add_argument("--context-dir", default=os.getenv("CONTEXT_DIR", "./context"))
+    parser.add_argument("--db", default=os.getenv("STORAGE_DB", "./callimachus.db"))
+    args = parser.parse_args()
+
+    target = SQLiteStorage(args.db)
+    print(f"✅ Migrated {migrate(JSONStorage(args.docs_dir, args.context_dir), target)} notebooks into {args.db}")
+    target.close()
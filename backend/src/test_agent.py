@@ -34,7 +34,7 @@ async def run_test():
 
     # Simulate React's initial save to the UI Document
     test_doc._update_ui_document(par_id, "Density is defined as the ratio between volume and mass of an object")
-    print(f"📄 Mocked React UI Document created at {test_doc.doc_file_path}")
+    print(f"📄 Mocked React UI Document created as '{test_doc.doc_name}'")
 
     # 2. Setup Thread Config (Required for MemorySaver to work)
     thread_id = str(uuid.uuid4())
@@ -113,12 +113,15 @@ async def run_test():
     print("💾 VERIFYING JSON PERSISTENCE ON DISK")
     print("="*50)
     
+    # Context saves are write-behind: make sure they hit the disk first
+    DOCUMENT_STORAGE[doc_id].flush()
+
     # We create a brand new Document instance. 
     # If it successfully loads the newly generated text, your JSON logic is perfect.
     disk_verification_doc = Document("test")
     persisted_paragraph = disk_verification_doc.get_paragraph(par_id)
     
-    print(f"\nLoading from: {disk_verification_doc.doc_file_path}")
+    print(f"\nLoading from: {disk_verification_doc.doc_name}")
     
     print("\n--- Persisted Additional Notes (From JSON) ---")
     print(persisted_paragraph.get("additional"))
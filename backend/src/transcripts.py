@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import bisect
+from typing import Any, Dict, Iterable, List, Optional
+
+from paths import TRANSCRIPTS_DIR
+
+# --- TRANSCRIPT LOG CLASS ---
+class TranscriptLog():
+    """
+    Append-only, per-document log of finalised audio segments (one JSON record per line).
+    A record's byte offset in the file is its stable reference: clients keep offsets instead of
+    resending the text, and reads seek straight to them.
+
+    Second-pass (refined) text never rewrites the log: it lives in a sidecar keyed by those same
+    offsets, and reads substitute it, so references handed out during the lecture stay valid.
+    """
+
+    def __init__(self, doc_name: str):
+        self.doc_name = doc_name
+        self.file_path = os.path.join(TRANSCRIPTS_DIR, f"{doc_name}.jsonl")
+        self.refined_path = os.path.join(TRANSCRIPTS_DIR, f"{doc_name}.refined.jsonl")
+
+    # --- 1. WRITE PATH ---
+
+    def append(self, text: str, start: float, end: float, speech_prob: Optional[float] = None, session_id: str = "") -> Dict[str, Any]:
+        """Appends one segment (start/end are wall-clock epoch seconds) and returns the stored record."""
+        record = {
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "text": text,
+            "speech_prob": round(speech_prob, 3) if speech_prob is not None else None,
+            "session": session_id,
+            "logged_at": round(time.time(), 3),
+        }
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+        with open(self.file_path, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(line)
+
+        record["offset"] = offset
+        record["end_offset"] = offset + len(line)
+        return record
+
+    def apply_refinement(self, session_id: str, started_at: float, segments: List[Dict[str, Any]], model: str = "") -> int:
+        """
+        Replaces the draft text of one session with second-pass segments (start/end in seconds from
+        the session start). Each segment goes to the draft record containing its midpoint, or the
+        nearest one; drafts that receive nothing keep their text. Returns the number of records refined.
+        """
+        drafts = [r for r in self._iter_from(0) if r.get("session") == session_id]
+        if not drafts or not segments:
+            return 0
+
+        starts = [r["start"] for r in drafts]
+        assigned: Dict[int, List[str]] = {}
+        for segment in sorted(segments, key=lambda s: s["start"]):
+            mid = started_at + (segment["start"] + segment["end"]) / 2
+            i = bisect.bisect_right(starts, mid) - 1
+            candidates = [drafts[j] for j in (i, i + 1) if 0 <= j < len(drafts)]
+            best = min(candidates, key=lambda r: 0.0 if r["start"] <= mid <= r["end"] else min(abs(mid - r["start"]), abs(mid - r["end"])))
+            assigned.setdefault(best["offset"], []).append(segment["text"].strip())
+
+        with open(self.refined_path, "a", encoding="utf-8") as f:
+            for offset, texts in assigned.items():
+                f.write(json.dumps({"ref": offset, "text": " ".join(texts), "model": model}, ensure_ascii=False) + "\n")
+        return len(assigned)
+
+    # --- 2. READ PATH ---
+
+    def _load_refinements(self) -> Dict[int, Dict[str, Any]]:
+        refined = {}
+        if not os.path.exists(self.refined_path):
+            return refined
+        with open(self.refined_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except Exception:
+                    continue
+                refined[entry["ref"]] = entry  # A later pass wins
+        return refined
+
+    @staticmethod
+    def _overlay(records: List[Dict[str, Any]], refined: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        for record in records:
+            entry = refined.get(record["offset"])
+            if entry:
+                record["draft"] = record["text"]
+                record["text"] = entry["text"]
+                record["refined"] = entry.get("model") or True
+        return records
+
+    def _iter_from(self, offset: int = 0) -> Iterable[Dict[str, Any]]:
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, "rb") as f:
+            f.seek(offset)
+            while True:
+                pos = f.tell()
+                line = f.readline()
+                if not line:
+                    return
+                try:
+                    record = json.loads(line)
+                except Exception:
+                    continue  # Torn tail from a crash mid-write
+                record["offset"] = pos
+                record["end_offset"] = pos + len(line)
+                yield record
+
+    def read_refs(self, offsets: List[int]) -> List[Dict[str, Any]]:
+        """Reads the records starting at the given byte offsets, in the order given."""
+        records = []
+        if not offsets or not os.path.exists(self.file_path):
+            return records
+        with open(self.file_path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                try:
+                    record = json.loads(f.readline())
+                except Exception:
+                    continue  # Stale or invalid reference
+                record["offset"] = offset
+                records.append(record)
+        return self._overlay(records, self._load_refinements())
+
+    def read_range(self, from_offset: Optional[int] = None, to_offset: Optional[int] = None,
+                   start: Optional[float] = None, end: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Records in a byte-offset range [from_offset, to_offset) and/or overlapping a time range [start, end]."""
+        records = []
+        for record in self._iter_from(from_offset or 0):
+            if to_offset is not None and record["offset"] >= to_offset:
+                break
+            if start is not None and record["end"] < start:
+                continue
+            if end is not None and record["start"] > end:
+                continue  # Concurrent sessions may interleave slightly, so keep scanning
+            records.append(record)
+        return self._overlay(records, self._load_refinements())
+
+    @staticmethod
+    def join(records: List[Dict[str, Any]]) -> str:
+        return " ".join(r.get("text", "").strip() for r in records).strip()
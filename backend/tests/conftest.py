@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC_DIR)
+
+# document.py opens its storage and search index at import time: point everything at a scratch directory
+SCRATCH_DIR = tempfile.mkdtemp(prefix="callimachus-tests-")
+for var, name in (
+    ("DOCS_DIR", "docs"),
+    ("CONTEXT_DIR", "context"),
+    ("TRANSCRIPTS_DIR", "transcripts"),
+    ("RECORDINGS_DIR", "recordings"),
+    ("STORAGE_DB", "callimachus.db"),
+    ("SEARCH_DB", "search.db"),
+):
+    os.environ[var] = os.path.join(SCRATCH_DIR, name)
+os.environ["STORAGE_BACKEND"] = "json"
@@ -0,0 +1,58 @@
+import asyncio
+
+from audio_pipeline.backpressure import evict_oldest, put_droppable, put_keeping
+
+
+def is_draft(msg):
+    return "partial" in msg
+
+
+def drain(queue):
+    return [queue.get_nowait() for _ in range(queue.qsize())]
+
+# --- OUTGOING MESSAGES ---
+
+def test_evict_oldest_keeps_the_order_of_the_rest():
+    async def run():
+        queue = asyncio.Queue()
+        for msg in ({"text": "a"}, {"partial": "x"}, {"text": "b"}, {"partial": "y"}):
+            queue.put_nowait(msg)
+        assert evict_oldest(queue, is_draft) == {"partial": "x"}
+        return drain(queue)
+
+    assert asyncio.run(run()) == [{"text": "a"}, {"text": "b"}, {"partial": "y"}]
+
+
+def test_drafts_never_evict_final_text():
+    async def run():
+        queue = asyncio.Queue(maxsize=2)
+        queue.put_nowait({"text": "a"})
+        queue.put_nowait({"partial": "x"})
+        assert put_droppable(queue, {"partial": "y"}, is_draft) == {"partial": "x"}
+        assert drain(queue) == [{"text": "a"}, {"partial": "y"}]
+
+        # A queue of final text: the new draft is the one dropped
+        queue.put_nowait({"text": "a"})
+        queue.put_nowait({"text": "b"})
+        assert put_droppable(queue, {"partial": "z"}, is_draft) == {"partial": "z"}
+        return drain(queue)
+
+    assert asyncio.run(run()) == [{"text": "a"}, {"text": "b"}]
+
+
+def test_final_text_waits_for_room_instead_of_being_dropped():
+    async def run():
+        queue = asyncio.Queue(maxsize=2)
+        queue.put_nowait({"partial": "x"})
+        queue.put_nowait({"text": "a"})
+        assert await put_keeping(queue, {"text": "b"}, is_draft) == {"partial": "x"}
+
+        # Full of final text: the put completes once the consumer takes one
+        put = asyncio.create_task(put_keeping(queue, {"text": "c"}, is_draft))
+        await asyncio.sleep(0)
+        assert not put.done()
+        received = [queue.get_nowait()]
+        assert await put is None
+        return received + drain(queue)
+
+    assert asyncio.run(run()) == [{"text": "a"}, {"text": "b"}, {"text": "c"}]
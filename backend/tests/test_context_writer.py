@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from document import ContextWriter
+
+
+class FakeDocument():
+    def __init__(self, name="nb", fail=False):
+        self.doc_name = name
+        self.deleted = False
+        self.fail = fail
+        self.writes = 0
+
+    def _write_context(self) -> int:
+        if self.fail:
+            raise OSError("disk full")
+        self.writes += 1
+        return 100
+
+
+def wait_for(condition, timeout_s=2.0):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("timed out")
+        time.sleep(0.01)
+
+
+def test_saves_within_the_delay_are_coalesced():
+    writer = ContextWriter(delay_s=0.05)
+    doc = FakeDocument()
+    for _ in range(5):
+        writer.mark(doc)
+    wait_for(lambda: writer.stats()["pending"] == 0 and doc.writes)
+    time.sleep(0.1)
+
+    assert doc.writes == 1
+    stats = writer.stats()
+    assert (stats["requested"], stats["written"], stats["coalesced"], stats["bytes_written"]) == (5, 1, 4, 100)
+
+
+def test_documents_are_written_separately():
+    writer = ContextWriter(delay_s=0.05)
+    first, second = FakeDocument("first"), FakeDocument("second")
+    writer.mark(first)
+    writer.mark(second)
+    wait_for(lambda: first.writes and second.writes)
+    assert writer.stats()["written"] == 2
+
+
+def test_flush_writes_right_away():
+    writer = ContextWriter(delay_s=60)
+    doc = FakeDocument()
+    writer.mark(doc)
+    writer.flush(doc)
+    assert doc.writes == 1
+    writer.flush(doc)  # Nothing pending any more
+    assert doc.writes == 1
+
+
+def test_flush_all_writes_every_pending_document():
+    writer = ContextWriter(delay_s=60)
+    docs = [FakeDocument(f"nb{i}") for i in range(3)]
+    for doc in docs:
+        writer.mark(doc)
+    writer.flush_all()
+    assert [doc.writes for doc in docs] == [1, 1, 1]
+
+
+def test_discard_drops_pending_saves_of_every_instance():
+    writer = ContextWriter(delay_s=60)
+    doc, other_instance, unrelated = FakeDocument("nb"), FakeDocument("nb"), FakeDocument("kept")
+    for d in (doc, other_instance, unrelated):
+        writer.mark(d)
+    writer.discard("nb")
+    writer.flush_all()
+    assert (doc.writes, other_instance.writes, unrelated.writes) == (0, 0, 1)
+
+
+def test_deleted_documents_are_not_marked():
+    writer = ContextWriter(delay_s=60)
+    doc = FakeDocument()
+    doc.deleted = True
+    writer.mark(doc)
+    assert writer.stats()["pending"] == 0
+
+
+def test_failed_writes_are_logged(caplog):
+    writer = ContextWriter(delay_s=60)
+    doc = FakeDocument(fail=True)
+    writer.mark(doc)
+    with caplog.at_level("ERROR", logger="CallimacusAPI"):
+        writer.flush(doc)
+    assert "Error saving context for nb" in caplog.text
+    assert writer.stats()["written"] == 0
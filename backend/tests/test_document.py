@@ -0,0 +1,204 @@
+import json
+import uuid
+import random
+
+import pytest
+
+from document import STORAGE, Document
+
+
+def heading(block_id, text):
+    return {"id": block_id, "type": "heading", "content": [{"type": "text", "text": text}]}
+
+
+def paragraph(block_id, text):
+    return {"id": block_id, "type": "paragraph", "content": [{"type": "text", "text": text}]}
+
+
+def save(doc, blocks):
+    doc.save_ui_document(json.dumps(blocks))
+
+
+@pytest.fixture
+def doc():
+    doc = Document(f"test_{uuid.uuid4().hex[:8]}")
+    yield doc
+    doc.delete()
+
+# --- SYNC FROM THE UI ---
+
+def test_sync_splits_the_ui_into_sections(doc):
+    save(doc, [paragraph("p0", "intro"), heading("h1", "One"), paragraph("p1", "a"), paragraph("p2", "b"),
+               heading("h2", "Two")])
+    doc.sync_context_from_ui()
+
+    assert list(doc.paragraphs) == ["doc-start", "h1", "h2"]
+    assert doc.paragraphs["doc-start"]["notes"] == "intro"
+    assert doc.paragraphs["h1"]["heading"] == "One"
+    assert doc.paragraphs["h1"]["notes"] == "a\n\nb"
+    assert doc.paragraphs["h2"]["notes"] == ""
+
+
+def test_sync_keeps_sources_of_edited_sections(doc):
+    save(doc, [heading("h1", "One"), paragraph("p1", "a")])
+    doc.sync_context_from_ui()
+    doc.update_paragraph_metadata("h1", "lecture audio", "slide text")
+
+    save(doc, [heading("h1", "One"), paragraph("p1", "a, edited")])
+    doc.sync_context_from_ui()
+    assert doc.paragraphs["h1"]["notes"] == "a, edited"
+    assert doc.paragraphs["h1"]["audio"] == "lecture audio"
+    assert doc.paragraphs["h1"]["ocr"] == "slide text"
+
+
+def test_deleting_a_heading_merges_its_text_upward(doc):
+    save(doc, [heading("h1", "One"), paragraph("p1", "a"), heading("h2", "Two"), paragraph("p2", "b")])
+    doc.sync_context_from_ui()
+    doc.update_paragraph_metadata("h2", "gone with its heading", "")
+
+    save(doc, [heading("h1", "One"), paragraph("p1", "a"), paragraph("p2", "b")])
+    doc.sync_context_from_ui()
+    assert list(doc.paragraphs) == ["doc-start", "h1"]
+    assert doc.paragraphs["h1"]["notes"] == "a\n\nb"
+
+
+def test_sync_without_ui_changes_stores_nothing(doc):
+    save(doc, [heading("h1", "One"), paragraph("p1", "a")])
+    doc.sync_context_from_ui()
+    version = doc.context_version
+
+    doc.sync_context_from_ui()
+    save(doc, [heading("h1", "One"), paragraph("p1", "a")])  # A new version with the same text
+    doc.sync_context_from_ui()
+    assert doc.context_version == version
+
+
+def test_sync_only_rewrites_changed_sections(doc):
+    save(doc, [heading("h1", "One"), paragraph("p1", "a"), heading("h2", "Two"), paragraph("p2", "b")])
+    doc.sync_context_from_ui()
+    revs = {par_id: doc.paragraph_rev(par_id) for par_id in doc.paragraphs}
+
+    doc.apply_patch(doc.version, [{"op": "update", "block": paragraph("p2", "b, edited")}])
+    doc.sync_context_from_ui()
+    assert doc.paragraph_rev("h1") == revs["h1"]
+    assert doc.paragraph_rev("h2") > revs["h2"]
+
+
+def test_sync_follows_reordered_sections(doc):
+    save(doc, [heading("h1", "One"), paragraph("p1", "a"), heading("h2", "Two"), paragraph("p2", "b")])
+    doc.sync_context_from_ui()
+
+    save(doc, [heading("h2", "Two"), paragraph("p2", "b"), heading("h1", "One"), paragraph("p1", "a")])
+    doc.sync_context_from_ui()
+    assert list(doc.paragraphs) == ["doc-start", "h2", "h1"]
+    doc.flush()
+    assert list(STORAGE.load_context(doc.doc_name)) == ["doc-start", "h2", "h1"]
+
+
+def test_a_patch_reparses_only_its_sections(doc, monkeypatch):
+    blocks = []
+    for n in range(50):
+        blocks += [heading(f"h{n}", f"Section {n}"), paragraph(f"p{n}", f"text {n}")]
+    save(doc, blocks)
+    doc.sync_context_from_ui()
+
+    calls = []
+    block_text = Document._block_text
+    monkeypatch.setattr(Document, "_block_text", staticmethod(lambda block: calls.append(block["id"]) or block_text(block)))
+    doc.apply_patch(doc.version, [{"op": "update", "block": paragraph("p7", "text 7, edited")}])
+    doc.sync_context_from_ui()
+    assert doc.paragraphs["h7"]["notes"] == "text 7, edited"
+    assert set(calls) <= {"h6", "p6", "h7", "p7"}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_patched_sections_match_a_full_parse(doc, seed):
+    rng = random.Random(seed)
+    save(doc, [heading("h0", "Zero"), paragraph("p0", "a")])
+    doc.sync_context_from_ui()
+
+    for step in range(60):
+        blocks = json.loads(doc.get_ui_document())
+        ids = [b["id"] for b in blocks]
+        kind = rng.choice(["insert", "insert", "update", "delete", "move"])
+        new_id = f"b{step}"
+        block = heading(new_id, f"Heading {step}") if rng.random() < 0.3 else paragraph(new_id, f"text {step}")
+        if kind == "insert" or not ids:
+            op = {"op": "insert", "block": block, "after": rng.choice(ids + [None])}
+        elif kind == "update":
+            # Sometimes turns a paragraph into a heading or back
+            target = rng.choice(ids)
+            maker = heading if rng.random() < 0.3 else paragraph
+            op = {"op": "update", "block": maker(target, f"edit {step}")}
+        elif kind == "delete":
+            op = {"op": "delete", "id": rng.choice(ids)}
+        else:
+            target = rng.choice(ids)
+            op = {"op": "move", "id": target, "after": rng.choice([i for i in ids if i != target] + [None])}
+        doc.apply_patch(doc.version, [op])
+        if rng.random() < 0.5:
+            doc.sync_context_from_ui()
+
+    doc.sync_context_from_ui()
+    expected = Document.parse_sections(json.loads(doc.get_ui_document()))
+    assert list(doc.paragraphs) == list(expected)
+    assert {k: (v["heading"], v["notes"]) for k, v in doc.paragraphs.items()} == expected
+
+
+def test_add_image_is_saved_with_the_context(doc):
+    save(doc, [heading("h1", "One")])
+    doc.sync_context_from_ui()
+    assert doc.add_image("h1", "A diagram", "img_abc.png") == {"success": True}
+
+    doc.flush()
+    stored = STORAGE.load_context(doc.doc_name)
+    assert stored["h1"]["image"] == {"description": "A diagram", "url": "img_abc.png"}
+
+# --- CONCURRENT AGENT WRITES ---
+
+def test_compiled_output_is_rejected_if_the_paragraph_changed(doc):
+    save(doc, [heading("h1", "One"), paragraph("p1", "a")])
+    doc.sync_context_from_ui()
+    rev = doc.get_paragraph("h1")["rev"]
+
+    doc.update_paragraph_metadata("h1", "new audio", "")  # The editor got there first
+    result = doc.replace_paragraph("h1", "compiled", expected_rev=rev)
+    assert result["success"] is False
+    assert doc.paragraphs["h1"]["notes"] == "a"
+    assert doc.take_conflict("h1") is True
+    assert doc.take_conflict("h1") is False  # Reported once
+
+
+def test_compiled_output_is_kept_with_a_current_rev(doc):
+    save(doc, [heading("h1", "One"), paragraph("p1", "a")])
+    doc.sync_context_from_ui()
+    rev = doc.get_paragraph("h1")["rev"]
+
+    assert doc.replace_paragraph("h1", "compiled", expected_rev=rev)["success"] is True
+    assert doc.take_conflict("h1") is False
+
+
+def test_sync_keeps_agent_notes_until_the_ui_changes(doc):
+    save(doc, [heading("h1", "One"), paragraph("p1", "a")])
+    doc.sync_context_from_ui()
+    doc.replace_paragraph("h1", "compiled")
+
+    # The editor has not inserted the output yet: a sync must not undo it
+    save(doc, [heading("h1", "One"), paragraph("p1", "a")])
+    doc.sync_context_from_ui()
+    assert doc.paragraphs["h1"]["notes"] == "compiled"
+
+    save(doc, [heading("h1", "One"), paragraph("p1", "compiled, then edited")])
+    doc.sync_context_from_ui()
+    assert doc.paragraphs["h1"]["notes"] == "compiled, then edited"
+
+
+def test_locks_of_deleted_paragraphs_are_dropped(doc):
+    save(doc, [heading("h1", "One"), heading("h2", "Two")])
+    doc.sync_context_from_ui()
+    doc.paragraph_lock("h1")
+    doc.paragraph_lock("h2")
+
+    save(doc, [heading("h1", "One")])
+    doc.sync_context_from_ui()
+    assert list(doc._par_locks) == ["h1"]
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from document import STORAGE, Document, DocumentCache
+
+
+@pytest.fixture
+def names():
+    created = []
+
+    def make(count):
+        created.extend(f"cache_{uuid.uuid4().hex[:8]}" for _ in range(count))
+        return created[-count:]
+
+    yield make
+    for name in created:
+        Document(name).delete()
+
+
+def fill(cache, names):
+    for name in names:
+        cache.open(name).save_ui_document("[]")
+
+
+def test_least_recently_used_documents_are_evicted(names):
+    cache = DocumentCache(max_entries=2)
+    a, b, c = names(3)
+    fill(cache, [a, b])
+    cache.get(a)  # b is now the least recently used
+    fill(cache, [c])
+
+    assert a in cache and c in cache and b not in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_eviction_flushes_the_pending_context(names):
+    cache = DocumentCache(max_entries=1)
+    a, b = names(2)
+    fill(cache, [a])
+    cache.get(a).update_paragraph_metadata("h1", "audio", "ocr")
+    fill(cache, [b])
+
+    assert a not in cache
+    assert STORAGE.load_context(a)["h1"]["audio"] == "audio"
+
+
+def test_byte_budget(names):
+    cache = DocumentCache(max_entries=10, max_bytes=1000)
+    a, b = names(2)
+    for name in (a, b):
+        # Like a request handler: the budget is enforced once the instance is released
+        with cache.pinned(name) as doc:
+            doc.save_ui_document(json.dumps([{"id": "p", "type": "paragraph", "text": "x" * 600}]))
+    assert list(cache._docs) == [b]
+
+
+def test_pinned_documents_are_not_evicted(names):
+    cache = DocumentCache(max_entries=1)
+    a, b = names(2)
+    with cache.pinned(a) as doc:
+        doc.save_ui_document("[]")
+        fill(cache, [b])
+        assert a in cache  # Still cached: its version and agent writes survive
+
+    # Unpinned: the cache shrinks back to its limit
+    assert a not in cache and len(cache) == 1
+
+
+def test_documents_with_an_agent_run_are_not_evicted(names):
+    cache = DocumentCache(max_entries=1)
+    a, b = names(2)
+    fill(cache, [a])
+    doc = cache.get(a)
+
+    async def run():
+        async with doc.paragraph_lock("h1"):
+            fill(cache, [b])
+            assert a in cache
+
+    asyncio.run(run())
+    cache.evict()
+    assert a not in cache
+
+
+def test_missing_documents_are_not_created_by_lookups(names):
+    cache = DocumentCache()
+    (missing,) = names(1)
+    assert cache.get(missing) is None
+    with cache.pinned(missing, create=False) as doc:
+        assert doc is None
+    assert missing not in cache
+    assert not STORAGE.exists(missing)
+
+
+def test_evicted_documents_reload_from_storage(names):
+    cache = DocumentCache(max_entries=1)
+    a, b = names(2)
+    blocks = [{"id": "h1", "type": "heading", "content": [{"type": "text", "text": "One"}]}]
+    cache.open(a).save_ui_document(json.dumps(blocks))
+    fill(cache, [b])
+
+    reloaded = cache.get(a)
+    assert json.loads(reloaded.get_ui_document()) == blocks
+    assert reloaded.version == 1
+    assert cache.stats()["misses"] >= 1
+
+
+def test_a_deleted_document_is_not_written_back(names):
+    cache = DocumentCache()
+    (a,) = names(1)
+    with cache.pinned(a) as doc:
+        doc.save_ui_document("[]")
+        doc.update_paragraph_metadata("h1", "pending", "")
+        cache.pop(a)
+        doc.delete()
+        # An agent run still holding the instance keeps writing
+        doc.update_paragraph_metadata("h1", "late", "")
+        doc.flush()
+    assert not STORAGE.exists(a)
+    assert STORAGE.load_context(a) == {}
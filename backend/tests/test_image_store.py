@@ -0,0 +1,124 @@
+import pytest
+
+from image_store import ImageStore, store_image, variant_dir
+
+
+@pytest.fixture
+def store(tmp_path):
+    images = tmp_path / "imgs"
+    images.mkdir()
+    return ImageStore(images, tmp_path / "image_refs.json")
+
+# --- CONTENT ADDRESSING ---
+
+def test_identical_bytes_are_stored_once(tmp_path):
+    first, written = store_image(tmp_path, b"logo", "PNG")
+    again, rewritten = store_image(tmp_path, b"logo", "png", prefix="temp")
+    other, _ = store_image(tmp_path, b"photo", "png")
+
+    assert first == again and written and not rewritten
+    assert first.startswith("temp_") and first.endswith(".png")
+    assert other != first
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted([first, other])
+
+
+def test_put_counts_writes_and_duplicates(store):
+    store.put(b"logo", "png")
+    store.put(b"logo", "png")
+    assert (store.written, store.deduplicated) == (1, 1)
+
+# --- REFERENCES ---
+
+def test_a_file_is_counted_once_per_holder(store):
+    name = store.put(b"logo", "png")
+    store.add_refs("pdf:deck", [name])
+    store.add_refs("pdf:deck", [name])
+    store.add_refs("doc:notes", [name])
+    assert store.refcount(name) == 2
+
+
+def test_temp_files_go_with_their_last_holder(store):
+    name = store.put(b"logo", "png")
+    store.add_refs("pdf:a", [name])
+    store.add_refs("pdf:b", [name])
+
+    assert store.drop("pdf:a") == 0
+    assert (store.images_dir / name).exists()
+    assert store.drop("pdf:b") == 1
+    assert not (store.images_dir / name).exists()
+    assert store.refcount(name) == 0
+
+
+def test_set_refs_replaces_a_holders_set(store):
+    kept, dropped = store.put(b"kept", "png"), store.put(b"dropped", "png")
+    store.set_refs("pdf:deck", [kept, dropped])
+    assert store.set_refs("pdf:deck", [kept]) == 1
+    assert store.holders["pdf:deck"] == {kept}
+    assert not (store.images_dir / dropped).exists()
+
+
+def test_rename_holder_keeps_the_counts(store):
+    name = store.put(b"logo", "png", prefix="img")
+    store.set_refs("doc:old", [name])
+    store.rename_holder("doc:old", "doc:new")
+    assert store.holders == {"doc:new": {name}}
+    assert store.refcount(name) == 1
+
+# --- SWEEP ---
+
+def test_unreferenced_img_files_wait_for_the_sweep(store):
+    name = store.put(b"figure", "png", prefix="img")
+    store.set_refs("doc:notes", [name])
+    assert store.drop("doc:notes") == 0
+    assert name in store.candidates
+
+    deleted = []
+    store.on_delete = deleted.append
+    assert store.sweep(3600) == 0  # Still in its grace period: an undo may re-insert it
+    assert store.sweep(0) == 1
+    assert deleted == [name]
+    assert not (store.images_dir / name).exists()
+    assert store.stats()["swept"] == 1
+
+
+def test_a_candidate_referenced_again_survives(store):
+    name = store.put(b"figure", "png", prefix="img")
+    store.add_refs("doc:notes", [name])
+    assert name not in store.candidates
+    assert store.sweep(0) == 0
+    assert (store.images_dir / name).exists()
+
+
+def test_sweep_drops_cached_variants(store):
+    name = store.put(b"figure", "png", prefix="img")
+    variants = variant_dir(store.images_dir, name)
+    variants.mkdir(parents=True)
+    (variants / "w320.webp").write_bytes(b"small")
+
+    store.sweep(0)
+    assert not variants.exists()
+
+
+def test_adopt_orphans_finds_untracked_files(store):
+    held, _ = store_image(store.images_dir, b"held", "png", prefix="img")
+    orphan, _ = store_image(store.images_dir, b"orphan", "png", prefix="img")
+    (store.images_dir / "notes.txt").write_text("not an image")
+    store.add_refs("doc:notes", [held])
+
+    assert store.adopt_orphans() == 1
+    assert set(store.candidates) == {orphan}
+    assert store.adopt_orphans() == 0
+
+# --- PERSISTENCE ---
+
+def test_the_index_survives_a_restart(store):
+    held = store.put(b"held", "png", prefix="img")
+    loose = store.put(b"loose", "png", prefix="img")
+    store.set_refs("doc:notes", [held])
+    store.flush()
+
+    reopened = ImageStore(store.images_dir, store.index_path)
+    assert reopened.holders == {"doc:notes": {held}}
+    assert reopened.refcount(held) == 1
+    assert set(reopened.candidates) == {loose}
+    assert reopened.sweep(0) == 1
@@ -0,0 +1,69 @@
+import time
+import threading
+
+import numpy as np
+
+from audio_pipeline import offline
+from audio_pipeline.models import WhisperConfig
+from audio_pipeline.offline import OfflineConfig, OfflineJob, OfflineTranscriber, split_at_silence
+from audio_pipeline.vad import SAMPLE_RATE
+
+
+def transcriber(tmp_path, **config):
+    return OfflineTranscriber(tmp_path, WhisperConfig(model="base"), OfflineConfig(workers=1, **config))
+
+# --- SILENCE SPLITTING ---
+
+def test_chunks_are_cut_in_the_pauses():
+    rng = np.random.default_rng(0)
+    speech = (rng.standard_normal(SAMPLE_RATE * 50) * 3000).astype(np.int16)
+    pause = np.zeros(SAMPLE_RATE, dtype=np.int16)
+    pcm = np.concatenate([speech, pause, speech, pause, speech])
+
+    ranges = split_at_silence(pcm, OfflineConfig(target_chunk_s=50, search_window_s=10))
+    assert ranges[0][0] == 0 and ranges[-1][1] == pcm.size
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    for _, end in ranges[:-1]:
+        assert np.all(pcm[end - 1600:end + 1600] == 0)
+
+# --- MODEL POOL ---
+
+def test_follow_does_not_wait_for_a_model_load(tmp_path, monkeypatch):
+    loading, release, loaded = threading.Event(), threading.Event(), []
+
+    def slow_load(config, num_workers=1):
+        loaded.append(config.model)
+        if len(loaded) == 1:
+            loading.set()
+            release.wait(5)
+        return f"model:{config.model}"
+
+    monkeypatch.setattr(offline, "load_whisper", slow_load)
+    t = transcriber(tmp_path)
+    result = {}
+    first_job = threading.Thread(target=lambda: result.update(pool=t._get_pool()))
+    first_job.start()
+    loading.wait(5)
+
+    start = time.monotonic()
+    t.follow(WhisperConfig(model="small"))
+    assert time.monotonic() - start < 1
+    release.set()
+    first_job.join(5)
+
+    # The load that the swap overtook is replaced by one of the new model
+    assert loaded == ["base", "small"]
+    assert result["pool"][0] == "model:small"
+    t.shutdown()
+
+# --- JOBS ---
+
+def test_finished_jobs_are_pruned(tmp_path):
+    t = transcriber(tmp_path, job_ttl_s=60, max_jobs=2)
+    now = time.time()
+    for job_id, finished_at in (("old", now - 120), ("a", now - 30), ("b", now - 20), ("c", now - 10), ("running", None)):
+        t.jobs[job_id] = OfflineJob(id=job_id, filename="x.wav", finished_at=finished_at)
+
+    t._prune_jobs()
+    # Past their TTL, then the oldest finished ones until at most max_jobs remain (running ones included)
+    assert sorted(t.jobs) == ["c", "running"]
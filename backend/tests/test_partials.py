@@ -0,0 +1,56 @@
+from audio_pipeline.partials import LocalAgreement, StreamingConfig
+
+
+def test_first_hypothesis_is_all_tail():
+    agreement = LocalAgreement()
+    assert agreement.update("the cat") == ("", "the cat")
+
+
+def test_words_two_hypotheses_agree_on_become_stable():
+    agreement = LocalAgreement()
+    agreement.update("the cat")
+    assert agreement.update("the cat sat") == ("the cat", "sat")
+    assert agreement.update("the cat sat on") == ("the cat sat", "on")
+
+
+def test_agreement_ignores_case_and_punctuation():
+    agreement = LocalAgreement()
+    agreement.update("The cat,")
+    assert agreement.update("the Cat sat") == ("the Cat", "sat")  # Spelled as in the newest hypothesis
+
+
+def test_stable_words_are_never_retracted():
+    agreement = LocalAgreement()
+    agreement.update("the cat sat")
+    agreement.update("the cat sat on")
+    # The decoder now hears "mat" where it heard "cat": the stable prefix stands
+    stable, tail = agreement.update("the mat sat on the")
+    assert stable.startswith("the cat sat")
+
+
+def test_tail_after_an_inserted_word():
+    agreement = LocalAgreement()
+    agreement.update("the cat sat")
+    agreement.update("the cat sat on")
+    assert agreement.update("the big cat sat on the") == ("the cat sat", "on the")
+
+
+def test_tail_after_a_replaced_word():
+    agreement = LocalAgreement()
+    agreement.update("the cat sat")
+    agreement.update("the cat sat on")
+    assert agreement.update("the cat sit on the mat") == ("the cat sat", "on the mat")
+
+
+def test_reset_starts_a_new_utterance():
+    agreement = LocalAgreement()
+    agreement.update("the cat")
+    agreement.update("the cat sat")
+    agreement.reset()
+    assert agreement.update("a dog") == ("", "a dog")
+
+
+def test_streaming_config_ignores_unknown_keys():
+    config = StreamingConfig.from_dict({"enabled": True, "beam_size": 3})
+    assert config.enabled is True
+    assert not hasattr(config, "beam_size")
@@ -0,0 +1,59 @@
+import io
+
+import fitz
+import pytest
+
+from image_store import ImageStore
+from pdf_extraction import PDFCache, PDFSession, PDFSessionClosed
+
+
+def deck(pages):
+    pdf = fitz.open()
+    for n in range(pages):
+        pdf.new_page().insert_text((72, 72), f"Slide {n + 1}")
+    data = pdf.tobytes()
+    pdf.close()
+    return io.BytesIO(data)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    images = tmp_path / "imgs"
+    images.mkdir()
+    return PDFCache(tmp_path / "pdf_cache", ImageStore(images, tmp_path / "image_refs.json"))
+
+
+def test_pages_are_extracted_on_demand(cache):
+    session = PDFSession.from_upload(deck(3), cache)
+    assert session.total_pages == 3
+    assert "Slide 2" in session.page(2)
+    assert session.order_from(2) == [2, 3, 1]
+    with pytest.raises(IndexError):
+        session.page(4)
+    session.close()
+
+
+def test_a_closed_session_refuses_new_pages(cache):
+    session = PDFSession.from_upload(deck(3), cache)
+    first = session.page(1)
+    assert cache.refs[session.key] == 1
+
+    session.close()
+    session.close()  # Closing twice releases the entry once
+    assert cache.refs.get(session.key, 0) == 0
+    assert session.page(1) == first  # Already extracted: served from memory
+    with pytest.raises(PDFSessionClosed):
+        session.page(2)
+    session.record(2, "late worker result", [])
+    assert 2 not in session.pages
+
+
+def test_in_use_marks_the_session_busy(cache):
+    session = PDFSession.from_upload(deck(1), cache)
+    with session.in_use():
+        with session.in_use():
+            assert session.users == 2
+        assert session.users == 1
+    assert session.users == 0
+    assert session.idle_s() < 1
+    session.close()
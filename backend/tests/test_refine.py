@@ -0,0 +1,105 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+from audio_pipeline import refine
+from audio_pipeline.refine import RefineConfig, RefinementWorker
+
+
+@pytest.fixture
+def recordings(tmp_path, monkeypatch):
+    monkeypatch.setattr(refine, "RECORDINGS_DIR", str(tmp_path))
+    return tmp_path
+
+
+def record(root, doc_id, name, size=10, age_days=0.0):
+    path = root / doc_id / f"{name}{refine.RECORDING_SUFFIX}"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\0" * size)
+    mtime = time.time() - age_days * 86400
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def worker(**config):
+    return RefinementWorker(RefineConfig(**config), is_busy=lambda: False)
+
+# --- STARTUP ---
+
+def test_a_missing_model_disables_refinement(recordings, monkeypatch):
+    def missing(size):
+        raise FileNotFoundError(f"'{size}' not cached")
+
+    monkeypatch.setattr(refine, "resolve_snapshot", missing)
+    w = worker(model="small")
+    w.start()  # No event loop needed: it returns before scheduling anything
+    assert not w.config.enabled
+    assert w._task is None
+
+# --- FAILURES ---
+
+def test_failures_are_remembered_on_disk(recordings):
+    done = record(recordings, "notes", "1_a")
+    failed = record(recordings, "notes", "2_b")
+    todo = record(recordings, "notes", "3_c")
+    refine._result_path(done).write_text("{}")
+    refine._failed_path(failed).write_text("model not found")
+
+    # A new worker (a restart) skips both the refined and the failed recording
+    w = worker()
+    assert w.pending() == [todo]
+    assert w.describe()["failed"] == 1
+
+# --- RETENTION ---
+
+def test_old_finished_recordings_are_deleted(recordings):
+    old_done = record(recordings, "notes", "1_a", age_days=40)
+    old_failed = record(recordings, "notes", "2_b", age_days=40)
+    old_pending = record(recordings, "notes", "3_c", age_days=40)
+    new_done = record(recordings, "notes", "4_d")
+    for path in (old_done, new_done):
+        refine._result_path(path).write_text("{}")
+    refine._failed_path(old_failed).write_text("error")
+
+    assert worker(retention_days=30).prune() == 2
+    assert not old_done.exists() and not refine._result_path(old_done).exists()
+    assert not old_failed.exists() and not refine._failed_path(old_failed).exists()
+    assert old_pending.exists() and new_done.exists()
+
+
+def test_the_size_cap_drops_the_oldest_recordings(recordings):
+    oldest = record(recordings, "a", "1_a", size=600_000, age_days=3)
+    middle = record(recordings, "b", "2_b", size=600_000, age_days=2)
+    newest = record(recordings, "a", "3_c", size=600_000, age_days=1)
+
+    assert worker(max_recordings_mb=1.5).prune() == 1
+    assert not oldest.exists()
+    assert middle.exists() and newest.exists()
+
+# --- SHUTDOWN ---
+
+def test_shutdown_does_not_record_the_stopped_job_as_failed(recordings, monkeypatch):
+    recording = record(recordings, "notes", "1_a")
+
+    async def run():
+        w = worker()
+        # Stand-in for the refinement process: runs until terminated
+        real_exec = asyncio.create_subprocess_exec
+
+        async def sleeper(*args, **kwargs):
+            kwargs.pop("preexec_fn", None)
+            return await real_exec("sleep", "30", **kwargs)
+
+        monkeypatch.setattr(asyncio, "create_subprocess_exec", sleeper)
+        w._job = asyncio.create_task(w._refine(recording))
+        while w._proc is None:
+            await asyncio.sleep(0.01)
+        await w.shutdown()
+        await asyncio.sleep(0)
+        return w
+
+    w = asyncio.run(run())
+    assert w.failed() == []
+    assert w.pending() == [recording]
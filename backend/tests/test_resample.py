@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from audio_pipeline.resample import InputFormat, PCMNormalizer, StreamingResampler, make_normalizer
+from audio_pipeline.vad import SAMPLE_RATE
+
+
+def tone(freq, rate, seconds=1.0, amplitude=0.5):
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def peak_frequency(x, rate):
+    spectrum = np.abs(np.fft.rfft(x * np.hanning(x.size)))
+    return np.fft.rfftfreq(x.size, 1 / rate)[np.argmax(spectrum)]
+
+
+def rms(x):
+    return float(np.sqrt(np.mean(x ** 2)))
+
+# --- HANDSHAKE ---
+
+def test_input_format_from_query():
+    fmt = InputFormat.from_query({"rate": "48000", "format": "f32", "channels": "2"})
+    assert (fmt.rate, fmt.format, fmt.channels) == (48000, "f32", 2)
+    assert fmt.frame_bytes == 8
+    assert not fmt.is_native
+
+
+@pytest.mark.parametrize("params", [
+    {"rate": "4000"}, {"format": "u8"}, {"channels": "0"}, {"rate": "fast"},
+])
+def test_unsupported_input_formats_fall_back_to_native(params):
+    assert InputFormat.from_query(params).is_native
+
+
+def test_native_input_needs_no_normalizer():
+    assert make_normalizer(InputFormat()) is None
+
+# --- RESAMPLING ---
+
+@pytest.mark.parametrize("rate_in", [48000, 44100, 22050, 8000])
+def test_resampler_keeps_length_and_pitch(rate_in):
+    out = StreamingResampler(rate_in).process(tone(440, rate_in))
+    assert abs(out.size - SAMPLE_RATE) <= 1
+    assert abs(peak_frequency(out, SAMPLE_RATE) - 440) < 2
+
+
+def test_chunked_input_matches_one_shot():
+    x = tone(440, 48000) + tone(3000, 48000, amplitude=0.2)
+    whole = StreamingResampler(48000).process(x)
+
+    resampler = StreamingResampler(48000)
+    rng = np.random.default_rng(0)
+    cuts = np.sort(rng.integers(0, x.size, 20))
+    pieces = [resampler.process(chunk) for chunk in np.split(x, cuts)]
+    np.testing.assert_allclose(np.concatenate(pieces), whole, atol=1e-5)
+
+
+def test_frequencies_above_the_new_nyquist_are_filtered():
+    passed = StreamingResampler(48000).process(tone(1000, 48000))
+    aliased = StreamingResampler(48000).process(tone(12000, 48000))
+    # Skip the filter's warm-up
+    assert rms(aliased[1000:]) < 0.01 * rms(passed[1000:])
+
+
+def test_same_rate_is_a_pass_through():
+    x = tone(440, SAMPLE_RATE)
+    assert StreamingResampler(SAMPLE_RATE).process(x) is x
+
+# --- NORMALISATION ---
+
+def test_normalizer_downmixes_and_scales_int16():
+    left = (tone(440, 48000) * 32767).astype(np.int16)
+    stereo = np.stack([left, left], axis=1).astype("<i2")
+    out = PCMNormalizer(InputFormat(rate=48000, format="s16", channels=2)).process(stereo.tobytes())
+
+    assert abs(out.size - SAMPLE_RATE) <= 1
+    assert abs(rms(out[1000:-1000]) - 0.5 / np.sqrt(2)) < 0.01
+
+
+def test_normalizer_carries_partial_frames_between_chunks():
+    fmt = InputFormat(rate=48000, format="f32", channels=2)
+    data = np.stack([tone(440, 48000), tone(660, 48000)], axis=1).astype("<f4").tobytes()
+    whole = PCMNormalizer(fmt).process(data)
+
+    normalizer = PCMNormalizer(fmt)
+    pieces = [normalizer.process(data[i:i + 1001]) for i in range(0, len(data), 1001)]
+    np.testing.assert_allclose(np.concatenate(pieces), whole, atol=1e-5)
@@ -0,0 +1,132 @@
+import time
+
+import pytest
+
+from search_index import SearchIndex, block_text
+from storage import JSONStorage
+
+
+def paragraph(block_id, text):
+    return {"id": block_id, "type": "paragraph", "content": [{"type": "text", "text": text}]}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / "search.db"))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "context").mkdir()
+    return JSONStorage(str(tmp_path / "docs"), str(tmp_path / "context"))
+
+
+def hits(index, query, **kwargs):
+    return [(r["doc_id"], r["block_id"], r["source"]) for r in index.search(query, **kwargs)]
+
+
+def test_block_text_walks_nested_content():
+    block = {
+        "id": "t", "type": "table",
+        "content": {"rows": [{"cells": [[{"type": "text", "text": "cell"}]]}]},
+        "children": [paragraph("c", "child")],
+    }
+    assert block_text(block) == "cell child"
+
+
+def test_match_expression():
+    assert SearchIndex.match_expression("Photo-synthesis ch") == '"photo" "synthesis" "ch"'
+    assert SearchIndex.match_expression("cell membr") == '"cell" "membr"*'
+    assert SearchIndex.match_expression("  ?! ") is None
+
+# --- INCREMENTAL UPDATES ---
+
+def test_blocks_and_contexts_are_searchable(index):
+    index.index_blocks("bio", [paragraph("b1", "The mitochondria is the powerhouse"), paragraph("b2", "Ribosomes")])
+    index.index_context("bio", {"h1": {"heading": "Cells", "notes": "Compiled notes on mitochondria"}})
+
+    assert set(hits(index, "mitochondria")) == {("bio", "b1", "block"), ("bio", "h1", "context")}
+    assert "**mitochondria**" in index.search("powerhouse mitochondria")[0]["snippet"]
+    assert hits(index, "mitoch") and not hits(index, "mi")  # Prefixes from MIN_PREFIX_CHARS letters
+
+
+def test_a_patch_only_rewrites_the_touched_blocks(index):
+    blocks = [paragraph("b1", "alpha"), paragraph("b2", "beta")]
+    index.index_blocks("nb", blocks)
+
+    blocks = [paragraph("b1", "alpha"), paragraph("b2", "gamma"), paragraph("b3", "delta")]
+    index.index_blocks("nb", blocks, touched={"b2", "b3"})
+    assert hits(index, "beta") == []
+    assert hits(index, "gamma") == [("nb", "b2", "block")]
+    assert hits(index, "delta") == [("nb", "b3", "block")]
+
+    # A deleted block is touched but no longer in the list
+    index.index_blocks("nb", [paragraph("b1", "alpha")], touched={"b2", "b3"})
+    assert hits(index, "gamma") == [] and hits(index, "alpha") == [("nb", "b1", "block")]
+
+
+def test_a_full_save_drops_missing_blocks(index):
+    index.index_blocks("nb", [paragraph("b1", "alpha"), paragraph("b2", "beta")])
+    index.index_blocks("nb", [paragraph("b2", "beta")])
+    assert hits(index, "alpha") == []
+    assert index.stats()["entries"] == 1
+
+
+def test_search_within_one_notebook(index):
+    index.index_blocks("first", [paragraph("b1", "entropy")])
+    index.index_blocks("second", [paragraph("b1", "entropy")])
+    assert hits(index, "entropy", doc_id="second") == [("second", "b1", "block")]
+    assert len(hits(index, "entropy", limit=1)) == 1
+
+
+def test_rename_and_delete(index):
+    index.index_blocks("old", [paragraph("b1", "entropy")])
+    index.rename("old", "new")
+    assert hits(index, "entropy") == [("new", "b1", "block")]
+    index.delete("new")
+    assert hits(index, "entropy") == []
+    assert index.stats()["notebooks"] == 0
+
+# --- REINDEX ---
+
+def test_reindex_reads_only_changed_notebooks(index, storage):
+    storage.save_blocks("first", [paragraph("b1", "entropy")], 1)
+    storage.save_blocks("second", [paragraph("b1", "enthalpy")], 1)
+    storage.save_context("second", {"h1": {"notes": "gibbs"}})
+
+    assert index.reindex(storage) == 2
+    assert hits(index, "gibbs") == [("second", "h1", "context")]
+    assert index.reindex(storage) == 0
+
+    time.sleep(0.01)
+    storage.save_blocks("first", [paragraph("b1", "kinetics")], 2)
+    assert index.reindex(storage) == 1
+    assert hits(index, "entropy") == [] and hits(index, "kinetics") == [("first", "b1", "block")]
+    assert index.reindex(storage, full=True) == 2
+
+
+def test_reindex_drops_deleted_notebooks(index, storage):
+    storage.save_blocks("gone", [paragraph("b1", "entropy")], 1)
+    index.reindex(storage)
+    storage.delete("gone")
+    index.reindex(storage)
+    assert hits(index, "entropy") == []
+
+
+def test_reindex_never_overwrites_a_newer_save(index):
+    read_at = time.time()
+    index.index_blocks("nb", [paragraph("b1", "saved while the reindex was reading")])
+    index.index_blocks("nb", [paragraph("b1", "stale")], as_of=read_at)
+    assert hits(index, "stale") == []
+    assert hits(index, "reindex") == [("nb", "b1", "block")]
+
+
+def test_background_reindex(index, storage):
+    storage.save_blocks("nb", [paragraph("b1", "entropy")], 1)
+    assert index.start_reindex(storage)
+    index._reindex_thread.join(5)
+    assert index.stats()["reindexed"] == 1
+    assert hits(index, "entropy") == [("nb", "b1", "block")]
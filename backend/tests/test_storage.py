@@ -0,0 +1,326 @@
+import os
+import json
+
+import pytest
+
+from storage import CATALOG_FILE, MIN_POSITION_GAP, JSONStorage, SQLiteStorage, apply_ops, migrate, open_storage
+
+
+def block(block_id, text=""):
+    return {"id": block_id, "type": "paragraph", "content": [{"type": "text", "text": text}]}
+
+
+def ids(blocks):
+    return [b["id"] for b in blocks]
+
+# --- BLOCK PATCHES ---
+
+def test_apply_ops_insert_update_delete_move():
+    blocks = [block("a"), block("b"), block("c")]
+    result = apply_ops(blocks, [
+        {"op": "insert", "block": block("x"), "after": "a"},
+        {"op": "update", "block": block("b", "edited")},
+        {"op": "delete", "id": "c"},
+        {"op": "move", "id": "a", "after": "b"},
+    ])
+    assert ids(result) == ["x", "b", "a"]
+    assert result[1]["content"][0]["text"] == "edited"
+    assert ids(blocks) == ["a", "b", "c"]  # The input is untouched
+
+
+def test_apply_ops_insert_at_top():
+    assert ids(apply_ops([block("a")], [{"op": "insert", "block": block("x"), "after": None}])) == ["x", "a"]
+
+
+def test_apply_ops_is_idempotent():
+    ops = [
+        {"op": "insert", "block": block("x", "new"), "after": "b"},
+        {"op": "update", "block": block("b", "edited")},
+        {"op": "move", "id": "c", "after": None},
+        {"op": "delete", "id": "a"},
+    ]
+    once = apply_ops([block("a"), block("b"), block("c")], ops)
+    assert apply_ops(once, ops) == once
+
+
+def test_apply_ops_missing_targets_are_no_ops():
+    blocks = [block("a")]
+    assert apply_ops(blocks, [
+        {"op": "update", "block": block("zz")},
+        {"op": "delete", "id": "zz"},
+        {"op": "move", "id": "zz", "after": "a"},
+    ]) == blocks
+
+
+def test_apply_ops_insert_of_existing_id_replaces_it():
+    result = apply_ops([block("a"), block("b")], [{"op": "insert", "block": block("a", "moved"), "after": "b"}])
+    assert ids(result) == ["b", "a"]
+    assert result[1]["content"][0]["text"] == "moved"
+
+
+@pytest.mark.parametrize("op", [
+    {"op": "rename", "id": "a"},
+    {"op": "insert", "block": {"type": "paragraph"}},
+    {"op": "delete"},
+    {"op": "move", "id": "a", "after": "missing"},
+])
+def test_apply_ops_rejects_malformed_ops(op):
+    with pytest.raises(ValueError):
+        apply_ops([block("a")], [op])
+
+# --- JSON BACKEND JOURNAL ---
+
+@pytest.fixture
+def json_storage(tmp_path):
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "context").mkdir()
+    return JSONStorage(str(tmp_path / "docs"), str(tmp_path / "context"))
+
+
+def test_journal_replays_patches_over_the_file(json_storage):
+    blocks = [block("a"), block("b")]
+    json_storage.save_blocks("nb", blocks, 1)
+    ops = [{"op": "insert", "block": block("c"), "after": "b"}]
+    json_storage.append_patch("nb", 2, ops, apply_ops(blocks, ops))
+
+    loaded, version = json_storage.load_blocks("nb")
+    assert ids(loaded) == ["a", "b", "c"]
+    assert version == 2
+
+
+def test_journal_replay_over_a_compacted_file_converges(json_storage):
+    # A crash between folding the journal into the file and resetting it replays ops the file already has
+    ops = [{"op": "insert", "block": block("c"), "after": "b"}, {"op": "delete", "id": "a"}]
+    result = apply_ops([block("a"), block("b")], ops)
+    json_storage.save_blocks("nb", result, 1)
+    with open(json_storage._journal_path("nb"), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"version": 2, "ops": ops}) + "\n")
+
+    loaded, version = json_storage.load_blocks("nb")
+    assert loaded == result
+    assert version == 2
+
+
+def test_journal_ignores_a_torn_tail(json_storage):
+    json_storage.save_blocks("nb", [block("a")], 1)
+    with open(json_storage._journal_path("nb"), "a", encoding="utf-8") as f:
+        f.write('{"version": 2, "ops": [{"op": "del')
+
+    loaded, version = json_storage.load_blocks("nb")
+    assert ids(loaded) == ["a"]
+    assert version == 1
+
+# --- SQLITE BACKEND ---
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "notebooks.db"))
+    yield storage
+    storage.close()
+
+
+def positions(storage, name):
+    with storage._lock:
+        return storage._conn.execute(
+            "SELECT block_id, position FROM blocks WHERE doc_id = ? ORDER BY position", (name,)
+        ).fetchall()
+
+
+def patch(storage, name, blocks, version, ops):
+    blocks = apply_ops(blocks, ops)
+    storage.append_patch(name, version, ops, blocks)
+    return blocks
+
+
+def test_sqlite_insert_goes_between_its_neighbours(sqlite_storage):
+    blocks = [block("a"), block("b"), block("c")]
+    sqlite_storage.save_blocks("nb", blocks, 1)
+    blocks = patch(sqlite_storage, "nb", blocks, 2, [{"op": "insert", "block": block("x"), "after": "a"}])
+
+    assert positions(sqlite_storage, "nb") == [("a", 0.0), ("x", 0.5), ("b", 1.0), ("c", 2.0)]
+    loaded, version = sqlite_storage.load_blocks("nb")
+    assert loaded == blocks
+    assert version == 2
+
+
+def test_sqlite_patches_match_apply_ops(sqlite_storage):
+    blocks = [block(i) for i in "abcde"]
+    sqlite_storage.save_blocks("nb", blocks, 1)
+    for version, ops in enumerate([
+        [{"op": "move", "id": "e", "after": None}, {"op": "insert", "block": block("x"), "after": "e"}],
+        [{"op": "delete", "id": "c"}, {"op": "update", "block": block("b", "edited")}],
+        [{"op": "insert", "block": block("y"), "after": "d"}, {"op": "move", "id": "a", "after": "y"}],
+    ], start=2):
+        blocks = patch(sqlite_storage, "nb", blocks, version, ops)
+        assert sqlite_storage.load_blocks("nb") == (blocks, version)
+
+
+def test_sqlite_renumbers_when_positions_run_out(sqlite_storage):
+    blocks = [block("a"), block("b")]
+    sqlite_storage.save_blocks("nb", blocks, 1)
+    # Every insert lands right after "a", halving the gap each time
+    for n in range(40):
+        blocks = patch(sqlite_storage, "nb", blocks, n + 2, [{"op": "insert", "block": block(f"x{n}"), "after": "a"}])
+
+    assert sqlite_storage.load_blocks("nb")[0] == blocks
+    stored = [position for _, position in positions(sqlite_storage, "nb")]
+    assert all(later - earlier >= MIN_POSITION_GAP for earlier, later in zip(stored, stored[1:]))
+
+
+def test_sqlite_catalog_bytes_follow_each_patch(sqlite_storage):
+    def stored_bytes():
+        with sqlite_storage._lock:
+            return sqlite_storage._conn.execute("SELECT SUM(LENGTH(body)) FROM blocks WHERE doc_id = 'nb'").fetchone()[0]
+
+    blocks = [block("a", "alpha"), block("b", "beta")]
+    sqlite_storage.save_blocks("nb", blocks, 1)
+    for version, ops in enumerate([
+        [{"op": "insert", "block": block("c", "gamma" * 20), "after": "a"}],
+        [{"op": "update", "block": block("a", "a")}],
+        [{"op": "move", "id": "b", "after": None}, {"op": "delete", "id": "c"}],
+        [{"op": "insert", "block": block("b", "replaced"), "after": "a"}],
+    ], start=2):
+        blocks = patch(sqlite_storage, "nb", blocks, version, ops)
+        assert sqlite_storage.catalog()[1][0]["bytes"] == stored_bytes()
+
+
+def test_sqlite_context_rows(sqlite_storage):
+    sqlite_storage.save_blocks("nb", [block("h1")], 1)
+    paragraphs = {"h1": {"notes": "one"}, "h2": {"notes": "two"}}
+    sqlite_storage.save_context("nb", paragraphs)
+    paragraphs["h2"]["notes"] = "changed"
+    sqlite_storage.save_context("nb", paragraphs, {"h2"})
+    assert sqlite_storage.load_context("nb") == paragraphs
+
+    del paragraphs["h1"]
+    sqlite_storage.save_context("nb", paragraphs, {"h1"})
+    assert list(sqlite_storage.load_context("nb")) == ["h2"]
+
+# --- MIGRATION ---
+
+def test_migrate_copies_every_notebook(json_storage, sqlite_storage):
+    blocks = [block("a"), block("b")]
+    json_storage.save_blocks("first", blocks, 3)
+    ops = [{"op": "insert", "block": block("c"), "after": "a"}]
+    json_storage.append_patch("first", 4, ops, apply_ops(blocks, ops))
+    json_storage.save_context("first", {"a": {"notes": "alpha"}})
+    json_storage.save_blocks("second", [block("z")], 1)
+
+    assert migrate(json_storage, sqlite_storage) == 2
+    assert sqlite_storage.list_documents() == ["first", "second"]
+    assert sqlite_storage.load_blocks("first") == json_storage.load_blocks("first")
+    assert sqlite_storage.load_context("first") == {"a": {"notes": "alpha"}}
+    assert sqlite_storage.load_blocks("second") == ([block("z")], 1)
+
+
+def test_open_storage_migrates_once(tmp_path, json_storage):
+    json_storage.save_blocks("nb", [block("a")], 1)
+    db_path = str(tmp_path / "notebooks.db")
+
+    storage = open_storage("sqlite", json_storage.docs_dir, json_storage.context_dir, db_path)
+    storage.delete("nb")
+    storage.close()
+
+    # Already migrated: the JSON files are not copied in again
+    storage = open_storage("sqlite", json_storage.docs_dir, json_storage.context_dir, db_path)
+    assert storage.list_documents() == []
+    storage.close()
+
+# --- NOTEBOOK CATALOG ---
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "json":
+        (tmp_path / "docs").mkdir()
+        (tmp_path / "context").mkdir()
+        storage = JSONStorage(str(tmp_path / "docs"), str(tmp_path / "context"))
+    else:
+        storage = SQLiteStorage(str(tmp_path / "notebooks.db"))
+    yield storage
+    storage.close()
+
+
+def catalog_ids(storage, **kwargs):
+    return [entry["id"] for entry in storage.catalog(**kwargs)[1]]
+
+
+def test_catalog_sorts_and_pages(storage):
+    storage.save_blocks("b_notes", [block("a", "x" * 50)], 1)
+    storage.save_blocks("a_notes", [block("a", "x" * 500)], 1)
+    storage.save_blocks("c_notes", [block("a")], 1)
+    storage.save_context("c_notes", {"p1": {}, "p2": {}, "p3": {}})
+    storage.save_context("b_notes", {"p1": {}})
+
+    assert catalog_ids(storage) == ["a_notes", "b_notes", "c_notes"]
+    assert catalog_ids(storage, descending=True) == ["c_notes", "b_notes", "a_notes"]
+    assert catalog_ids(storage, sort="bytes") == ["c_notes", "b_notes", "a_notes"]
+    assert catalog_ids(storage, sort="paragraphs", descending=True) == ["c_notes", "b_notes", "a_notes"]
+    assert catalog_ids(storage, sort="mtime", descending=True)[0] == "c_notes"
+
+    total, page = storage.catalog(offset=1, limit=1)
+    assert total == 3
+    assert [entry["id"] for entry in page] == ["b_notes"]
+    assert page[0]["name"] == "B Notes"
+    assert catalog_ids(storage, offset=2, limit=5) == ["c_notes"]
+
+
+def test_catalog_ties_break_by_id(storage):
+    for name in ("c", "a", "b"):
+        storage.save_blocks(name, [block("x")], 1)
+    assert catalog_ids(storage, sort="paragraphs") == ["a", "b", "c"]
+    assert catalog_ids(storage, sort="paragraphs", descending=True) == ["c", "b", "a"]
+
+
+def test_catalog_follows_rename_and_delete(storage):
+    storage.save_blocks("old", [block("a")], 1)
+    storage.save_blocks("gone", [block("a")], 1)
+    storage.mark_compiled("old", 100.0)
+
+    assert storage.rename("old", "new_name")
+    storage.delete("gone")
+    total, page = storage.catalog()
+    assert total == 1
+    assert (page[0]["id"], page[0]["name"], page[0]["compiled_at"]) == ("new_name", "New Name", 100.0)
+
+
+def test_never_compiled_notebooks_sort_as_oldest(storage):
+    for name in ("early", "late", "never"):
+        storage.save_blocks(name, [block("a")], 1)
+    storage.mark_compiled("late", 200.0)
+    storage.mark_compiled("early", 100.0)
+
+    assert catalog_ids(storage, sort="compiled_at") == ["never", "early", "late"]
+    assert catalog_ids(storage, sort="compiled_at", descending=True) == ["late", "early", "never"]
+
+
+def test_json_catalog_recovers_from_a_stale_snapshot(json_storage):
+    json_storage.save_blocks("kept", [block("a")], 1)
+    json_storage.save_blocks("dropped", [block("a")], 1)
+    json_storage.mark_compiled("kept", 100.0)
+    json_storage.close()
+
+    # Written after the snapshot (the next one is not due yet), then a crash: a new instance re-reads what changed
+    json_storage.save_blocks("added", [block("a")], 1)
+    json_storage.save_context("kept", {"p1": {}, "p2": {}})
+    os.remove(json_storage._doc_path("dropped"))
+
+    reopened = JSONStorage(json_storage.docs_dir, json_storage.context_dir)
+    entries = {entry["id"]: entry for entry in reopened.catalog()[1]}
+    assert sorted(entries) == ["added", "kept"]
+    assert entries["kept"]["paragraphs"] == 2
+    assert entries["kept"]["compiled_at"] == 100.0
+
+
+def test_json_catalog_rebuilds_without_a_snapshot(json_storage):
+    json_storage.save_blocks("nb", [block("a")], 1)
+    json_storage.save_context("nb", {"p1": {}})
+    json_storage.close()
+    os.remove(os.path.join(json_storage.context_dir, CATALOG_FILE))
+
+    reopened = JSONStorage(json_storage.docs_dir, json_storage.context_dir)
+    total, [entry] = reopened.catalog()
+    assert total == 1
+    assert (entry["id"], entry["paragraphs"], entry["compiled_at"]) == ("nb", 1, None)
+    # The UI file plus its journal
+    paths = (json_storage._doc_path("nb"), json_storage._journal_path("nb"))
+    assert entry["bytes"] == sum(os.path.getsize(p) for p in paths)
@@ -167,6 +167,7 @@ function App() {
       <AudioStreamer
         isSessionActive={isSessionActive}
         audioSource={audioSource}
+        docId={currentDocId.replace(".json", "")}
       />
     </>
   );
@@ -3,17 +3,31 @@ import { useEffect, useRef } from "react";
 interface AudioStreamerProps {
   isSessionActive: boolean;
   audioSource: "mic" | "system";
+  docId: string;
 }
 
-function AudioStreamer({ isSessionActive, audioSource }: AudioStreamerProps) {
+// Compressed framing (~24 kbit/s instead of 256 for raw PCM), decoded by the server
+const OPUS_MIME = "audio/webm;codecs=opus";
+const supportsOpus = () =>
+  typeof MediaRecorder !== "undefined" && MediaRecorder.isTypeSupported(OPUS_MIME);
+
+function AudioStreamer({
+  isSessionActive,
+  audioSource,
+  docId,
+}: AudioStreamerProps) {
   const socketRef = useRef<WebSocket | null>(null);
   const streamRef = useRef<MediaStream | null>(null);
   const audioContextRef = useRef<AudioContext | null>(null);
   const processorRef = useRef<ScriptProcessorNode | null>(null);
+  const recorderRef = useRef<MediaRecorder | null>(null);
 
   useEffect(() => {
     // If the session is turned OFF, aggressively shut down the PCM pipeline
     if (!isSessionActive) {
+      if (recorderRef.current && recorderRef.current.state !== "inactive") {
+        recorderRef.current.stop();
+      }
       if (processorRef.current) {
         processorRef.current.disconnect();
       }
@@ -38,9 +52,27 @@ function AudioStreamer({ isSessionActive, audioSource }: AudioStreamerProps) {
     const startStreaming = async () => {
       try {
         // 1. Open the WebSocket to FastAPI
-        const ws = new WebSocket("ws://localhost:8000/api/ws/audio");
+        // The PCM fallback runs at the device's native rate (Safari ignores a 16 kHz request anyway);
+        // the handshake declares it and the server resamples
+        const AudioContextClass =
+          window.AudioContext || (window as any).webkitAudioContext;
+        const audioContext = new AudioContextClass();
+        audioContextRef.current = audioContext;
+
+        // The doc_id lets the server keep a timestamped transcript log for this notebook
+        const codecParam = supportsOpus() ? "&codec=webm-opus" : "";
+        const formatParam = `&rate=${audioContext.sampleRate}&format=f32&channels=1`;
+        const ws = new WebSocket(
+          `ws://localhost:8000/api/ws/audio?doc_id=${encodeURIComponent(docId)}${codecParam}${formatParam}`,
+        );
         socketRef.current = ws;
 
+        // The server's first message confirms the wire format ("pcm16" is the fallback)
+        let resolveCodec: (codec: string) => void;
+        const negotiated = new Promise<string>((resolve) => {
+          resolveCodec = resolve;
+        });
+
         ws.onopen = () => console.log("🎤 WebSocket Connected");
         ws.onclose = (e) =>
           console.log(
@@ -51,9 +83,14 @@ function AudioStreamer({ isSessionActive, audioSource }: AudioStreamerProps) {
         // 2. Listen for text coming BACK from Python and broadcast it
         ws.onmessage = (event) => {
           const data = JSON.parse(event.data);
+          if (data.codec) {
+            resolveCodec(data.codec);
+          }
           if (data.text) {
             window.dispatchEvent(
-              new CustomEvent("injectAudio", { detail: data.text }),
+              new CustomEvent("injectAudio", {
+                detail: { text: data.text, ref: data.offset },
+              }),
             );
           }
         };
@@ -85,12 +122,27 @@ function AudioStreamer({ isSessionActive, audioSource }: AudioStreamerProps) {
         const audioTrack = stream.getAudioTracks()[0];
         const audioOnlyStream = new MediaStream([audioTrack]);
 
-        // 4. Create the Raw PCM Audio Context (with Safari Fallback)
-        const AudioContextClass =
-          window.AudioContext || (window as any).webkitAudioContext;
-        const audioContext = new AudioContextClass({ sampleRate: 16000 });
-        audioContextRef.current = audioContext;
+        const codec = await negotiated;
+        if (!isMounted) return;
 
+        // 4a. Compressed path: the browser encodes, the server decodes and resamples
+        if (codec === "webm-opus") {
+          const recorder = new MediaRecorder(audioOnlyStream, {
+            mimeType: OPUS_MIME,
+            audioBitsPerSecond: 24000,
+          });
+          recorderRef.current = recorder;
+          recorder.ondataavailable = (e) => {
+            if (e.data.size > 0 && ws.readyState === WebSocket.OPEN) {
+              ws.send(e.data);
+            }
+          };
+          recorder.start(250); // One WebM cluster every 250 ms
+          audioContext.close();
+          return;
+        }
+
+        // 4b. Raw PCM path (native-rate Float32)
         // Force the browser to wake up the audio context!
         if (audioContext.state === "suspended") {
           await audioContext.resume();
@@ -106,14 +158,9 @@ function AudioStreamer({ isSessionActive, audioSource }: AudioStreamerProps) {
 
         processor.onaudioprocess = (e) => {
           if (ws.readyState === WebSocket.OPEN) {
-            const float32Array = e.inputBuffer.getChannelData(0);
-            const int16Array = new Int16Array(float32Array.length);
-
-            for (let i = 0; i < float32Array.length; i++) {
-              let s = Math.max(-1, Math.min(1, float32Array[i]));
-              int16Array[i] = s < 0 ? s * 0x8000 : s * 0x7fff;
-            }
-            ws.send(int16Array.buffer);
+            // Sent as-is: conversion and resampling happen server-side. Copied, since the
+            // browser reuses the input buffer.
+            ws.send(e.inputBuffer.getChannelData(0).slice().buffer);
           }
         };
 
@@ -134,6 +181,9 @@ function AudioStreamer({ isSessionActive, audioSource }: AudioStreamerProps) {
     // Cleanup function when component unmounts or session toggles off
     return () => {
       isMounted = false;
+      if (recorderRef.current && recorderRef.current.state !== "inactive") {
+        recorderRef.current.stop();
+      }
       if (processorRef.current) processorRef.current.disconnect();
       if (
         audioContextRef.current &&
@@ -144,7 +194,7 @@ function AudioStreamer({ isSessionActive, audioSource }: AudioStreamerProps) {
       streamRef.current?.getTracks().forEach((track) => track.stop());
       socketRef.current?.close();
     };
-  }, [isSessionActive, audioSource]);
+  }, [isSessionActive, audioSource, docId]);
 
   return null;
 }
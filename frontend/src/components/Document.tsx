@@ -29,6 +29,9 @@ interface DocumentProps {
   onDelete: () => void;
 }
 
+// CSS width images are requested at in the notebook column (times devicePixelRatio)
+const NOTE_IMAGE_WIDTH = 720;
+
 const schema = BlockNoteSchema.create({
   blockSpecs: {
     ...defaultBlockSpecs,
@@ -41,30 +44,109 @@ const schema = BlockNoteSchema.create({
 });
 
 /* HELPER FUNCTIONS */
-async function fetchDocContent(docId: string): Promise<string> {
+async function fetchDocContent(
+  docId: string,
+): Promise<{ content: string; version: number }> {
   const res = await fetch(
     `http://localhost:8000/api/docs/${encodeURIComponent(docId)}`,
   );
   if (!res.ok) throw new Error(`404 Failed to load doc: ${docId}`);
-  const data: { docId: string; content: string } = await res.json();
-  return data.content;
+  const data: { docId: string; content: string; version: number } =
+    await res.json();
+  return { content: data.content, version: data.version };
+}
+
+// What the server last stored: each top-level block's JSON by id, their order, and the version
+interface SavedDoc {
+  blocks: Map<string, string>;
+  order: string[];
+  version: number;
+}
+
+type BlockOp =
+  | { op: "insert"; block: any; after: string | null }
+  | { op: "update"; block: any }
+  | { op: "delete"; id: string }
+  | { op: "move"; id: string; after: string | null };
+
+function snapshotBlocks(blocks: any[], version: number): SavedDoc {
+  return {
+    blocks: new Map(blocks.map((b) => [b.id, JSON.stringify(b)])),
+    order: blocks.map((b) => b.id),
+    version,
+  };
+}
+
+// Block-level edits that turn the saved document into `next` (applied in order by the server)
+function diffBlocks(saved: SavedDoc, next: SavedDoc, nextBlocks: any[]): BlockOp[] {
+  const ops: BlockOp[] = [];
+  const order = saved.order.filter((id) => {
+    if (next.blocks.has(id)) return true;
+    ops.push({ op: "delete", id });
+    return false;
+  });
+
+  // Invariant: after step i, order[0..i] matches next.order[0..i]
+  nextBlocks.forEach((block, i) => {
+    const after = i > 0 ? next.order[i - 1] : null;
+    const json = next.blocks.get(block.id);
+    const previous = saved.blocks.get(block.id);
+    if (previous === undefined) {
+      order.splice(i, 0, block.id);
+      ops.push({ op: "insert", block, after });
+      return;
+    }
+    if (previous !== json) ops.push({ op: "update", block });
+    const index = order.indexOf(block.id, i);
+    if (index !== i) {
+      order.splice(index, 1);
+      order.splice(i, 0, block.id);
+      ops.push({ op: "move", id: block.id, after });
+    }
+  });
+  return ops;
 }
 
+// Sends only the changed blocks; falls back to the whole document when the patch
+// would not be much smaller, or when the server has moved on (409)
 async function saveDocContent(
   docId: string,
-  content: string,
+  blocks: any[],
+  saved: SavedDoc | null,
   signal?: AbortSignal,
-) {
-  const res = await fetch(
-    `http://localhost:8000/api/docs/${encodeURIComponent(docId)}`,
-    {
-      method: "PUT",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ content }),
-      signal,
-    },
-  );
+): Promise<SavedDoc> {
+  const url = `http://localhost:8000/api/docs/${encodeURIComponent(docId)}`;
+  const content = JSON.stringify(blocks);
+  const next = snapshotBlocks(blocks, saved?.version ?? 0);
+
+  if (saved) {
+    const ops = diffBlocks(saved, next, blocks);
+    if (ops.length === 0) return saved;
+    const body = JSON.stringify({ base_version: saved.version, ops });
+    if (body.length < content.length / 2) {
+      const res = await fetch(url, {
+        method: "PATCH",
+        headers: { "Content-Type": "application/json" },
+        body,
+        signal,
+      });
+      if (res.ok) {
+        next.version = (await res.json()).version;
+        return next;
+      }
+      if (res.status !== 409) throw new Error(`Failed to save doc: ${docId}`);
+    }
+  }
+
+  const res = await fetch(url, {
+    method: "PUT",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ content }),
+    signal,
+  });
   if (!res.ok) throw new Error(`Failed to save doc: ${docId}`);
+  next.version = (await res.json()).version;
+  return next;
 }
 
 // LATEX PARSER: Scans LLM text and separates math from normal paragraphs
@@ -339,6 +421,7 @@ function Document({
   const [rewriteInput, setRewriteInput] = useState<string>("");
 
   const saveAbortRef = useRef<AbortController | null>(null);
+  const savedDocRef = useRef<SavedDoc | null>(null); // Base for the next block patch
   const debounceTimerRef = useRef<number | null>(null);
   const containerRef = useRef<HTMLDivElement>(null); // Reference to the main container so we can calculate relative coordinates for the yellow dots
 
@@ -351,6 +434,7 @@ function Document({
         contentSnapshot: string;
         blocksPayload: any[];
         audioContext: string[];
+        audioRefs?: number[]; // Server transcript log offsets, parallel to audioContext
         ocrContext: string[];
         timeoutId?: number;
       }
@@ -384,17 +468,30 @@ function Document({
       return data.url; // Returns the clean URL to the image!
     };
 
+    // Display-only: the stored URL stays clean, the backend picks a variant at least this wide
+    const resolveFileUrl = async (url: string) => {
+      if (!url.startsWith("http://localhost:8000/imgs/") || url.includes("?")) {
+        return url;
+      }
+      const width = Math.round(NOTE_IMAGE_WIDTH * (window.devicePixelRatio || 1));
+      return `${url}?w=${width}`;
+    };
+
     async function loadInitialData() {
       try {
         setError("");
-        const rawData = await fetchDocContent(docId);
+        const { content: rawData, version } = await fetchDocContent(docId);
 
         if (!isMounted) return;
 
         let initialBlocks = undefined;
+        savedDocRef.current = null;
         if (rawData) {
           try {
             const parsed = JSON.parse(rawData);
+            if (Array.isArray(parsed)) {
+              savedDocRef.current = snapshotBlocks(parsed, version);
+            }
             if (Array.isArray(parsed) && parsed.length > 0) {
               initialBlocks = parsed;
             }
@@ -410,6 +507,7 @@ function Document({
           initialContent: initialBlocks,
           schema: schema,
           uploadFile: uploadFile,
+          resolveFileUrl: resolveFileUrl,
         });
 
         // PRE-LOAD THE REGISTER TO PREVENT SPAMMING THE LLM
@@ -448,6 +546,7 @@ function Document({
           const emptyEditor = BlockNoteEditor.create({
             schema: schema,
             uploadFile: uploadFile, // <-- Added here!
+            resolveFileUrl: resolveFileUrl,
           });
           setEditor(emptyEditor);
         } else {
@@ -657,8 +756,12 @@ function Document({
     const handleInjectAudio = (e: any) => {
       // 💡 FIX: We bypass helper functions completely to avoid scope/hoisting crashes!
       const activeId = activeHeadingRef.current;
-      if (sectionRegister.current[activeId]) {
-        sectionRegister.current[activeId].audioContext.push(e.detail);
+      const entry = sectionRegister.current[activeId];
+      if (entry) {
+        entry.audioContext.push(e.detail.text);
+        if (e.detail.ref !== undefined) {
+          entry.audioRefs = [...(entry.audioRefs || []), e.detail.ref];
+        }
         console.log(`🎤 Injected audio into: ${activeId}`);
       }
     };
@@ -694,10 +797,17 @@ function Document({
       })
       .join("\n\n");
 
+    // If every audio chunk is in the server's transcript log, send references instead of the text
+    const audioRefs = registerEntry.audioRefs || [];
+    const useRefs =
+      audioRefs.length > 0 &&
+      audioRefs.length === registerEntry.audioContext.length;
+
     const payload = {
       doc_id: docname,
       par_id: headingId,
-      audio: registerEntry.audioContext.join(" "),
+      audio: useRefs ? "" : registerEntry.audioContext.join(" "),
+      audio_refs: useRefs ? audioRefs : [],
       ocr:
         registerEntry.ocrContext.length > 0
           ? `[PDF PAGE CONTENT]: ${registerEntry.ocrContext.join(" \n ")}`
@@ -757,10 +867,20 @@ function Document({
           delete updated[headingId];
           return updated;
         });
+      } else if (data.status === "conflict") {
+        // The section changed while it was being compiled: keep its sources queued for the next pass
+        console.warn(`[CONFLICT] ${headingId}: ${data.message}`);
+        registerEntry.status = "draft";
+        if (editor)
+          editor.updateBlock(headingId, {
+            props: { backgroundColor: "default" },
+          });
+        return;
       }
 
       // Clear multimodal queues
       registerEntry.audioContext = [];
+      registerEntry.audioRefs = [];
       registerEntry.ocrContext = [];
     } catch (error) {
       console.error("LLM Process Error:", error);
@@ -835,6 +955,13 @@ function Document({
             2000,
           );
         }
+      } else if (data.status === "conflict") {
+        console.warn(`[CONFLICT] ${headingId}: ${data.message}`);
+        sectionRegister.current[headingId].status = "draft";
+        if (editor)
+          editor.updateBlock(headingId, {
+            props: { backgroundColor: "default" },
+          });
       }
     } catch (error) {
       console.error("LLM Resume Error:", error);
@@ -893,6 +1020,12 @@ function Document({
             2000,
           );
         }
+      } else if (data.status === "conflict") {
+        console.warn(`[CONFLICT] ${headingId}: ${data.message}`);
+        if (editor)
+          editor.updateBlock(headingId, {
+            props: { backgroundColor: "default" },
+          });
       }
     } catch (error) {
       console.error("LLM Rewrite Error:", error);
@@ -1040,6 +1173,7 @@ function Document({
             contentSnapshot: currentContentStr,
             blocksPayload: bucket.blocks,
             audioContext: registerEntry?.audioContext || [],
+            audioRefs: registerEntry?.audioRefs,
             ocrContext: registerEntry?.ocrContext || [],
           };
           return; // Skip so it doesn't become a draft
@@ -1090,6 +1224,7 @@ function Document({
           contentSnapshot: currentContentStr,
           blocksPayload: bucket.blocks,
           audioContext: existingAudio,
+          audioRefs: registerEntry?.audioRefs,
           ocrContext: existingOcr,
           timeoutId: registerEntry?.timeoutId, // Keep it, manageTimers will handle it!
         };
@@ -1106,12 +1241,15 @@ function Document({
       const saveAc = new AbortController();
       saveAbortRef.current = saveAc;
       try {
-        await saveDocContent(
+        savedDocRef.current = await saveDocContent(
           docId,
-          JSON.stringify(editor.document),
+          editor.document,
+          savedDocRef.current,
           saveAc.signal,
         );
       } catch (err) {
+        // The server may or may not have applied it: the next save sends the whole document
+        if (!saveAc.signal.aborted) savedDocRef.current = null;
         console.error("Autosave failed:", err);
       }
     }, 1000);
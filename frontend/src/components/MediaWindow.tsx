@@ -41,6 +41,25 @@ function MediaWindow({ onToggleExpand }: MediaWindowProps) {
     setPageInputValue(String(currentPage));
   }, [currentPage]);
 
+  // The page on screen comes first: pull it on demand if the stream has not reached it yet
+  useEffect(() => {
+    if (!sessionId || extractedPages[String(currentPage)] !== undefined) return;
+    let cancelled = false;
+    fetch(
+      `http://localhost:8000/api/media/extract/${sessionId}/pages/${currentPage}`,
+    )
+      .then((res) => (res.ok ? res.json() : null))
+      .then((data) => {
+        if (!cancelled && data) {
+          setExtractedPages((prev) => ({ ...prev, [String(data.page)]: data.text }));
+        }
+      })
+      .catch((e) => console.error("Failed to fetch page", e));
+    return () => {
+      cancelled = true;
+    };
+  }, [sessionId, currentPage]);
+
   // Listen for the document telling us a new paragraph started!
   useEffect(() => {
     const handleReset = () => {
@@ -110,20 +129,47 @@ function MediaWindow({ onToggleExpand }: MediaWindowProps) {
       formData.append("file", file);
 
       try {
-        const res = await fetch("http://localhost:8000/api/media/extract", {
-          method: "POST",
-          body: formData,
-        });
-        const data = await res.json();
-
-        if (data.status === "completed") {
-          setSessionId(data.session_id);
-          setExtractedPages(data.pages);
-          setTotalPages(data.total_pages);
-          setCurrentPage(1);
-          setPdfFile(file);
-          onToggleExpand(true);
+        // NDJSON stream: the deck opens on the first record, pages fill in as they are extracted
+        const res = await fetch(
+          "http://localhost:8000/api/media/extract/stream?first_page=1",
+          { method: "POST", body: formData },
+        );
+        if (!res.body) throw new Error("Empty extraction response");
+
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = "";
+
+        const handleRecord = (record: any) => {
+          if (record.type === "meta") {
+            setSessionId(record.session_id);
+            setTotalPages(record.total_pages);
+            setExtractedPages({});
+            setCurrentPage(1);
+            setPdfFile(file);
+            onToggleExpand(true);
+            setIsExtracting(false);
+          } else if (record.type === "page") {
+            setExtractedPages((prev) => ({
+              ...prev,
+              [String(record.page)]: record.text,
+            }));
+          } else if (record.type === "done") {
+            console.log(`📄 PDF extraction finished in ${record.ms} ms`);
+          } else if (record.type === "error" || record.status === "error") {
+            console.error("Extraction error:", record.message);
+          }
+        };
+
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffered += decoder.decode(value, { stream: true });
+          const lines = buffered.split("\n");
+          buffered = lines.pop() ?? "";
+          lines.filter((l) => l.trim()).forEach((l) => handleRecord(JSON.parse(l)));
         }
+        if (buffered.trim()) handleRecord(JSON.parse(buffered));
       } catch (err) {
         console.error("Extraction failed", err);
         alert("Failed to extract PDF text.");
@@ -1,8 +1,33 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 
 interface DocItem {
   id: string;
   name: string;
+  mtime?: number;
+  bytes?: number;
+  paragraphs?: number;
+  compiled_at?: number | null;
+}
+
+// The catalog is served in pages; the next one loads when the list is scrolled near its end
+const PAGE_SIZE = 100;
+
+function formatSize(bytes: number) {
+  if (bytes < 1024) return `${bytes} B`;
+  if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(1)} KB`;
+  return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+}
+
+function describeDoc(doc: DocItem) {
+  if (doc.mtime === undefined) return doc.name;
+  const parts = [
+    `${formatSize(doc.bytes ?? 0)}, ${doc.paragraphs ?? 0} sections`,
+    `Edited ${new Date(doc.mtime * 1000).toLocaleString()}`,
+  ];
+  if (doc.compiled_at) {
+    parts.push(`Compiled ${new Date(doc.compiled_at * 1000).toLocaleString()}`);
+  }
+  return parts.join("\n");
 }
 
 interface SidebarProps {
@@ -12,25 +37,51 @@ interface SidebarProps {
 
 function Sidebar({ currentDocId, onSelectDocument }: SidebarProps) {
   const [docs, setDocs] = useState<DocItem[]>([]);
+  const [total, setTotal] = useState<number>(0);
   const [error, setError] = useState<string>("");
+  const loadingRef = useRef<boolean>(false);
+  // Items received from the server so far: the next page's offset. Not docs.length, since notebooks
+  // created here are listed at once, before the server page they sort into
+  const serverOffsetRef = useRef<number>(0);
   const [isExpanded, setIsExpanded] = useState<boolean>(true);
 
   // New state for renaming
   const [editingId, setEditingId] = useState<string | null>(null);
   const [editName, setEditName] = useState<string>("");
 
-  useEffect(() => {
-    async function fetchDocList() {
-      try {
-        const res = await fetch("http://localhost:8000/api/docs");
-        if (!res.ok) throw new Error("Failed to load document list");
-
-        const data = await res.json();
-        setDocs(data);
-      } catch (err) {
-        setError("Could not connect to backend.");
-      }
+  async function fetchDocPage(offset: number) {
+    loadingRef.current = true;
+    try {
+      const res = await fetch(
+        `http://localhost:8000/api/docs?sort=name&offset=${offset}&limit=${PAGE_SIZE}`,
+      );
+      if (!res.ok) throw new Error("Failed to load document list");
+
+      const data = await res.json();
+      serverOffsetRef.current = offset + data.items.length;
+      setTotal(data.total);
+      setDocs((prev) => {
+        if (offset === 0) return data.items;
+        const listed = new Set(prev.map((doc) => doc.id));
+        return [...prev, ...data.items.filter((doc: DocItem) => !listed.has(doc.id))];
+      });
+    } catch (err) {
+      setError("Could not connect to backend.");
+    } finally {
+      loadingRef.current = false;
     }
+  }
+
+  const handleListScroll = (e: React.UIEvent<HTMLUListElement>) => {
+    const list = e.currentTarget;
+    const nearEnd = list.scrollTop + list.clientHeight >= list.scrollHeight - 200;
+    if (nearEnd && !loadingRef.current && serverOffsetRef.current < total) {
+      fetchDocPage(serverOffsetRef.current);
+    }
+  };
+
+  useEffect(() => {
+    const fetchDocList = () => fetchDocPage(0);
 
     fetchDocList();
 
@@ -55,6 +106,7 @@ function Sidebar({ currentDocId, onSelectDocument }: SidebarProps) {
 
       // 2. ONLY AFTER it exists on the hard drive, update the visual sidebar
       setDocs((prev) => [...prev, { id: newId, name: newName }]);
+      setTotal((prev) => prev + 1);
       onSelectDocument(newId);
     } catch (err) {
       alert("Error creating new document.");
@@ -100,7 +152,7 @@ function Sidebar({ currentDocId, onSelectDocument }: SidebarProps) {
       // 1. Update the sidebar list with the new name and ID
       setDocs((prev) =>
         prev.map((doc) =>
-          doc.id === oldId ? { id: newId, name: editName } : doc,
+          doc.id === oldId ? { ...doc, id: newId, name: editName } : doc,
         ),
       );
 
@@ -166,7 +218,7 @@ function Sidebar({ currentDocId, onSelectDocument }: SidebarProps) {
       <div className="sidebar-collapsible-content">
         {error && <div className="sidebar-error">{error}</div>}
 
-        <ul className="doc-list">
+        <ul className="doc-list" onScroll={handleListScroll}>
           {docs.map((doc) => (
             <li key={doc.id} className="doc-item-wrapper">
               {editingId === doc.id ? (
@@ -188,6 +240,7 @@ function Sidebar({ currentDocId, onSelectDocument }: SidebarProps) {
                   <button
                     className="doc-item-button"
                     onClick={() => onSelectDocument(doc.id)}
+                    title={describeDoc(doc)}
                   >
                     📄 {doc.name}
                   </button>